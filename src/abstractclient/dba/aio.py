@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+from .bulk import BulkStats, Row
+from .transaction import Transaction, FetchStrategy, FetchAll, FetchOne, FetchNone, DBMap, FETCH_ARRAYSIZE, \
+    make_model_class, pretty_log, union_exception
+
+
+class ConnectionWorker:
+    """
+    Поток транзакции. Все операции с подключением в рамках транзакции выполняются в одном потоке
+    """
+
+    def __init__(self, name: str):
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Выполнить функцию в потоке подключения
+
+        Args:
+            func: Функция
+
+        Returns:
+            Результат функции
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """
+        Выполнить функцию в потоке подключения, не дожидаясь результата
+
+        Args:
+            func: Функция
+
+        """
+        self.executor.submit(func, *args, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ConnectionWorkers:
+    """
+    Ограниченный набор потоков подключений. Транзакция занимает поток на все время работы
+    """
+
+    def __init__(self, size: int, name: str = "dba"):
+        """
+        Args:
+            size: Кол-во потоков, т.е. одновременно открытых транзакций
+            name: Префикс имени потоков
+
+        """
+        if size < 1:
+            raise ValueError("Кол-во потоков подключений к БД должно быть больше 0")
+
+        self.size = size
+        self.__workers: List[ConnectionWorker] = [ConnectionWorker(f"{name}-{index}") for index in range(size)]
+        self.__free: Optional[asyncio.Queue] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __queue(self) -> asyncio.Queue:
+        # Очередь привязана к циклу событий, поэтому создается в том цикле, в котором используется
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            self.__loop = loop
+            self.__free = asyncio.Queue()
+            for worker in self.__workers:
+                self.__free.put_nowait(worker)
+        return self.__free
+
+    async def acquire(self) -> ConnectionWorker:
+        """
+        Дождаться свободного потока
+
+        Returns:
+            ConnectionWorker
+        """
+        return await self.__queue().get()
+
+    def release(self, worker: ConnectionWorker):
+        """
+        Вернуть поток
+
+        Args:
+            worker: Поток подключения
+
+        """
+        self.__queue().put_nowait(worker)
+
+    @property
+    def workers(self) -> List[ConnectionWorker]:
+        return list(self.__workers)
+
+    def shutdown(self):
+        for worker in self.__workers:
+            worker.shutdown()
+
+
+class AsyncTransaction:
+    """
+    Транзакция для asyncio. Операции синхронной Transaction выполняются в потоке подключения
+    """
+    ONE = Transaction.ONE
+    NOTHING = Transaction.NOTHING
+    MANY = Transaction.MANY
+    ITER = Transaction.ITER
+    TUPLES = Transaction.TUPLES
+    RECORDS = Transaction.RECORDS
+    COLUMNS = Transaction.COLUMNS
+
+    def __init__(self, transaction: Transaction, worker: ConnectionWorker):
+        self.transaction = transaction
+        self.worker = worker
+
+    @property
+    def auto(self) -> bool:
+        return self.transaction.auto
+
+    def __result(self, result: Any, fetch: Type[FetchStrategy]) -> Any:
+        return self.__iterate(result) if fetch.lazy else result
+
+    async def __iterate(self, rows: Iterator[DBMap]) -> AsyncIterator[DBMap]:
+        """
+        Перебор потоковой выборки: строки забираются из потока подключения блоками
+        """
+        try:
+            while True:
+                chunk: List[DBMap] = await self.worker.run(lambda: list(islice(rows, FETCH_ARRAYSIZE)))
+                if not chunk:
+                    return
+                for row in chunk:
+                    yield row
+        finally:
+            await self.worker.run(rows.close)
+
+    async def callproc(self, statement: str, params: Optional[Union[Iterable, Dict]] = None,
+                       fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        """
+        Call a stored database procedure with the given name (see Transaction.callproc)
+        """
+        return self.__result(await self.worker.run(self.transaction.callproc, statement, params, fetch), fetch)
+
+    async def execute(self, statement: str, params: Optional[Union[Iterable, Dict]] = None,
+                      fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        """
+        Prepare and execute a database operation (see Transaction.execute).
+        For lazy fetch modes (Transaction.ITER) returns an async iterator
+        """
+        return self.__result(await self.worker.run(self.transaction.execute, statement, params, fetch), fetch)
+
+    async def executemany(self, statement: str, params: Union[Iterable[Dict], Iterable[Iterable]],
+                          fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        """
+        Execute a database operation against all parameter sequences (see Transaction.executemany)
+        """
+        return self.__result(await self.worker.run(self.transaction.executemany, statement, params, fetch), fetch)
+
+    async def bulk(self, statement: str, rows: Iterable[Row], batch_size: int = 1000,
+                   commit_every: Optional[int] = None,
+                   progress: Optional[Callable[[BulkStats], None]] = None) -> BulkStats:
+        """
+        Execute a database operation against rows of a stream in batches (see Transaction.bulk).
+        progress is called in the connection thread
+        """
+        return await self.worker.run(self.transaction.bulk, statement, rows, batch_size, commit_every, progress)
+
+    async def commit(self):
+        await self.worker.run(self.transaction.commit)
+
+    async def rollback(self):
+        await self.worker.run(self.transaction.rollback)
+
+
+class BufferedCursor:
+    """
+    Курсор над строками, уже полученными асинхронным драйвером. Позволяет применить к ним стратегии выборки
+    """
+
+    def __init__(self, description: Any, rows: List[Any]):
+        self.description = description
+        self.arraysize: int = 1
+        self.__rows: Iterator[Any] = iter(rows)
+
+    def fetchone(self) -> Any:
+        return next(self.__rows, None)
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        return list(islice(self.__rows, size or self.arraysize))
+
+    def fetchall(self) -> List[Any]:
+        return list(self.__rows)
+
+    def close(self):
+        pass
+
+
+class NativeAsyncTransaction:
+    """
+    Транзакция асинхронного драйвера с DB-API подобным интерфейсом (aiosqlite, aioodbc): методы подключения
+    и курсора являются корутинами
+    """
+    ONE = Transaction.ONE
+    NOTHING = Transaction.NOTHING
+    MANY = Transaction.MANY
+    ITER = Transaction.ITER
+    TUPLES = Transaction.TUPLES
+    RECORDS = Transaction.RECORDS
+    COLUMNS = Transaction.COLUMNS
+
+    def __init__(self, con: Any, auto: bool = False):
+        self._con = con
+        self.auto: bool = auto
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.__streams: Dict[int, Tuple[Any, AsyncIterator[DBMap]]] = dict()
+
+    async def __run(self, method: str, statement: str, params: Any, fetch: Type[FetchStrategy]) -> Any:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.log(logging.DEBUG, f"\nRunning SQL query:\n{statement}\n")
+
+        cursor = await self._con.cursor()
+        try:
+            await getattr(cursor, method)(statement, params or ())
+        except Exception as e:
+            await cursor.close()
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+
+        if fetch.lazy:
+            rows: AsyncIterator[DBMap] = self.__stream(cursor)
+            self.__streams[id(cursor)] = (cursor, rows)
+            return rows
+        return await self.__fetch(cursor, fetch)
+
+    async def __fetch(self, cursor: Any, fetch: Type[FetchStrategy]) -> Any:
+        try:
+            if issubclass(fetch, FetchNone):
+                rows: List[Any] = []
+            elif issubclass(fetch, FetchOne):
+                row: Any = await cursor.fetchone()
+                rows = [row] if row else []
+            else:
+                rows = await cursor.fetchall()
+            res: Any = fetch(BufferedCursor(cursor.description, rows)).execute()
+        except Exception as e:
+            if self.auto:
+                await self._con.rollback()
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+        finally:
+            await cursor.close()
+
+        if self.auto:
+            await self._con.commit()
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.log(logging.DEBUG, pretty_log(res))
+
+        return res
+
+    async def __stream(self, cursor: Any) -> AsyncIterator[DBMap]:
+        exhausted: bool = False
+        try:
+            cls = None
+            while True:
+                rows: List[Any] = await cursor.fetchmany(FETCH_ARRAYSIZE)
+                if not rows:
+                    break
+                if cls is None:
+                    cls = make_model_class(cursor.description)
+                for row in rows:
+                    yield cls(*row)
+            exhausted = True
+        except Exception as e:
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+        finally:
+            # Перебор, прерванный потребителем (aclose или сборщик мусора), не фиксируется
+            await self.__close_stream(cursor, exhausted)
+
+    async def __close_stream(self, cursor: Any, exhausted: bool):
+        # Поток, уже закрытый при завершении транзакции, повторно не закрывается
+        if self.__streams.pop(id(cursor), None) is None:
+            return
+        await cursor.close()
+        if self.auto:
+            if exhausted:
+                await self._con.commit()
+            else:
+                await self._con.rollback()
+
+    async def close_streams(self):
+        """
+        Закрыть незавершенные потоковые выборки: курсоры закрываются, при auto=True транзакция откатывается.
+        Вызывается DAO при завершении транзакции
+        """
+        for cursor, rows in list(self.__streams.values()):
+            # Генератор, перебор которого начат, закрывает курсор сам. Не начатый генератор закрывается здесь
+            await rows.aclose()
+            await self.__close_stream(cursor, exhausted=False)
+
+    async def callproc(self, statement: str, params: Optional[Union[Iterable, Dict]] = None,
+                       fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        return await self.__run("callproc", statement, params, fetch)
+
+    async def execute(self, statement: str, params: Optional[Union[Iterable, Dict]] = None,
+                      fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        return await self.__run("execute", statement, params, fetch)
+
+    async def executemany(self, statement: str, params: Union[Iterable[Dict], Iterable[Iterable]],
+                          fetch: Type[FetchStrategy] = FetchAll) -> Any:
+        return await self.__run("executemany", statement, params, fetch)
+
+    async def commit(self):
+        await self._con.commit()
+
+    async def rollback(self):
+        await self._con.rollback()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import re
+from itertools import islice
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Union
+
+from .cursor import AbstractCursor
+
+Row = Union[Iterable, Dict]
+BulkWriter = Callable[[AbstractCursor, str, List[Row]], None]
+
+# Запрос вида INSERT ... VALUES %s, который psycopg2 может выполнить одним многострочным VALUES
+VALUES_PLACEHOLDER = re.compile(r"\bvalues\s*%s", re.IGNORECASE)
+
+
+@dataclass()
+class BulkStats:
+    """
+    Ход массовой записи
+    """
+    rows: int = 0
+    batches: int = 0
+    commits: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def batches(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    """
+    Разбивает поток строк на пакеты, не считывая поток целиком
+
+    Args:
+        rows: строки
+        size: размер пакета
+
+    Returns:
+        Iterator[List[Row]]
+    """
+    if size < 1:
+        raise ValueError("Размер пакета записи должен быть больше 0")
+
+    iterator: Iterator[Row] = iter(rows)
+    while True:
+        batch: List[Row] = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_executemany(cursor: AbstractCursor, statement: str, batch: List[Row]):
+    """
+    Запись пакета через executemany. Для cx_Oracle это array DML: пакет передается на сервер за одно обращение
+    """
+    cursor.executemany(statement, batch)
+
+
+def write_psycopg2(cursor: AbstractCursor, statement: str, batch: List[Row]):
+    """
+    Запись пакета через многострочный VALUES psycopg2, если запрос записан в виде INSERT ... VALUES %s.
+    executemany psycopg2 выполняет запрос отдельно для каждой строки
+    """
+    if not VALUES_PLACEHOLDER.search(statement):
+        cursor.executemany(statement, batch)
+        return
+
+    from psycopg2.extras import execute_values
+    execute_values(cursor, statement, batch, page_size=len(batch))
+
+
+# Способы записи пакета по модулю драйвера, которому принадлежит курсор
+BULK_WRITERS: Dict[str, BulkWriter] = {
+    "psycopg2": write_psycopg2,
+}
+
+
+def bulk_writer(cursor: Any) -> BulkWriter:
+    """
+    Способ записи пакета для драйвера курсора
+
+    Args:
+        cursor: курсор
+
+    Returns:
+        BulkWriter
+    """
+    return BULK_WRITERS.get(type(cursor).__module__.split(".", 1)[0], write_executemany)
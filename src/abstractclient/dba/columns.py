@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from array import array
+from decimal import Decimal
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Типы колонок: целые и вещественные числа хранятся в array.array, даты, строки и точные числа (Decimal) - в списках
+INTEGER: str = "q"
+FLOAT: str = "d"
+DATE: str = "date"
+DECIMAL: str = "decimal"
+
+Column = Union[array, List[Any]]
+
+
+def column_typecode(column: Sequence, decimal_as_float: bool = False) -> Optional[str]:
+    """
+    Тип буфера колонки по описанию курсора (cursor.description)
+
+    Драйверы описывают тип по-разному: fdb - классом значения (int, Decimal, datetime), cx_Oracle - объектом типа
+    с именем (DB_TYPE_NUMBER), поэтому проверяются оба варианта
+
+    Колонки Decimal (NUMERIC, DECIMAL с дробной частью) по умолчанию хранятся в списке без потери точности.
+    В array.array('d') они переводятся только при decimal_as_float=True
+
+    Args:
+        column: описание колонки
+        decimal_as_float: хранить значения Decimal как float
+
+    Returns:
+        INTEGER, FLOAT, DATE, DECIMAL или None, если значения колонки хранятся в списке
+    """
+    type_code: Any = column[1]
+    scale: Optional[int] = column[5] if len(column) > 5 else None
+
+    if isinstance(type_code, type):
+        if issubclass(type_code, bool):
+            return None
+        if issubclass(type_code, int):
+            return INTEGER
+        if issubclass(type_code, float):
+            return FLOAT
+        if issubclass(type_code, Decimal):
+            return FLOAT if decimal_as_float else DECIMAL
+        if issubclass(type_code, date):
+            return DATE
+        return None
+
+    name: str = str(getattr(type_code, "name", type_code) or "").upper()
+    if "DATE" in name or "TIMESTAMP" in name:
+        return DATE
+    if any(key in name for key in ("FLOAT", "DOUBLE", "REAL")):
+        return FLOAT
+    if "INTEGER" in name or scale == 0 and any(key in name for key in ("NUMBER", "NUMERIC", "DECIMAL")):
+        return INTEGER
+    # cx_Oracle возвращает NUMBER с дробной частью как float, остальные драйверы NUMERIC и DECIMAL - как Decimal
+    if "NUMBER" in name:
+        return FLOAT
+    if "NUMERIC" in name or "DECIMAL" in name:
+        return FLOAT if decimal_as_float else DECIMAL
+    return None
+
+
+class ColumnBuffer:
+    """
+    Буфер значений одной колонки
+    """
+
+    def __init__(self, typecode: Optional[str]):
+        self.typecode = typecode
+        self.values: Column = array(typecode) if typecode in (INTEGER, FLOAT) else []
+
+    def extend(self, values: Iterable[Any]):
+        """
+        Добавить значения колонки из блока строк. Если значение нельзя поместить в массив (NULL, переполнение),
+        колонка переводится в список
+
+        Args:
+            values: значения колонки
+
+        """
+        if isinstance(self.values, list):
+            self.values.extend(values)
+            return
+
+        size: int = len(self.values)
+        values = tuple(values)
+        try:
+            self.values.extend(values)
+        except (TypeError, OverflowError):
+            # array.extend успевает добавить значения до ошибочного
+            del self.values[size:]
+            self.values = self.values.tolist()
+            self.values.extend(values)
+
+    def to_numpy(self) -> Any:
+        """
+        Значения колонки в виде массива numpy. Строки остаются списком
+
+        Returns:
+            numpy.ndarray или list
+        """
+        if isinstance(self.values, array):
+            return numpy.frombuffer(self.values, dtype=self.values.typecode)
+        if self.typecode == DATE:
+            return numpy.array(self.values, dtype="datetime64[us]")
+        if self.typecode in (INTEGER, FLOAT):
+            # Колонка с NULL: пропуски становятся NaN
+            return numpy.array([float("nan") if value is None else value for value in self.values], dtype=float)
+        return self.values
+
+
+def fill_columns(cursor: Any, size: int, decimal_as_float: bool = False) -> Dict[str, ColumnBuffer]:
+    """
+    Считывает курсор блоками fetchmany в буферы колонок
+
+    Args:
+        cursor: курсор после выполнения запроса
+        size: кол-во строк в блоке
+        decimal_as_float: хранить значения Decimal в array.array('d') как float
+
+    Returns:
+        Буферы колонок по именам в нижнем регистре
+    """
+    if not cursor.description:
+        return {}
+
+    buffers: List[ColumnBuffer] = [ColumnBuffer(column_typecode(column, decimal_as_float)) for column in cursor.description]
+    while True:
+        rows: List[Any] = cursor.fetchmany(size)
+        if not rows:
+            break
+        for buffer, values in zip(buffers, zip(*rows)):
+            buffer.extend(values)
+
+    return {column[0].lower(): buffer for column, buffer in zip(cursor.description, buffers)}
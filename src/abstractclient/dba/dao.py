@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
 from abc import ABC
-from contextlib import contextmanager
-from typing import Generator, Any
+from functools import partial
+from contextlib import contextmanager, asynccontextmanager
+from typing import Generator, AsyncGenerator, Any, Optional, Sequence, Tuple, Union
 
 from .connection import AbstractConnection
-from .pool import AbstractConnectionPool
+from .pool import AbstractConnectionPool, AbstractAsyncConnectionPool
 from .transaction import Transaction
+from .replicas import ReplicaRouter, BALANCING_LEAST_LOADED
+from .aio import ConnectionWorker, ConnectionWorkers, AsyncTransaction, NativeAsyncTransaction
 
 
 class AbstractDAO(ABC):
@@ -14,24 +18,158 @@ class AbstractDAO(ABC):
     Abstract data access object
     """
 
-    def __init__(self, pool: AbstractConnectionPool):
+    def __init__(self, pool: AbstractConnectionPool, replicas: Optional[Sequence[AbstractConnectionPool]] = None,
+                 balancing: str = BALANCING_LEAST_LOADED, failure_backoff: float = 30):
+        """
+        Args:
+            pool: Пул подключений основной базы
+            replicas: Пулы подключений реплик для транзакций только на чтение
+            balancing: Стратегия выбора реплики: least_loaded или round_robin
+            failure_backoff: Время исключения недоступной реплики, сек.
+
+        """
         self._pool: AbstractConnectionPool = pool
         self.logger: logging.Logger = logging.getLogger(__name__)
+        self._replicas: Optional[ReplicaRouter] = None
+        if replicas:
+            self._replicas = ReplicaRouter(replicas, balancing, failure_backoff)
+
+    def _checkout(self, readonly: bool) -> Tuple[AbstractConnectionPool, AbstractConnection]:
+        if readonly and self._replicas is not None:
+            replica: Optional[Tuple[AbstractConnectionPool, AbstractConnection]] = self._replicas.acquire()
+            if replica is not None:
+                return replica
+            self.logger.debug("Реплики недоступны, транзакция только на чтение выполняется на основной базе")
+        return self._pool, self._pool.acquire()
 
     @contextmanager
-    def acquire(self, auto: bool = False) -> Generator[Transaction, Any, Any]:
+    def acquire(self, auto: bool = False, readonly: bool = False) -> Generator[Transaction, Any, Any]:
         """
         Стартует новую транзакцию и помещает ее в пул транзакций
 
         Args:
              auto (bool): Если True - автоматический commit или rollback
+             readonly (bool): Если True - транзакция выполняется на реплике, если они заданы и доступны,
+                иначе на основной базе
 
         Returns:
              Открытая транзакция
 
         """
-        con: AbstractConnection = self._pool.acquire()
+        pool, con = self._checkout(readonly)
+        tr: Optional[Transaction] = None
         try:
-            yield Transaction(con, auto)
+            tr = Transaction(con, auto, pool.statements(con))
+            yield tr
         finally:
-            self._pool.release(con)
+            try:
+                # Курсоры не дочитанных потоковых выборок не должны остаться на подключении, возвращаемом в пул
+                if tr is not None:
+                    tr.close_streams()
+            finally:
+                pool.release(con)
+
+    def dispose(self):
+        """
+        Закрыть пулы подключений основной базы и реплик
+        """
+        self._pool.dispose()
+        if self._replicas is not None:
+            self._replicas.dispose()
+
+
+class AbstractAsyncDAO(ABC):
+    """
+    Abstract data access object for asyncio
+    """
+
+    def __init__(self, pool: Union[AbstractConnectionPool, AbstractAsyncConnectionPool], workers: Optional[int] = None):
+        """
+        Args:
+            pool: Пул подключений асинхронного драйвера или синхронный пул. Операции синхронного драйвера
+                выполняются в отдельных потоках. Подключение берется из пула на время транзакции, поэтому
+                драйвер должен допускать поочередную работу с подключением из разных потоков
+                (для sqlite3 - check_same_thread=False)
+            workers: Кол-во потоков подключений для синхронного пула, по умолчанию - размер пула
+
+        """
+        self._pool: Union[AbstractConnectionPool, AbstractAsyncConnectionPool] = pool
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self._workers: Optional[ConnectionWorkers] = None
+        if not isinstance(pool, AbstractAsyncConnectionPool):
+            self._workers = ConnectionWorkers(workers or getattr(pool, "size", 5))
+
+    @property
+    def native(self) -> bool:
+        """
+        Используется асинхронный драйвер
+        """
+        return self._workers is None
+
+    @asynccontextmanager
+    async def acquire(
+            self,
+            auto: bool = False
+    ) -> AsyncGenerator[Union[AsyncTransaction, NativeAsyncTransaction], Any]:
+        """
+        Стартует новую транзакцию
+
+        Args:
+             auto (bool): Если True - автоматический commit или rollback
+
+        Returns:
+             Открытая транзакция
+
+        """
+        if self.native:
+            con: Any = await self._pool.acquire()
+            native: Optional[NativeAsyncTransaction] = None
+            try:
+                native = NativeAsyncTransaction(con, auto)
+                yield native
+            finally:
+                try:
+                    if native is not None:
+                        await native.close_streams()
+                finally:
+                    await self._pool.release(con)
+            return
+
+        # Подключение берется из пула и возвращается в него в потоке транзакции, поэтому на него
+        # распространяются проверки пула (recycle, idle_timeout, pre_ping) и его метрики
+        worker: ConnectionWorker = await self._workers.acquire()
+        try:
+            acquiring: asyncio.Future = asyncio.ensure_future(worker.run(self._pool.acquire))
+            try:
+                con = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # Отмена не прерывает ожидание подключения в потоке, полученное подключение возвращается в пул
+                acquiring.add_done_callback(partial(self.__release_late, worker))
+                raise
+            tr: Optional[Transaction] = None
+            try:
+                tr = Transaction(con, auto, self._pool.statements(con))
+                yield AsyncTransaction(tr, worker)
+            finally:
+                try:
+                    if tr is not None:
+                        await worker.run(tr.close_streams)
+                finally:
+                    await worker.run(self._pool.release, con)
+        finally:
+            self._workers.release(worker)
+
+    def __release_late(self, worker: ConnectionWorker, acquiring: asyncio.Future):
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            worker.submit(self._pool.release, acquiring.result())
+
+    async def dispose(self):
+        """
+        Закрыть пул подключений и потоки подключений
+        """
+        if self.native:
+            await self._pool.dispose()
+            return
+
+        self._pool.dispose()
+        self._workers.shutdown()
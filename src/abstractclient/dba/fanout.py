@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import logging
+from time import monotonic
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Type, Union
+
+from .dao import AbstractDAO
+from .transaction import FetchStrategy, FetchAll
+
+Params = Optional[Union[Iterable, Dict]]
+Query = Union[str, Tuple[str, Params]]
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass()
+class FanOutResult:
+    """
+    Результат запроса к одной базе
+    """
+    key: str
+    result: Any = None
+    error: Optional[Exception] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def run_query(key: str, dao: AbstractDAO, query: Query, params: Params, fetch: Type[FetchStrategy],
+              auto: bool) -> FanOutResult:
+    """
+    Выполнить запрос в отдельной транзакции
+
+    Args:
+        key: Ключ базы в разделе DATABASE
+        dao: DAO базы
+        query: Запрос или запрос с параметрами
+        params: Параметры запроса, если они не заданы в query
+        fetch: Стратегия выборки
+        auto: Автоматический commit или rollback
+
+    Returns:
+        FanOutResult
+    """
+    statement, params = query if isinstance(query, tuple) else (query, params)
+    start: float = monotonic()
+    try:
+        with dao.acquire(auto) as tr:
+            result: Any = tr.execute(statement, params or (), fetch)
+    except Exception as e:
+        logger.exception(f"Ошибка запроса к базе {key}: {str(e)}")
+        return FanOutResult(key=key, error=e, elapsed=monotonic() - start)
+    return FanOutResult(key=key, result=result, elapsed=monotonic() - start)
+
+
+def fan_out_iter(daos: Mapping[str, AbstractDAO], query: Union[Query, Mapping[str, Query]], params: Params = None,
+                 fetch: Type[FetchStrategy] = FetchAll, keys: Optional[Iterable[str]] = None, auto: bool = False,
+                 workers: Optional[int] = None) -> Iterator[FanOutResult]:
+    """
+    Выполняет запрос одновременно в нескольких базах и выдает результаты по мере их получения
+
+    Args:
+        daos: DAO по ключам раздела DATABASE, например self.database репозитория
+        query: Запрос для всех баз или запросы по ключам баз. Запрос может быть задан вместе с параметрами:
+            (statement, params)
+        params: Параметры запросов, для которых они не заданы в query
+        fetch: Стратегия выборки. Потоковая выборка недоступна, так как транзакция закрывается после запроса
+        keys: Ключи баз, по умолчанию - ключи query, если запросы заданы по базам, иначе все базы
+        auto: Автоматический commit или rollback
+        workers: Кол-во одновременных запросов, по умолчанию - кол-во баз
+
+    Returns:
+        Iterator[FanOutResult]
+    """
+    if fetch.lazy:
+        raise ValueError("Потоковая выборка недоступна для запроса к нескольким базам")
+
+    queries: Dict[str, Query]
+    if isinstance(query, Mapping):
+        queries = {key: query[key] for key in (keys if keys is not None else query)}
+    else:
+        queries = {key: query for key in (keys if keys is not None else daos)}
+
+    unknown: List[str] = [key for key in queries if key not in daos]
+    if unknown:
+        raise ValueError(f"Не найдены настройки баз: {', '.join(unknown)}")
+    if not queries:
+        return
+
+    with ThreadPoolExecutor(max_workers=workers or len(queries), thread_name_prefix="fanout") as executor:
+        futures = [executor.submit(run_query, key, daos[key], item, params, fetch, auto)
+                   for key, item in queries.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def fan_out(daos: Mapping[str, AbstractDAO], query: Union[Query, Mapping[str, Query]], params: Params = None,
+            fetch: Type[FetchStrategy] = FetchAll, keys: Optional[Iterable[str]] = None, auto: bool = False,
+            workers: Optional[int] = None) -> Dict[str, FanOutResult]:
+    """
+    Выполняет запрос одновременно в нескольких базах. Общее время равно времени самого долгого запроса
+
+    Параметры совпадают с fan_out_iter
+
+    Returns:
+        Результаты по ключам баз в порядке запросов
+
+    Example:
+
+        .. code-block:: python
+
+            results = fan_out(self.database, "select code, qty from stock where article = ?", (article,))
+            rows = merge_rows(results.values())
+            failed = [result.key for result in results.values() if not result.ok]
+    """
+    # Ключи нужны дважды: для запросов и для порядка результатов, поэтому генератор считывается один раз
+    keys = list(keys) if keys is not None else None
+    results: Dict[str, FanOutResult] = {result.key: result for result in
+                                        fan_out_iter(daos, query, params, fetch, keys, auto, workers)}
+    order: Iterable[str] = query if isinstance(query, Mapping) and keys is None else (keys or daos)
+    return {key: results[key] for key in order if key in results}
+
+
+def merge_rows(results: Iterable[FanOutResult]) -> List[Tuple[str, Any]]:
+    """
+    Объединяет строки успешных результатов, помечая каждую строку ключом базы
+
+    Args:
+        results: Результаты fan_out или fan_out_iter
+
+    Returns:
+        Список пар (ключ базы, строка)
+    """
+    rows: List[Tuple[str, Any]] = []
+    for item in results:
+        if not item.ok or item.result is None:
+            continue
+        if isinstance(item.result, list):
+            rows.extend((item.key, row) for row in item.result)
+        else:
+            rows.append((item.key, item.result))
+    return rows
@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 import logging
 from abc import ABC, abstractmethod
+from typing import Optional, Any
 
 from .connection import AbstractConnection
+from .statements import StatementCache
 
 
 class AbstractConnectionPool(ABC):
     logger: logging.Logger
 
     @abstractmethod
-    def acquire(self) -> AbstractConnection:
+    def acquire(self, timeout: Optional[float] = None) -> AbstractConnection:
         """
         Acquires the connection from pool
+
+        Args:
+            timeout(float): max time to wait for a free connection, raises TimeoutError when it expires
+
         Returns:
             AbstractConnection
         """
@@ -30,3 +36,42 @@ class AbstractConnectionPool(ABC):
         """
         Dispose pool and free all allocated resources
         """
+
+    def statements(self, connection: AbstractConnection) -> Optional[StatementCache]:
+        """
+        Statement cache of the connection
+
+        Args:
+            connection(AbstractConnection): connection object
+
+        Returns:
+            StatementCache or None if the pool does not cache statements
+        """
+        return None
+
+
+class AbstractAsyncConnectionPool(ABC):
+    logger: logging.Logger
+
+    @abstractmethod
+    async def acquire(self) -> Any:
+        """
+        Acquires the connection of an async driver from pool
+        Returns:
+            Connection
+        """
+
+    @abstractmethod
+    async def release(self, connection: Any) -> None:
+        """
+        Returns the connection to pool
+
+        Args:
+            connection: connection object
+        """
+
+    @abstractmethod
+    async def dispose(self) -> None:
+        """
+        Dispose pool and free all allocated resources
+        """
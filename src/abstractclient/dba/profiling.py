@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import re
+import reprlib
+import logging
+import threading
+from datetime import date, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from ..metrics import Histogram
+from .. import environment
+
+# Запросы дольше порога (сек.) пишутся в журнал медленных запросов. Если порог не задан, журнал отключен
+SLOW_QUERY_THRESHOLD: Optional[float] = environment.get("SLOW_QUERY_THRESHOLD", None)
+# Кол-во различных запросов в реестре. Запросы сверх него учитываются под общим ключом OTHER_STATEMENTS
+MAX_PROFILED_STATEMENTS: int = environment.get("MAX_PROFILED_STATEMENTS", 1000)
+# Кол-во строк, по которым оценивается размер результата
+SIZE_SAMPLE_ROWS: int = 100
+OTHER_STATEMENTS: str = "<other>"
+
+# Параметры запроса логируются с ограничением: для executemany это может быть весь набор записываемых строк
+PARAMS_REPR = reprlib.Repr()
+PARAMS_REPR.maxlist = PARAMS_REPR.maxtuple = PARAMS_REPR.maxdict = 20
+PARAMS_REPR.maxstring = PARAMS_REPR.maxother = 200
+
+slow_logger: logging.Logger = logging.getLogger(f"{__name__}.slow")
+
+COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|(?<![:\w]):\w+")
+VALUE_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=MAX_PROFILED_STATEMENTS)
+def normalize_statement(statement: str) -> str:
+    """
+    Текст запроса без параметров: литералы и плейсхолдеры заменяются на ?, списки значений сворачиваются,
+    комментарии и лишние пробелы удаляются
+
+    Args:
+        statement: текст запроса
+
+    Returns:
+        str
+    """
+    statement = COMMENTS.sub(" ", statement)
+    statement = LITERALS.sub("?", statement)
+    statement = VALUE_LISTS.sub("(...)", statement)
+    return SPACES.sub(" ", statement).strip()
+
+
+def value_size(value: Any) -> int:
+    """
+    Оценка размера значения колонки в байтах
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (bool, int, float, date, time, timedelta)):
+        return 8
+    if isinstance(value, Decimal):
+        return 16
+    return len(str(value))
+
+
+def row_size(row: Any) -> int:
+    """
+    Оценка размера строки результата в байтах
+    """
+    values: Iterable[Any] = row.__dict__.values() if hasattr(row, "__dict__") else row
+    return sum(value_size(value) for value in values)
+
+
+def column_size(column: Any) -> int:
+    """
+    Оценка размера колонки результата выборки по колонкам в байтах
+    """
+    if hasattr(column, "nbytes"):
+        return column.nbytes
+    if hasattr(column, "itemsize"):
+        return column.itemsize * len(column)
+    return sample_size(column, value_size)
+
+
+def sample_size(items: List[Any], size) -> int:
+    """
+    Оценка размера списка по первым SIZE_SAMPLE_ROWS элементам
+    """
+    sample: List[Any] = list(islice(items, SIZE_SAMPLE_ROWS))
+    if not sample:
+        return 0
+    return sum(size(item) for item in sample) * len(items) // len(sample)
+
+
+def result_rows(result: Any) -> int:
+    """
+    Кол-во строк результата выборки
+    """
+    if not result:
+        return 0
+    if isinstance(result, dict):
+        return len(next(iter(result.values())))
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+def result_size(result: Any) -> int:
+    """
+    Оценка размера результата выборки в байтах. Размер списка строк оценивается по первым строкам,
+    поэтому стоимость оценки не зависит от размера результата
+    """
+    if not result:
+        return 0
+    if isinstance(result, dict):
+        return sum(column_size(column) for column in result.values())
+    if isinstance(result, list):
+        return sample_size(result, row_size)
+    return row_size(result)
+
+
+@dataclass()
+class QueryTiming:
+    """
+    Замер выполнения запроса транзакцией
+    """
+    statement: str
+    params: Any = None
+    execute: float = 0.0
+    fetch: float = 0.0
+    rows: int = 0
+    size: int = 0
+    error: bool = False
+
+    @property
+    def elapsed(self) -> float:
+        return self.execute + self.fetch
+
+
+class StatementProfile:
+    """
+    Накопленная статистика запроса
+    """
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.execute: Histogram = Histogram()
+        self.fetch: Histogram = Histogram()
+        self.calls: int = 0
+        self.errors: int = 0
+        self.rows: int = 0
+        self.size: int = 0
+        self.total: float = 0.0
+        self.__lock = threading.Lock()
+
+    def add(self, timing: QueryTiming):
+        self.execute.observe(timing.execute)
+        self.fetch.observe(timing.fetch)
+        with self.__lock:
+            self.calls += 1
+            self.errors += int(timing.error)
+            self.rows += timing.rows
+            self.size += timing.size
+            self.total += timing.elapsed
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.__lock:
+            counters: Dict[str, Any] = dict(statement=self.statement, calls=self.calls, errors=self.errors,
+                                            rows=self.rows, bytes=self.size, total=self.total)
+        counters["execute"] = self.execute.snapshot()
+        counters["fetch"] = self.fetch.snapshot()
+        return counters
+
+
+class StatementRegistry:
+    """
+    Реестр статистики запросов процесса по тексту запроса без параметров
+
+    Запросы дольше slow_threshold секунд пишутся с параметрами в журнал медленных запросов (логгер
+    abstractclient.dba.profiling.slow)
+    """
+
+    def __init__(self, slow_threshold: Optional[float] = SLOW_QUERY_THRESHOLD,
+                 max_statements: int = MAX_PROFILED_STATEMENTS):
+        """
+        Args:
+            slow_threshold: Порог медленного запроса, сек. None - журнал медленных запросов отключен
+            max_statements: Кол-во различных запросов в реестре
+
+        """
+        self.enabled: bool = True
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self.__profiles: Dict[str, StatementProfile] = dict()
+        self.__lock = threading.Lock()
+
+    def __profile(self, key: str) -> StatementProfile:
+        profile: Optional[StatementProfile] = self.__profiles.get(key)
+        if profile is not None:
+            return profile
+        with self.__lock:
+            if key not in self.__profiles and len(self.__profiles) >= self.max_statements:
+                key = OTHER_STATEMENTS
+            return self.__profiles.setdefault(key, StatementProfile(key))
+
+    def record(self, timing: QueryTiming):
+        """
+        Учесть выполнение запроса
+
+        Args:
+            timing: Замер выполнения запроса
+
+        """
+        if not self.enabled:
+            return
+
+        self.__profile(normalize_statement(timing.statement)).add(timing)
+
+        if self.slow_threshold is not None and timing.elapsed >= self.slow_threshold:
+            slow_logger.warning(f"Slow query ({timing.elapsed:.3f}s: execute {timing.execute:.3f}s, "
+                                f"fetch {timing.fetch:.3f}s, {timing.rows} rows, ~{timing.size}b):\n"
+                                f"{timing.statement}\nwith params: {PARAMS_REPR.repr(timing.params)}")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        Статистика всех запросов
+
+        Returns:
+            Список статистик запросов по убыванию общего времени
+        """
+        with self.__lock:
+            profiles: List[StatementProfile] = list(self.__profiles.values())
+        return sorted((profile.snapshot() for profile in profiles), key=lambda item: item["total"], reverse=True)
+
+    def top(self, count: int = 10, key: str = "total") -> List[Dict[str, Any]]:
+        """
+        Запросы, занимающие больше всего времени, строк или байт
+
+        Args:
+            count: Кол-во запросов
+            key: Показатель сортировки: total, calls, errors, rows или bytes
+
+        Returns:
+            List[Dict[str, Any]]
+        """
+        return sorted(self.snapshot(), key=lambda item: item[key], reverse=True)[:count]
+
+    def reset(self):
+        """
+        Очистить реестр
+        """
+        with self.__lock:
+            self.__profiles.clear()
+
+
+# Реестр процесса, в который пишут все транзакции
+PROFILER: StatementRegistry = StatementRegistry()
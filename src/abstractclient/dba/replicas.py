@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from time import monotonic
+from itertools import count
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .connection import AbstractConnection
+from .pool import AbstractConnectionPool
+
+BALANCING_ROUND_ROBIN: str = "round_robin"
+BALANCING_LEAST_LOADED: str = "least_loaded"
+
+
+class ReplicaRouter:
+    """
+    Выбор пула реплики для транзакции только на чтение
+
+    Реплика пропускается, если в ее пуле нет свободного места (подключение не ожидается), и исключается
+    на failure_backoff секунд, если к ней не удалось подключиться. Если ни одна реплика недоступна,
+    транзакция выполняется на основной базе.
+    """
+
+    def __init__(self, pools: Sequence[AbstractConnectionPool], balancing: str = BALANCING_LEAST_LOADED,
+                 failure_backoff: float = 30):
+        """
+        Args:
+            pools: Пулы подключений реплик
+            balancing: Стратегия выбора реплики: least_loaded - с наименьшим кол-вом занятых подключений,
+                round_robin - по очереди
+            failure_backoff: Время исключения недоступной реплики, сек.
+
+        """
+        if balancing not in (BALANCING_ROUND_ROBIN, BALANCING_LEAST_LOADED):
+            raise ValueError(f"Неизвестная стратегия выбора реплики: {balancing}")
+
+        self.pools: List[AbstractConnectionPool] = list(pools)
+        self.balancing = balancing
+        self.failure_backoff = failure_backoff
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.__failed_at: Dict[int, float] = dict()
+        self.__counter = count()
+        self.__lock = threading.Lock()
+
+    def __available(self, index: int) -> bool:
+        failed_at: Optional[float] = self.__failed_at.get(index)
+        return failed_at is None or monotonic() - failed_at > self.failure_backoff
+
+    def ordered(self) -> List[int]:
+        """
+        Индексы доступных реплик в порядке выбора
+
+        Returns:
+            List[int]
+        """
+        indexes: List[int] = [index for index in range(len(self.pools)) if self.__available(index)]
+        if not indexes:
+            return indexes
+        if self.balancing == BALANCING_ROUND_ROBIN:
+            with self.__lock:
+                shift: int = next(self.__counter) % len(indexes)
+            return indexes[shift:] + indexes[:shift]
+        return sorted(indexes, key=lambda index: getattr(self.pools[index], "checkedout", 0))
+
+    def acquire(self) -> Optional[Tuple[AbstractConnectionPool, AbstractConnection]]:
+        """
+        Получить подключение к реплике без ожидания
+
+        Returns:
+            Пул и подключение или None, если ни одна реплика недоступна
+        """
+        for index in self.ordered():
+            pool: AbstractConnectionPool = self.pools[index]
+            try:
+                con: AbstractConnection = pool.acquire(timeout=0)
+            except TimeoutError:
+                self.logger.debug(f"Нет свободного подключения к реплике {index}")
+                continue
+            except Exception as e:
+                self.logger.warning(f"Реплика {index} недоступна и будет пропущена {self.failure_backoff} сек.: {e}")
+                self.__failed_at[index] = monotonic()
+                continue
+            self.__failed_at.pop(index, None)
+            return pool, con
+        return None
+
+    def dispose(self):
+        for pool in self.pools:
+            pool.dispose()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from .connection import AbstractConnection
+from .cursor import AbstractCursor
+
+
+@dataclass()
+class StatementStats:
+    """
+    Счетчики кеша курсоров. Могут быть общими для кешей всех подключений пула
+    """
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, **counters: int):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {name: getattr(self, name) for name in ("hits", "misses", "evictions", "invalidations")}
+
+
+class StatementCache:
+    """
+    LRU кеш курсоров подключения по тексту запроса
+
+    Драйверы (cx_Oracle, fdb) не готовят запрос повторно, если курсор выполняет тот же текст запроса, что и
+    в прошлый раз. Поэтому курсор после выполнения запроса не закрывается, а возвращается в кеш и выдается для
+    следующего выполнения того же запроса. Курсор, выданный транзакции, из кеша изымается, поэтому один курсор
+    не используется дважды одновременно (например, потоковой выборкой и следующим запросом).
+    """
+
+    def __init__(self, connection: AbstractConnection, size: int, stats: Optional[StatementStats] = None):
+        """
+        Args:
+            connection: подключение
+            size: максимальное кол-во хранимых курсоров
+            stats: счетчики кеша
+
+        """
+        self.connection = connection
+        self.size = size
+        self.stats: StatementStats = stats if stats is not None else StatementStats()
+        self.__idle: OrderedDict = OrderedDict()
+        self.__busy: Dict[int, Tuple[str, AbstractCursor]] = dict()
+
+    def __len__(self) -> int:
+        return len(self.__idle)
+
+    def acquire(self, statement: str) -> AbstractCursor:
+        """
+        Выдает курсор для запроса: подготовленный ранее или новый
+
+        Args:
+            statement: текст запроса
+
+        Returns:
+            AbstractCursor
+        """
+        cursor: AbstractCursor = self.__idle.pop(statement, None)
+        if cursor is None:
+            self.stats.add(misses=1)
+            cursor = self.connection.cursor()
+        else:
+            self.stats.add(hits=1)
+        self.__busy[id(cursor)] = (statement, cursor)
+        return cursor
+
+    def release(self, cursor: AbstractCursor, discard: bool = False):
+        """
+        Возвращает курсор в кеш
+
+        Args:
+            cursor: курсор
+            discard: закрыть курсор вместо возврата в кеш (например, после ошибки)
+
+        """
+        statement, _ = self.__busy.pop(id(cursor), (None, None))
+        if discard or statement is None or statement in self.__idle:
+            cursor.close()
+            return
+
+        self.__idle[statement] = cursor
+        if len(self.__idle) > self.size:
+            _, evicted = self.__idle.popitem(last=False)
+            self.stats.add(evictions=1)
+            evicted.close()
+
+    def invalidate(self):
+        """
+        Закрывает все курсоры кеша. Вызывается при закрытии или сбросе подключения
+        """
+        cursors = list(self.__idle.values()) + [cursor for _, cursor in self.__busy.values()]
+        self.__idle.clear()
+        self.__busy.clear()
+        self.stats.add(invalidations=1)
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Exception:
+                # Курсор разорванного подключения закрыть уже нельзя
+                pass
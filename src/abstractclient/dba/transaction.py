@@ -1,22 +1,35 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
-from dataclasses import make_dataclass, asdict
+from time import monotonic
+from dataclasses import make_dataclass, asdict, is_dataclass
+from functools import lru_cache
+from collections import namedtuple
+from itertools import starmap
 from uuid import uuid4
 from abc import ABC, abstractmethod
-from typing import Type, Union, Iterable, Dict, List, Mapping, Any, Optional
+from typing import Type, Union, Iterable, Iterator, Dict, List, Mapping, Any, Optional, Tuple, Callable
 
 from .exceptions import DatabaseError, ProgrammingError, InterfaceError, DataError, OperationalError, \
     IntegrityError, InternalError, NotSupportedError
 from .connection import AbstractConnection
 from .cursor import AbstractCursor
+from .columns import Column, fill_columns, numpy
+from .statements import StatementCache
+from .bulk import BulkStats, Row, batches, bulk_writer
+from .profiling import PROFILER, PARAMS_REPR, SIZE_SAMPLE_ROWS, QueryTiming, StatementRegistry, result_rows, \
+    result_size, row_size
 from .utils import GenericJSONEncoder
-from ..utils import gzip_data
 from .. import environment
 
 MAX_DB_ANSWER_LENGTH: int = environment.get("MAX_LOG_LENGTH", 5000)
 MAPPING_CLS_NAME: str = "DBMapping"
+# Кол-во различных наборов колонок, для которых хранятся классы строк
+MODEL_CACHE_SIZE: int = environment.get("MODEL_CACHE_SIZE", 1024)
+# Минимальное кол-во строк, считываемых из курсора за одно обращение при потоковой выборке
+FETCH_ARRAYSIZE: int = environment.get("FETCH_ARRAYSIZE", 1000)
 DBMap = Type[MAPPING_CLS_NAME]
+Signature = Tuple[Tuple[str, Any], ...]
 
 
 class FetchStrategy(ABC):
@@ -24,6 +37,9 @@ class FetchStrategy(ABC):
     Базовый режим выборки
     """
 
+    # Стратегия возвращает генератор, который читает курсор после возврата из Transaction.fetch
+    lazy: bool = False
+
     def __init__(self, cursor):
         self.cursor = cursor
 
@@ -48,8 +64,103 @@ class FetchAll(FetchStrategy):
         if not len(result):
             return result
 
-        cls = make_model_class(self.cursor.description)
-        return [cls(**{col[0].lower(): row[idx] for idx, col in enumerate(self.cursor.description)}) for row in result]
+        # Поля класса строки следуют в порядке колонок, поэтому экземпляры создаются позиционно
+        return list(starmap(make_model_class(self.cursor.description), result))
+
+
+class FetchIter(FetchStrategy):
+    """
+    Потоковая выборка блоками fetchmany
+    """
+
+    lazy = True
+
+    def execute(self) -> Iterator[DBMap]:
+        """
+        Считывать данные из курсора блоками по мере перебора строк
+        """
+        size: int = max(self.cursor.arraysize, FETCH_ARRAYSIZE)
+        cls = None
+        while True:
+            rows: List[Any] = self.cursor.fetchmany(size)
+            if not rows:
+                return
+            if cls is None:
+                cls = make_model_class(self.cursor.description)
+            yield from starmap(cls, rows)
+
+
+class FetchTuples(FetchStrategy):
+    """
+    Выбрать все в кортежи драйвера
+    """
+
+    def execute(self) -> List[Tuple]:
+        """
+        Считать все данные из курсора без преобразования строк
+        """
+        return self.cursor.fetchall()
+
+
+class FetchNamedTuples(FetchStrategy):
+    """
+    Выбрать все в именованные кортежи
+    """
+
+    def execute(self) -> List[Tuple]:
+        """
+        Считать все данные из курсора в именованные кортежи
+        """
+        result: List[Any] = self.cursor.fetchall()
+
+        if not len(result):
+            return result
+
+        cls = make_record_class(self.cursor.description)
+        return list(map(cls._make, result))
+
+
+class FetchColumns(FetchStrategy):
+    """
+    Выбрать все по колонкам
+    """
+
+    # Колонки Decimal хранятся в списках без потери точности. True - в array.array('d') как float
+    decimal_as_float: bool = False
+
+    def execute(self) -> Dict[str, Column]:
+        """
+        Считать все данные из курсора блоками в колонки: числа в array.array, даты, строки и Decimal в списки
+        """
+        buffers = fill_columns(self.cursor, max(self.cursor.arraysize, FETCH_ARRAYSIZE), self.decimal_as_float)
+        return {name: buffer.values for name, buffer in buffers.items()}
+
+
+class FetchFloatColumns(FetchColumns):
+    """
+    Выбрать все по колонкам, переводя Decimal во float
+    """
+
+    decimal_as_float = True
+
+
+class FetchNumpyColumns(FetchStrategy):
+    """
+    Выбрать все по колонкам в массивы numpy
+    """
+
+    # Колонки Decimal хранятся в списках без потери точности. True - в массивах float64
+    decimal_as_float: bool = False
+
+    def execute(self) -> Dict[str, Any]:
+        """
+        Считать все данные из курсора блоками в колонки: числа и даты в numpy.ndarray, строки и Decimal в списки
+        """
+        if numpy is None:
+            raise NotSupportedError("Для выборки FetchNumpyColumns необходимо установить пакет numpy")
+
+        buffers = fill_columns(self.cursor, max(self.cursor.arraysize, FETCH_ARRAYSIZE), self.decimal_as_float)
+        return {name: buffer.to_numpy() for name, buffer in buffers.items()}
 
 
 class FetchNone(FetchStrategy):
@@ -78,43 +189,111 @@ class FetchOne(FetchStrategy):
         if not result:
             return result
 
-        cls = make_model_class(self.cursor.description)
-        return cls(**{col[0].lower(): result[idx] for idx, col in enumerate(self.cursor.description)})
+        return make_model_class(self.cursor.description)(*result)
 
 
-def pretty_log(dataset: Optional[Union[Iterable[DBMap], DBMap]] = None) -> Union[str, bytes]:
+def pretty_log(dataset: Optional[Union[Iterable[DBMap], DBMap]] = None) -> str:
     """
     Форматирование результата транзакции
 
+    Строки сериализуются по одной и только до достижения MAX_DB_ANSWER_LENGTH, остальные строки учитываются
+    в итоговой строке по кол-ву. Поэтому размер лога и затраты на него не зависят от размера результата
+
     Args:
         dataset: логируемые данные
     """
     if not dataset:
         return "\nQuery result is:\nNo data\n"
 
-    data = [row.asdict() for row in dataset] if isinstance(dataset, list) else dataset.asdict()
-    result = json.dumps(data, indent=4, ensure_ascii=False, cls=GenericJSONEncoder)
+    # Результат выборки по колонкам не перекладывается в строки, в лог выводится только его размер
+    if isinstance(dataset, dict):
+        rows: int = len(next(iter(dataset.values())))
+        return f"\nQuery result is:\n{rows} rows in columns: {', '.join(dataset)}\n"
 
-    # Если результат больше параметра MAX_DB_ANSWER_LENGTH, то быстренько пожмем его gzip
-    if len(result) > MAX_DB_ANSWER_LENGTH:
-        result = gzip_data(result.encode())
-    # Если результат все еще велик, то просто выведем информацию о настройке в конфиге - MAX_LOG_LENGTH
-    if len(result) > MAX_DB_ANSWER_LENGTH:
-        result = f"To long for logging. Please, set or increase param MAX_LOG_LENGTH (current {MAX_DB_ANSWER_LENGTH}b.)"
+    if not isinstance(dataset, list):
+        return f"\nQuery result is:\n{truncate_log(dump_row(dataset), MAX_DB_ANSWER_LENGTH)}\n"
 
-    return f"\nQuery result is:\n{result}\n"
+    lines: List[str] = []
+    length: int = 0
+    for row in dataset:
+        line: str = dump_row(row)
+        if length + len(line) > MAX_DB_ANSWER_LENGTH:
+            # Первая строка выводится хотя бы частично
+            if not lines:
+                lines.append(truncate_log(line, MAX_DB_ANSWER_LENGTH))
+            break
+        lines.append(line)
+        length += len(line) + 1
 
+    rest: int = len(dataset) - len(lines)
+    if rest:
+        lines.append(f"... {rest} more rows of {len(dataset)} "
+                     f"(set or increase param MAX_LOG_LENGTH to log more, current {MAX_DB_ANSWER_LENGTH}b.)")
 
-def make_model_class(dataset_item: Mapping):
+    return "\nQuery result is:\n{}\n".format("\n".join(lines))
+
+
+def dump_row(row: Any) -> str:
     """
-    Конвертер маппинга в датакласс
+    Строка результата в виде JSON
 
     Args:
-        dataset_item(Mapping): маппинг
+        row: строка результата
+    """
+    return json.dumps(row_dict(row), ensure_ascii=False, cls=GenericJSONEncoder)
+
+
+def truncate_log(text: str, length: int) -> str:
+    """
+    Обрезка текста лога до заданной длины
+
+    Args:
+        text: текст
+        length: максимальная длина
+    """
+    return text if len(text) <= length else f"{text[:length]}... ({len(text)} chars)"
+
+
+def row_dict(row: Any) -> Union[Dict[str, Any], List[Any]]:
+    """
+    Строка результата в виде словаря, кортеж драйвера - в виде списка
+
+    Args:
+        row: строка результата
+    """
+    # Поля датакласса строки - значения колонок, поэтому рекурсивное копирование asdict не требуется
+    if is_dataclass(row) and hasattr(row, "__dict__"):
+        return dict(row.__dict__)
+    if hasattr(row, "asdict"):
+        return row.asdict()
+    if hasattr(row, "_asdict"):
+        return row._asdict()
+    return list(row)
+
+
+def description_signature(description: Iterable) -> Signature:
+    """
+    Сигнатура набора колонок: имена в нижнем регистре и типы
+
+    Args:
+        description: описание колонок курсора
+
+    Returns:
+        Signature
+    """
+    return tuple((col[0].lower(), col[1]) for col in description)
+
+
+def build_model_class(signature: Signature):
+    """
+    Создает датакласс строки по сигнатуре набора колонок
+
+    Args:
+        signature: сигнатура набора колонок
     """
     return make_dataclass(
         MAPPING_CLS_NAME,
-        [(val[0].lower(), val[1]) for val in dataset_item],
+        list(signature),
         frozen=True,
         namespace={
             "asdict": lambda self: asdict(self)
@@ -122,6 +301,48 @@ def make_model_class(dataset_item: Mapping):
     )
 
 
+cached_model_class = lru_cache(maxsize=MODEL_CACHE_SIZE)(build_model_class)
+
+
+def make_model_class(dataset_item: Mapping):
+    """
+    Конвертер маппинга в датакласс
+
+    make_dataclass генерирует и компилирует код класса, поэтому класс создается один раз для каждого набора колонок
+    и далее берется из кеша
+
+    Args:
+        dataset_item(Mapping): маппинг
+    """
+    signature: Signature = description_signature(dataset_item)
+    try:
+        return cached_model_class(signature)
+    except TypeError:
+        # Тип колонки, который драйвер не позволяет хешировать, кешировать нельзя
+        return build_model_class(signature)
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def record_class(names: Tuple[str, ...]):
+    """
+    Создает именованный кортеж строки по именам колонок
+
+    Args:
+        names: имена колонок в нижнем регистре
+    """
+    return namedtuple(MAPPING_CLS_NAME, names, rename=True)
+
+
+def make_record_class(description: Iterable):
+    """
+    Конвертер описания колонок в именованный кортеж. Класс создается один раз для каждого набора колонок
+
+    Args:
+        description: описание колонок курсора
+    """
+    return record_class(tuple(col[0].lower() for col in description))
+
+
 various_excps = {
     'DatabaseError': DatabaseError,
     'ProgrammingError': ProgrammingError,
@@ -142,12 +363,20 @@ class Transaction:
     ONE = FetchOne
     NOTHING = FetchNone
     MANY = FetchAll
+    ITER = FetchIter
+    TUPLES = FetchTuples
+    RECORDS = FetchNamedTuples
+    COLUMNS = FetchColumns
 
-    def __init__(self, con: AbstractConnection, auto: bool = False):
+    def __init__(self, con: AbstractConnection, auto: bool = False, statements: Optional[StatementCache] = None,
+                 profiler: Optional[StatementRegistry] = PROFILER):
         self._con: AbstractConnection = con
+        self._statements: Optional[StatementCache] = statements
+        self.profiler: Optional[StatementRegistry] = profiler
         self.__guid: str = uuid4().hex
         self.auto: bool = auto
         self.logger: logging.Logger = logging.getLogger(__name__)
+        self.__streams: Dict[int, Tuple[AbstractCursor, Iterator[DBMap]]] = dict()
 
     def callproc(
             self,
@@ -167,12 +396,16 @@ class Transaction:
             Optional[Union[Iterable[DataModel], DataModel]]
         """
         cursor: AbstractCursor = self.start(statement, params or ())
+        start: float = monotonic()
         try:
             cursor.callproc(statement, params)
         except Exception as e:
+            self.close(cursor, discard=True)
+            if self.profiling:
+                self.profile(QueryTiming(statement, params, execute=monotonic() - start, error=True))
             ex = union_exception(e)
             raise ex(str(e)) if ex else e
-        return self.fetch(cursor, fetch)
+        return self.fetch(cursor, fetch, self.__timing(statement, params, start))
 
     def execute(
             self,
@@ -192,13 +425,17 @@ class Transaction:
             Optional[Union[Iterable[DataModel], DataModel]]
         """
         cursor: AbstractCursor = self.start(statement, params or ())
+        start: float = monotonic()
         try:
             cursor.execute(statement, params)
         except Exception as e:
+            self.close(cursor, discard=True)
+            if self.profiling:
+                self.profile(QueryTiming(statement, params, execute=monotonic() - start, error=True))
             ex = union_exception(e)
             raise ex(str(e)) if ex else e
 
-        return self.fetch(cursor, fetch)
+        return self.fetch(cursor, fetch, self.__timing(statement, params, start))
 
     def executemany(
             self,
@@ -219,12 +456,80 @@ class Transaction:
             Optional[Union[Iterable[DataModel], DataModel]]
         """
         cursor: AbstractCursor = self.start(statement, params or ())
+        start: float = monotonic()
         try:
             cursor.executemany(statement, params)
         except Exception as e:
+            self.close(cursor, discard=True)
+            if self.profiling:
+                self.profile(QueryTiming(statement, params, execute=monotonic() - start, error=True))
             ex = union_exception(e)
             raise ex(str(e)) if ex else e
-        return self.fetch(cursor, fetch)
+        return self.fetch(cursor, fetch, self.__timing(statement, params, start))
+
+    def bulk(
+            self,
+            statement: str,
+            rows: Iterable[Row],
+            batch_size: int = 1000,
+            commit_every: Optional[int] = None,
+            progress: Optional[Callable[[BulkStats], None]] = None
+    ) -> BulkStats:
+        """
+        Execute a database operation against rows of a stream in batches. Rows are read from the stream
+        one batch at a time, so the stream is never materialized.
+
+        Driver specific batch writers are used when available (see bulk.BULK_WRITERS), executemany otherwise.
+        With auto=True the transaction is committed at the end and rolled back on error.
+
+        Args:
+            statement (str): SQL statement
+            rows (Iterable[Row]): bind params of rows, e.g. generator
+            batch_size (int): rows per batch
+            commit_every (Optional[int]): commit after every N batches
+            progress (Optional[Callable[[BulkStats], None]]): called after every batch
+
+        Returns:
+            BulkStats
+        """
+        stats: BulkStats = BulkStats()
+        start: float = monotonic()
+        cursor: AbstractCursor = self.start(statement)
+        write = bulk_writer(cursor)
+        try:
+            for batch in batches(rows, batch_size):
+                write(cursor, statement, batch)
+                stats.rows += len(batch)
+                stats.batches += 1
+                if commit_every and stats.batches % commit_every == 0:
+                    self._con.commit()
+                    stats.commits += 1
+                stats.elapsed = monotonic() - start
+                if progress:
+                    progress(stats)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.log(logging.DEBUG, f"Written {stats.rows} rows ({stats.rows_per_second:.0f} rows/s)")
+        except Exception as e:
+            self.close(cursor, discard=True)
+            if self.profiling:
+                self.profile(QueryTiming(statement, execute=monotonic() - start, rows=stats.rows, error=True))
+            if self.auto:
+                self._con.rollback()
+            self.logger.error(f"Bulk write failed after {stats.rows} rows, {stats.commits} commits: {str(e)}")
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+
+        self.close(cursor)
+        if self.auto:
+            self._con.commit()
+            stats.commits += 1
+
+        stats.elapsed = monotonic() - start
+        if self.profiling:
+            self.profile(QueryTiming(statement, execute=stats.elapsed, rows=stats.rows))
+        self.logger.info(f"Written {stats.rows} rows in {stats.batches} batches for {stats.elapsed:.2f}s "
+                         f"({stats.rows_per_second:.0f} rows/s)")
+        return stats
 
     def start(self, statement: str, params: Optional[Union[Iterable, Dict]] = None):
         """
@@ -234,36 +539,54 @@ class Transaction:
             statement (str): SQL statement
             params (Union[Tuple, List]): bind params
         """
-        cur: AbstractCursor = self._con.cursor()
+        # Курсор из кеша подключения уже подготовлен для этого запроса
+        cur: AbstractCursor = (self._statements.acquire(statement) if self._statements is not None
+                               else self._con.cursor())
 
         if not params:
             params = ()
 
         if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.log(logging.DEBUG, f"\nRunning SQL query:\n{statement}\nwith params: {str(params)}\n")
+            self.logger.log(logging.DEBUG, f"\nRunning SQL query:\n{statement}\nwith params: {PARAMS_REPR.repr(params)}\n")
 
         return cur
 
-    def fetch(self, cursor: AbstractCursor, fetch: Type[FetchStrategy] = FetchAll):
+    def fetch(self, cursor: AbstractCursor, fetch: Type[FetchStrategy] = FetchAll,
+              timing: Optional[QueryTiming] = None):
         """
         Fetch results
 
         Args:
             cursor(AbstractCursor): cursor
             fetch(Type[FetchStrategy]): fetch mode
+            timing(Optional[QueryTiming]): execution timing of the statement, completed with fetch time,
+                rows and estimated size and passed to the profiler
 
         Returns:
             Optional[Union[Iterable[DataModel], DataModel]]
         """
+        if fetch.lazy:
+            return self.stream(cursor, fetch, timing)
+
+        start: float = monotonic() if timing is not None else 0.0
         try:
             res: Optional[Union[Iterable[DBMap], DBMap]] = fetch(cursor).execute()
         except Exception as e:
+            self.close(cursor, discard=True)
+            if timing is not None:
+                timing.fetch, timing.error = monotonic() - start, True
+                self.profile(timing)
             if self.auto:
                 self._con.rollback()
             ex = union_exception(e)
             raise ex(str(e)) if ex else e
-        finally:
-            cursor.close()
+
+        if timing is not None:
+            timing.fetch = monotonic() - start
+            timing.rows, timing.size = result_rows(res), result_size(res)
+            self.profile(timing)
+
+        self.close(cursor)
 
         if self.auto:
             self._con.commit()
@@ -273,6 +596,110 @@ class Transaction:
 
         return res
 
+    def stream(self, cursor: AbstractCursor, fetch: Type[FetchStrategy] = FetchIter,
+               timing: Optional[QueryTiming] = None) -> Iterator[DBMap]:
+        """
+        Stream results. The cursor stays open until the generator is exhausted or closed, so the result must be
+        consumed inside the transaction. Streams left open are closed by close_streams when the transaction ends.
+        With auto=True the transaction is committed when the generator is exhausted and rolled back when
+        it is closed before that or fails
+
+        Args:
+            cursor(AbstractCursor): cursor
+            fetch(Type[FetchStrategy]): lazy fetch mode
+            timing(Optional[QueryTiming]): execution timing of the statement. Fetch time of a stream includes
+                the time the consumer spends on rows
+
+        Returns:
+            Iterator[DataModel]
+        """
+        rows: Iterator[DBMap] = self.__stream(cursor, fetch, timing)
+        self.__streams[id(cursor)] = (cursor, rows)
+        return rows
+
+    def __stream(self, cursor: AbstractCursor, fetch: Type[FetchStrategy],
+                 timing: Optional[QueryTiming]) -> Iterator[DBMap]:
+        count: int = 0
+        sample: int = 0
+        failed: bool = False
+        exhausted: bool = False
+        start: float = monotonic() if timing is not None else 0.0
+        try:
+            for row in fetch(cursor).execute():
+                count += 1
+                if timing is not None and count <= SIZE_SAMPLE_ROWS:
+                    sample += row_size(row)
+                yield row
+            exhausted = True
+        except Exception as e:
+            failed = True
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+        finally:
+            # Перебор, прерванный потребителем (в т.ч. закрытие генератора сборщиком мусора), не фиксируется
+            self.__close_stream(cursor, exhausted, failed)
+            if timing is not None:
+                timing.fetch, timing.rows, timing.error = monotonic() - start, count, failed
+                timing.size = sample * count // min(count, SIZE_SAMPLE_ROWS) if count else 0
+                self.profile(timing)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.log(logging.DEBUG, f"\nQuery result is:\n{count} rows streamed\n")
+
+    def __close_stream(self, cursor: AbstractCursor, exhausted: bool, failed: bool = False):
+        # Поток, уже закрытый при завершении транзакции, повторно не закрывается
+        if self.__streams.pop(id(cursor), None) is None:
+            return
+        self.close(cursor, discard=failed)
+        if self.auto:
+            if exhausted:
+                self._con.commit()
+            else:
+                self._con.rollback()
+
+    def close_streams(self):
+        """
+        Close streams left open: the cursors are closed or returned to the statement cache and, with auto=True,
+        the transaction is rolled back. Called by DAO when the transaction ends
+        """
+        for cursor, rows in list(self.__streams.values()):
+            # Генератор, перебор которого начат, закрывает курсор сам. Не начатый генератор закрывается здесь
+            rows.close()
+            self.__close_stream(cursor, exhausted=False)
+
+    @property
+    def profiling(self) -> bool:
+        """
+        Statements are profiled: the profiler is set and enabled
+        """
+        return self.profiler is not None and self.profiler.enabled
+
+    def __timing(self, statement: str, params: Any, start: float) -> Optional[QueryTiming]:
+        # Без профайлера замер не создается, и выборка не считает строки и размер результата
+        return QueryTiming(statement, params, execute=monotonic() - start) if self.profiling else None
+
+    def profile(self, timing: QueryTiming):
+        """
+        Pass the execution timing of a statement to the profiler
+
+        Args:
+            timing(QueryTiming): execution timing
+        """
+        if self.profiling:
+            self.profiler.record(timing)
+
+    def close(self, cursor: AbstractCursor, discard: bool = False):
+        """
+        Close cursor or return it to the statement cache of the connection
+
+        Args:
+            cursor(AbstractCursor): cursor
+            discard(bool): close cursor even if statement cache is used
+        """
+        if self._statements is not None:
+            self._statements.release(cursor, discard)
+        else:
+            cursor.close()
+
     def commit(self):
         """
         Коммит транзакции
@@ -1,10 +1,11 @@
 import importlib
-from typing import Optional, Type, Callable, Dict, Any
+from typing import Optional, Type, Callable, Dict, List, Union, Any
 
 from .. import environment
 from ..abstractpipeline import AbstractConfig
 from .transports import HTTPFactory
-from .database import DAO, GenericConnectionPool
+from .database import DAO, GenericConnectionPool, AsyncConnectionPool
+from ..dba.dao import AbstractAsyncDAO
 
 
 class DefaultConfig(AbstractConfig):
@@ -61,19 +62,72 @@ class DefaultConfig(AbstractConfig):
             module: str = importlib.import_module(db.connection.get("module"))
             connection_fabric: Callable = getattr(module, db.connection.get("function", "connect"))
 
-            pool: GenericConnectionPool = GenericConnectionPool(
-                connection_fabric,
-                db.credentials,
-                db.pool.pool_size,
-                db.pool.max_overflow,
-                db.pool.timeout,
-                db.pool.use_lifo
-            )
-
-            databases[key] = self._db_cls(pool)
+            is_async: bool = isinstance(self._db_cls, type) and issubclass(self._db_cls, AbstractAsyncDAO)
+            if db.get("replicas", None) and is_async:
+                raise ValueError(f"В настройках базы '{key}' заданы replicas, но {self._db_cls.__name__} не поддерживает "
+                                 f"реплики. Используйте DAO или удалите раздел replicas")
+
+            pool: Union[GenericConnectionPool, AsyncConnectionPool]
+            # Асинхронный драйвер (aiosqlite, aioodbc): фабрика подключений - корутина
+            if db.connection.get("async", False):
+                if not is_async:
+                    raise ValueError(f"Для асинхронного драйвера базы '{key}' необходим класс AsyncDAO")
+                pool = AsyncConnectionPool(
+                    connection_fabric,
+                    db.credentials,
+                    db.pool.pool_size,
+                    db.pool.timeout,
+                    reset_on_return=db.pool.get("reset_on_return", True)
+                )
+            else:
+                pool = self._connection_pool(connection_fabric, db.credentials, db.pool)
+
+            # Реплики для транзакций только на чтение. Незаданные параметры берутся из настроек основной базы
+            replicas: List[GenericConnectionPool] = []
+            for replica in db.get("replicas", None) or []:
+                replicas.append(self._connection_pool(
+                    connection_fabric,
+                    {**db.credentials, **(replica.get("credentials", None) or {})},
+                    {**db.pool, **(replica.get("pool", None) or {})}
+                ))
+
+            if replicas:
+                databases[key] = self._db_cls(pool, replicas=replicas,
+                                              balancing=db.get("replica_balancing", "least_loaded"),
+                                              failure_backoff=db.get("replica_failure_backoff", 30))
+            else:
+                databases[key] = self._db_cls(pool)
 
         return databases
 
+    @staticmethod
+    def _connection_pool(connection_fabric: Callable, credentials: Dict[str, Any],
+                         settings: Dict[str, Any]) -> GenericConnectionPool:
+        """
+        Создает пул подключений по настройкам раздела pool
+
+        Args:
+            connection_fabric: Фабрика подключений
+            credentials: Параметры подключения
+            settings: Настройки пула
+
+        Returns:
+            GenericConnectionPool
+        """
+        return GenericConnectionPool(
+            connection_fabric,
+            credentials,
+            settings["pool_size"],
+            settings["max_overflow"],
+            settings["timeout"],
+            settings["use_lifo"],
+            statement_cache_size=settings.get("statement_cache_size", 0),
+            recycle=settings.get("recycle"),
+            idle_timeout=settings.get("idle_timeout"),
+            pre_ping=settings.get("pre_ping", False),
+            ping_query=settings.get("ping_query")
+        )
+
     def transport(self) -> Dict[str, Any]:
         """
         Инициализация AbstractFactory класса для работы с HTTP
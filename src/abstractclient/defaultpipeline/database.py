@@ -5,42 +5,182 @@
 DI протестирован с fdb, kinterbasdb, cx_Oracle.
 Нужно протестировать psycopg.
 """
+import asyncio
 import logging
 import threading
 
-from queue import LifoQueue, Queue
-from typing import Callable, Union, Type, Iterable, Optional
+from time import monotonic
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Type, Iterable, Optional, Dict, Deque, List, Any
 
-from ..dba.pool import AbstractConnectionPool
-from ..dba.dao import AbstractDAO
+from ..metrics import Histogram
+from ..dba.pool import AbstractConnectionPool, AbstractAsyncConnectionPool
+from ..dba.statements import StatementCache, StatementStats
+from ..dba.dao import AbstractDAO, AbstractAsyncDAO
 from ..dba.transaction import union_exception
 
 
+@dataclass()
+class ConnectionRecord:
+    """
+    Подключение пула
+    """
+    connection: Any
+    created: float
+    released: float
+    checked_out: float = 0.0
+
+
+class PoolMetrics:
+    """
+    Метрики пула подключений: гистограммы ожидания, удержания и открытия подключений и счетчики событий пула
+    """
+
+    def __init__(self):
+        self.wait: Histogram = Histogram()
+        self.hold: Histogram = Histogram()
+        self.connect: Histogram = Histogram()
+        self.__counters: Dict[str, int] = dict(checkouts=0, connects=0, connect_failures=0, timeouts=0,
+                                               overflow_high_water=0)
+        self.__recycles: Dict[str, int] = dict()
+        self.__lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1):
+        """
+        Увеличить счетчик
+
+        Args:
+            name: Наименование счетчика
+            value: Приращение
+
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def high_water(self, overflow: int):
+        """
+        Учесть текущее переполнение пула
+
+        Args:
+            overflow: Кол-во открытых подключений сверх pool_size
+
+        """
+        with self.__lock:
+            if overflow > self.__counters["overflow_high_water"]:
+                self.__counters["overflow_high_water"] = overflow
+
+    def recycled(self, reason: str, value: int = 1):
+        """
+        Учесть закрытие подключения пулом
+
+        Args:
+            reason: Причина: recycle, idle, ping, reset, overflow
+            value: Кол-во подключений
+
+        """
+        with self.__lock:
+            self.__recycles[reason] = self.__recycles.get(reason, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Текущее состояние метрик
+
+        Returns:
+            Словарь со счетчиками, закрытиями подключений по причинам и гистограммами длительностей
+        """
+        with self.__lock:
+            result: Dict[str, Any] = dict(self.__counters)
+            result["recycles"] = dict(self.__recycles)
+        result["wait"] = self.wait.snapshot()
+        result["hold"] = self.hold.snapshot()
+        result["connect"] = self.connect.snapshot()
+        return result
+
+
 class GenericConnectionPool(AbstractConnectionPool):
 
     def __init__(self, connection_fabric: Callable, credentials: dict, pool_size: int = 5, max_overflow: int = 10,
-                 timeout: int = 30, use_lifo: bool = False, suppressed_exc: Optional[Iterable[Type]] = None):
+                 timeout: int = 30, use_lifo: bool = False, suppressed_exc: Optional[Iterable[Type]] = None,
+                 statement_cache_size: int = 0, recycle: Optional[float] = None, idle_timeout: Optional[float] = None,
+                 pre_ping: bool = False, ping_query: Optional[str] = None, reset_on_return: bool = True):
         """
         Универсальный пул подключений к БД
 
+        Свободные подключения остаются открытыми и выдаются повторно. Подключения сверх pool_size (переполнение)
+        закрываются при возврате в пул.
+
         Args:
             connection_fabric(Callable): фабрика подключений к БД
             credentials(dict): данные для подключения
             pool_size(int): верхняя граница пула подключений
-            max_overflow(int): максимальное допустимое переполнение
+            max_overflow(int): максимальное допустимое переполнение, -1 - без ограничения
             timeout(int): время ожидание свободного подключения
             use_lifo(bool): использовать стек вместо очереди
             suppressed_exc(Optional[Iterable[Type]]): игнорируемые исключения
+            statement_cache_size(int): кол-во подготовленных курсоров, хранимых для каждого подключения, 0 - без кеша
+            recycle(Optional[float]): время жизни подключения, сек., после которого оно открывается заново
+            idle_timeout(Optional[float]): время простоя, сек., после которого свободное подключение закрывается
+            pre_ping(bool): проверять подключение перед выдачей (метод ping драйвера или запрос ping_query)
+            ping_query(Optional[str]): запрос проверки подключения, например select 1 from rdb$database
+            reset_on_return(bool): откатывать незавершенную транзакцию при возврате подключения в пул
         """
         self.connection_fabric: Callable = connection_fabric
         self.credentials: dict = credentials
-        self._pool: Union[LifoQueue, Queue] = LifoQueue(maxsize=pool_size) if use_lifo else Queue(maxsize=pool_size)
+        self._size: int = pool_size
+        self._use_lifo: bool = use_lifo
+        self._idle: Deque[ConnectionRecord] = deque()
+        self._checked_out: Dict[int, ConnectionRecord] = dict()
         self._overflow: int = 0 - pool_size
         self._max_overflow: int = max_overflow
         self._timeout: int = timeout
-        self._overflow_lock: threading.Lock = threading.Lock()
+        # Условие пула: изменение состава подключений и ожидание свободного подключения
+        self._overflow_lock: threading.Condition = threading.Condition()
         self.suppressed_exc: Iterable[Type] = () if suppressed_exc is None else suppressed_exc
         self.logger: logging.Logger = logging.getLogger()
+        self.recycle: Optional[float] = recycle
+        self.idle_timeout: Optional[float] = idle_timeout
+        self.pre_ping: bool = pre_ping
+        self.ping_query: Optional[str] = ping_query
+        self.reset_on_return: bool = reset_on_return
+        self._reaped: float = monotonic()
+        self.metrics: PoolMetrics = PoolMetrics()
+        self.statement_cache_size: int = statement_cache_size
+        self.statement_stats: StatementStats = StatementStats()
+        self._statements: Dict[int, StatementCache] = dict()
+        self._statements_lock: threading.Lock = threading.Lock()
+
+    def statements(self, conn) -> Optional[StatementCache]:
+        """
+        Кеш подготовленных курсоров подключения
+
+        Args:
+            conn: подключение
+
+        Returns:
+            StatementCache или None, если кеш отключен
+        """
+        if not self.statement_cache_size:
+            return None
+
+        with self._statements_lock:
+            cache: Optional[StatementCache] = self._statements.get(id(conn))
+            if cache is None:
+                cache = self._statements[id(conn)] = StatementCache(conn, self.statement_cache_size,
+                                                                    self.statement_stats)
+        return cache
+
+    def _invalidate_statements(self, conn):
+        """
+        Закрыть курсоры кеша подключения перед его закрытием
+
+        Args:
+            conn: подключение
+        """
+        with self._statements_lock:
+            cache: Optional[StatementCache] = self._statements.pop(id(conn), None)
+        if cache is not None:
+            cache.invalidate()
 
     def release(self, conn):
         """
@@ -48,46 +188,222 @@ class GenericConnectionPool(AbstractConnectionPool):
         Args:
             conn: подключение
         """
-        if not self._pool.full():
-            self._pool.put(conn, False)
+        with self._overflow_lock:
+            record: Optional[ConnectionRecord] = self._checked_out.pop(id(conn), None)
+
+        # Подключение не из пула (например, test_acquire) просто закрываем
+        if record is None:
+            self._close(conn)
+            return
+
+        self.metrics.hold.observe(monotonic() - record.checked_out)
+        if self.reset_on_return:
+            try:
+                conn.rollback()
+            except Exception as e:
+                self.logger.warning(f"Подключение не удалось вернуть в пул и оно будет закрыто: {e}")
+                self.metrics.recycled("reset")
+                self._discard(record)
+                return
+
+        with self._overflow_lock:
+            if len(self._idle) < self._size:
+                record.released = monotonic()
+                self._idle.append(record)
+                self._overflow_lock.notify()
+                record = None
+
+        # Подключение сверх pool_size закрывается
+        if record is not None:
+            self.metrics.recycled("overflow")
+            self._discard(record)
+
+        self._reap_if_due()
+
+    def acquire(self, timeout: Optional[float] = None) -> object:
+        """
+        Получить подключение: свободное из пула, новое, если пул не заполнен, или дождаться освобождения
+
+        Args:
+            timeout: время ожидания свободного подключения, по умолчанию - timeout пула
+
+        Raises:
+            TimeoutError: если свободное подключение не появилось за время ожидания
+        """
+        start: float = monotonic()
+        deadline: float = start + (self._timeout if timeout is None else timeout)
+        while True:
+            with self._overflow_lock:
+                record: Optional[ConnectionRecord] = self._take()
+                if record is None and not self._inc_overflow():
+                    remaining: float = deadline - monotonic()
+                    if remaining <= 0:
+                        self.metrics.increment("timeouts")
+                        raise TimeoutError(f"Нет свободного подключения к БД в пуле. {self.status()}")
+                    self._overflow_lock.wait(remaining)
+                    continue
+
+            if record is None:
+                record = self._connect()
+            elif not self._usable(record):
+                self._discard(record)
+                continue
+
+            record.checked_out = monotonic()
+            with self._overflow_lock:
+                self._checked_out[id(record.connection)] = record
+            self.metrics.wait.observe(record.checked_out - start)
+            self.metrics.increment("checkouts")
+            return record.connection
+
+    def _take(self) -> Optional[ConnectionRecord]:
+        """
+        Забрать свободное подключение. Вызывается под блокировкой пула
 
+        Returns:
+            Optional[ConnectionRecord]
+        """
+        if not self._idle:
+            return None
+        return self._idle.pop() if self._use_lifo else self._idle.popleft()
+
+    def _connect(self) -> ConnectionRecord:
+        """
+        Открыть подключение. Место в пуле должно быть занято через _inc_overflow
+
+        Returns:
+            ConnectionRecord
+        """
+        start: float = monotonic()
+        try:
+            connection = self.connection_fabric(**self.credentials)
+        except Exception as e:
+            self.metrics.increment("connect_failures")
+            self._discard_slot()
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+
+        now: float = monotonic()
+        self.metrics.connect.observe(now - start)
+        self.metrics.increment("connects")
+        return ConnectionRecord(connection=connection, created=now, released=now)
+
+    def _usable(self, record: ConnectionRecord) -> bool:
+        """
+        Проверить, можно ли выдать свободное подключение
+
+        Args:
+            record: подключение пула
+
+        Returns:
+            bool
+        """
+        now: float = monotonic()
+        if self.recycle is not None and now - record.created > self.recycle:
+            self.logger.debug("Подключение к БД превысило время жизни и будет открыто заново")
+            self.metrics.recycled("recycle")
+            return False
+        if self.idle_timeout is not None and now - record.released > self.idle_timeout:
+            self.logger.debug("Подключение к БД простаивало дольше idle_timeout и будет открыто заново")
+            self.metrics.recycled("idle")
+            return False
+        if self.pre_ping and not self._ping(record.connection):
+            self.logger.warning("Подключение к БД не прошло проверку и будет открыто заново")
+            self.metrics.recycled("ping")
+            return False
+        return True
+
+    def _ping(self, conn) -> bool:
+        """
+        Проверить подключение методом ping драйвера (cx_Oracle) или запросом ping_query
+
+        Args:
+            conn: подключение
+
+        Returns:
+            bool
+        """
+        try:
+            ping: Optional[Callable] = getattr(conn, "ping", None)
+            if callable(ping):
+                ping()
+            elif self.ping_query:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(self.ping_query)
+                    cursor.fetchall()
+                finally:
+                    cursor.close()
+            return True
+        except Exception as e:
+            self.logger.debug(f"Ошибка проверки подключения к БД: {e}")
+            return False
+
+    def _close(self, conn):
+        """
+        Закрыть подключение
+
+        Args:
+            conn: подключение
+        """
+        self._invalidate_statements(conn)
         try:
             conn.close()
         except self.suppressed_exc as e:
             self.logger.warning(f"Проигнорировано исключение при закрытии подключения: {e}")
         except Exception as e:
-            self._dec_overflow()
-            ex = union_exception(e)
-            raise ex(str(e)) if ex else e
+            self.logger.warning(f"Ошибка при закрытии подключения: {e}")
 
-        self._dec_overflow()
+    def _discard(self, record: ConnectionRecord):
+        """
+        Закрыть подключение пула и освободить его место
 
-    def acquire(self) -> object:
+        Args:
+            record: подключение пула
         """
-        Получить подключение
+        self._close(record.connection)
+        self._discard_slot()
+
+    def _discard_slot(self):
+        """
+        Освободить место закрытого или не открытого подключения и разбудить ожидающего
         """
-        use_overflow = self._max_overflow > -1
-        wait = use_overflow and self._overflow >= self._max_overflow
+        with self._overflow_lock:
+            self._dec_overflow()
+            self._overflow_lock.notify()
 
-        if use_overflow and self._overflow >= self._max_overflow:
-            if not wait:
-                return self.acquire()
+    def reap(self) -> int:
+        """
+        Закрыть свободные подключения, простаивавшие дольше idle_timeout или превысившие время жизни recycle
 
-            raise OverflowError("Connection pool overflow")
+        Returns:
+            Кол-во закрытых подключений
+        """
+        now: float = monotonic()
+        with self._overflow_lock:
+            self._reaped = now
+            kept: Deque[ConnectionRecord] = deque()
+            expired: List[ConnectionRecord] = []
+            for record in self._idle:
+                idle: bool = self.idle_timeout is not None and now - record.released > self.idle_timeout
+                stale: bool = idle or (self.recycle is not None and now - record.created > self.recycle)
+                (expired if stale else kept).append(record)
+            self._idle = kept
 
-        if self._inc_overflow():
-            try:
-                return self.connection_fabric(**self.credentials)
-            except Exception as e:
-                self._dec_overflow()
-                ex = union_exception(e)
-                raise ex(str(e)) if ex else e
+        for record in expired:
+            self._discard(record)
+        if expired:
+            self.metrics.recycled("reaped", len(expired))
+            self.logger.debug(f"Закрыто простаивающих подключений к БД: {len(expired)}")
+        return len(expired)
 
-        # теоретически, если один поток получил лок в _inc_overflow, и другой поток пришел следом и ждет
-        # когда лок освободится, то, когда первый поток освободит лок,
-        # то второй может выполниться быстрее чем первый и забрать подключение из пула раньше,
-        # тогда, если в пуле не осталось подключений первый поток будет вынужден ждать появления коннекта в пуле
-        return self._pool.get()
+    def _reap_if_due(self):
+        """
+        Проверить простаивающие подключения не чаще, чем раз в половину idle_timeout
+        """
+        interval: Optional[float] = self.idle_timeout if self.idle_timeout is not None else self.recycle
+        if interval is not None and monotonic() - self._reaped > interval / 2:
+            self.reap()
 
     def _inc_overflow(self) -> bool:
         """
@@ -96,16 +412,12 @@ class GenericConnectionPool(AbstractConnectionPool):
         Returns:
             bool
         """
-        if self._max_overflow == -1:
-            self._overflow += 1
-            return True
-
         with self._overflow_lock:
-            if self._overflow < self._max_overflow:
+            if self._max_overflow == -1 or self._overflow < self._max_overflow:
                 self._overflow += 1
+                self.metrics.high_water(self._overflow)
                 return True
-            else:
-                return False
+            return False
 
     def _dec_overflow(self) -> bool:
         """
@@ -114,21 +426,32 @@ class GenericConnectionPool(AbstractConnectionPool):
         Returns:
             bool
         """
-        if self._max_overflow == -1:
-            self._overflow -= 1
-            return True
         with self._overflow_lock:
             self._overflow -= 1
             return True
 
     def dispose(self) -> None:
         """
-        Закрыть пул
+        Закрыть пул. Свободные подключения закрываются, выданные - закрываются или возвращаются в пул при освобождении
         """
-        while not self._pool.empty():
-            self._pool.get_nowait().close()
+        with self._overflow_lock:
+            records: List[ConnectionRecord] = list(self._idle)
+            self._idle.clear()
 
-        self._overflow = 0 - self.size
+        for record in records:
+            self._discard(record)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Метрики и текущее состояние пула
+
+        Returns:
+            Словарь с размером пула, кол-вом свободных и занятых подключений, переполнением и метриками PoolMetrics
+        """
+        result: Dict[str, Any] = dict(size=self.size, checkedin=self.checkedin, checkedout=self.checkedout,
+                                      overflow=self.overflow)
+        result.update(self.metrics.snapshot())
+        return result
 
     def status(self) -> str:
         """
@@ -146,7 +469,7 @@ class GenericConnectionPool(AbstractConnectionPool):
         Returns:
             int
         """
-        return self._pool.maxsize
+        return self._size
 
     @property
     def timeout(self) -> int:
@@ -164,7 +487,7 @@ class GenericConnectionPool(AbstractConnectionPool):
         Returns:
             int
         """
-        return self._pool.qsize()
+        return len(self._idle)
 
     @property
     def overflow(self) -> int:
@@ -182,7 +505,7 @@ class GenericConnectionPool(AbstractConnectionPool):
         Returns:
             int
         """
-        return self._pool.maxsize - self._pool.qsize() + self._overflow
+        return len(self._checked_out)
 
     def test_acquire(self, username: str, password: str):
         """
@@ -202,6 +525,95 @@ class GenericConnectionPool(AbstractConnectionPool):
         return self.connection_fabric(**credentials)
 
 
+class AsyncConnectionPool(AbstractAsyncConnectionPool):
+
+    def __init__(self, connection_fabric: Callable, credentials: dict, pool_size: int = 5, timeout: int = 30,
+                 reset_on_return: bool = True):
+        """
+        Пул подключений асинхронного драйвера (aiosqlite, aioodbc)
+
+        Args:
+            connection_fabric(Callable): фабрика подключений к БД, результат которой ожидается через await
+            credentials(dict): данные для подключения
+            pool_size(int): максимальное кол-во открытых подключений
+            timeout(int): время ожидания свободного подключения
+            reset_on_return(bool): откатывать незавершенную транзакцию при возврате подключения в пул
+        """
+        self.connection_fabric: Callable = connection_fabric
+        self.credentials: dict = credentials
+        self.size: int = pool_size
+        self.timeout: int = timeout
+        self.reset_on_return: bool = reset_on_return
+        self.logger: logging.Logger = logging.getLogger()
+        self._idle: List[Any] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        # Семафор создается в цикле событий, в котором используется пул
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        return self._slots
+
+    async def acquire(self) -> Any:
+        """
+        Получить подключение
+
+        Raises:
+            TimeoutError: если свободное подключение не появилось за время ожидания
+        """
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Нет свободного подключения к БД в пуле размером {self.size}")
+
+        if self._idle:
+            return self._idle.pop()
+
+        try:
+            return await self.connection_fabric(**self.credentials)
+        except Exception as e:
+            self.slots.release()
+            ex = union_exception(e)
+            raise ex(str(e)) if ex else e
+
+    async def release(self, conn: Any):
+        """
+        Вернуть подключение в пул
+
+        Args:
+            conn: подключение
+        """
+        try:
+            if self.reset_on_return:
+                await conn.rollback()
+            self._idle.append(conn)
+        except Exception as e:
+            self.logger.warning(f"Подключение не удалось вернуть в пул и оно будет закрыто: {e}")
+            await self._close(conn)
+        finally:
+            self.slots.release()
+
+    async def _close(self, conn: Any):
+        try:
+            await conn.close()
+        except Exception as e:
+            self.logger.warning(f"Ошибка при закрытии подключения: {e}")
+
+    async def dispose(self) -> None:
+        """
+        Закрыть свободные подключения
+        """
+        while self._idle:
+            await self._close(self._idle.pop())
+
+
+class AsyncDAO(AbstractAsyncDAO):
+    """
+    Database adapter for asyncio
+    """
+
+
 class DAO(AbstractDAO):
     """
     Database adapter
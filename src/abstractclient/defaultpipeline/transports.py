@@ -3,8 +3,9 @@ from ..http import HTTPFactory
 from ..smtp import SMTPFactory
 
 try:
-    from ..grpc import GRPCFactory
+    from ..grpc import GRPCFactory, AsyncGRPCFactory
 except ImportError:
     GRPCFactory = None
+    AsyncGRPCFactory = None
 
-__all__ = ['HTTPFactory', 'SMTPFactory', 'GRPCFactory']
+__all__ = ['HTTPFactory', 'SMTPFactory', 'GRPCFactory', 'AsyncGRPCFactory']
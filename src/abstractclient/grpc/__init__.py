@@ -1,26 +1,31 @@
 # -*- coding: utf-8 -*-
 import grpc
+import asyncio
 import logging
 from importlib import import_module
-from typing import Dict, Tuple, List, Optional, Any
+from queue import Queue
+from itertools import islice, chain
+from typing import Dict, List, Optional, Any, Type, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator, Union
 from google.protobuf.reflection import GeneratedProtocolMessageType
 
-from .. import environment
+from .channels import ChannelPool, AsyncChannelPool
+from .interceptors import GRPCMetrics, MetricsInterceptor, ASYNC_METRICS_INTERCEPTORS
+from .policies import build_service_config
+from .streams import RequestStream, AsyncRequestStream
+from .utils import MAX_LOG_LENGTH, format_message  # noqa: F401
 from ..abstractpipeline import AbstractFactory
-from ..constants import TR
-from ..utils import gzip_data
-
-MAX_LOG_LENGTH: int = environment.get("MAX_LOG_LENGTH", 5000)
 
 
 class GRPCFactory(AbstractFactory):
     """
     Фабрика коннектов gRPC
     """
-    __timeout: int
-    __channels: Dict[str, grpc.Channel] = dict()
-    __stubs: Dict[Tuple[str, str], Any] = dict()
-    __metadata: List[Tuple[str, str]] = list()
+    _pool_cls: Type[ChannelPool] = ChannelPool
+    _interceptor_classes: Tuple[Type, ...] = (MetricsInterceptor,)
+    _channels: Dict[str, ChannelPool]
+    _stubs: Dict[str, Any]
+    _service_config: Optional[str]
+    metrics: GRPCMetrics
 
     def __init__(self, config: Dict):
         """
@@ -32,12 +37,24 @@ class GRPCFactory(AbstractFactory):
         """
         self.logger = logging.getLogger(__name__)
         self.__config = config
+        self._channels = dict()
+        self._stubs = dict()
+        self.__stub_configs: Dict[str, Dict] = dict()
+        self.metrics = GRPCMetrics()
+        # Политики retry и hedging применяются при создании каналов, поэтому соберем их до настройки каналов
+        self._service_config = build_service_config(config.get("stubs") or [], config.get("retry_throttling"))
         self.setup_channels()
         self.setup_stubs()
 
     def __del__(self):
-        for name, chanel in self.__channels.items():
-            chanel.close()
+        self.close()
+
+    def close(self):
+        """
+        Закрыть все каналы фабрики
+        """
+        for name, pool in getattr(self, "_channels", {}).items():
+            pool.close()
 
     def setup_channels(self, cfg: Optional[List[Dict]] = None):
         """
@@ -53,30 +70,49 @@ class GRPCFactory(AbstractFactory):
             raise ValueError("Не заданы настройки каналов gRPC. Проверьте в конфигурации раздел transport.channels")
 
         for item in config:
-            url: str = item.get("url")
-            if not url:
-                raise ValueError("Не задан url адрес")
-
-            # Если задан SSL сертификат, то создадим для канала полномочия
-            certs_filename = item.get("verify")
-            credentials = None
-            if certs_filename:
-                try:
-                    with open(certs_filename, 'rb') as f:
-                        trusted_certs = f.read()
-                    credentials = grpc.ssl_channel_credentials(root_certificates=trusted_certs)
-                except (OSError, IOError, EOFError):
-                    self.logger.error("Не удалось прочитать SSL сертификат. Будет создан незащищенный канал.")
+            # Создадим пул gRPC каналов. Таймаут и метаданные хранятся в пуле и относятся только к нему
+            pool = self._pool_cls(item, self._interceptors(), self._service_config)
+
+            # Если канал перенастраивается, закроем прежний пул
+            if pool.alias in self._channels:
+                self._discard_pool(self._channels[pool.alias])
+
+            # Создадим для нового пула ранее настроенные stubs
+            for stub_name, stub_cls in self._stubs.items():
+                pool.add_stub(stub_name, stub_cls)
+
+            self._channels[pool.alias] = pool
+
+    def _interceptors(self) -> List[Any]:
+        """
+        Перехватчики вызовов для каналов фабрики. Сбор метрик отключается параметром metrics = false
+
+        Returns:
+            Список перехватчиков
+        """
+        if not self.__config.get("metrics", True):
+            return []
+        return [interceptor_cls(self.metrics) for interceptor_cls in self._interceptor_classes]
+
+    def _ordered_channels(self) -> List[Tuple[str, ChannelPool]]:
+        """
+        Порядок перебора каналов при выполнении запроса: сначала готовые к работе, затем подключающиеся,
+        последними - недоступные, находящиеся в окне failure_backoff. Внутри группы сохраняется порядок конфигурации
 
-            # Запомним таймаут, если задан
-            self.__timeout = item.get("timeout", TR.SESSION_TIMEOUT)
+        Returns:
+            Список пар (alias, пул каналов)
+        """
+        return sorted(self._channels.items(), key=lambda item: 0 if item[1].ready else 2 if item[1].backing_off else 1)
 
-            # Если есть метаданные, запомним для дальнейшего использования
-            self.__metadata.extend(item.get("metadata").items()) if item.get("metadata") else None
+    def _discard_pool(self, pool: ChannelPool):
+        """
+        Закрыть пул каналов, замененный при перенастройке
 
-            # Создадим gRPC канал
-            chanel = grpc.secure_channel(url, credentials) if credentials else grpc.insecure_channel(url)
-            self.__channels[item.get("alias").lower()] = chanel
+        Args:
+            pool: Пул каналов
+
+        """
+        pool.close()
 
     def setup_stubs(self, cfg: Optional[List[Dict]] = None):
         """
@@ -98,10 +134,18 @@ class GRPCFactory(AbstractFactory):
             if not module_name or not stub_class:
                 raise ValueError("Не заданы модуль и имя stub класса")
 
-            # Создадим Stub для каждого канала и добавим его в список
-            module = import_module(module_name)
-            for chanel_name, chanel in self.__channels.items():
-                self.__stubs[(chanel_name, stub_name)] = getattr(module, stub_class)(chanel)
+            # Создадим Stub для каждого канала каждого пула
+            self._stubs[stub_name] = getattr(import_module(module_name), stub_class)
+            self.__stub_configs[stub_name] = item
+            for pool in self._channels.values():
+                pool.add_stub(stub_name, self._stubs[stub_name])
+
+        # Если изменились политики retry и hedging, пересоздадим каналы с новым service config
+        service_config = build_service_config(self.__stub_configs.values(), self.__config.get("retry_throttling"))
+        if service_config != self._service_config:
+            self._service_config = service_config
+            if self._channels:
+                self.setup_channels([pool.config for pool in self._channels.values()])
 
     def execute(self, service_name: str, method_name: str,
                 data: Optional[GeneratedProtocolMessageType] = None) -> Optional[GeneratedProtocolMessageType]:
@@ -120,25 +164,528 @@ class GRPCFactory(AbstractFactory):
         response: Optional[GeneratedProtocolMessageType] = None
 
         # Запрос будет последовательно выполняться для всех сессий, заданных в конфигурации, до успеха
-        for i, (chanel_name, chanel) in enumerate(self.__channels.items()):
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
             # Попробуем выполнить запрос в рамках сессии, если ошибка то следующей и т.д.
             try:
-                log = data if len(str(data)) < MAX_LOG_LENGTH else gzip_data(str(data).encode())
-                self.logger.debug(f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}\n"
-                                  f"Данные: {log}")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}\n"
+                                      f"Данные: {format_message(data)}")
 
                 # Проверим наличие вызываемого метода в сконфигурированном stub и вызовем его
-                method = getattr(self.__stubs[(chanel_name, service_name)], method_name)
-                response = method(request=data, timeout=self.__timeout, metadata=self.__metadata)
+                with pool.stub(service_name) as stub:
+                    method = getattr(stub, method_name)
+                    response = method(request=data, timeout=pool.timeout, metadata=pool.metadata)
 
-                log = response if len(str(response)) < MAX_LOG_LENGTH else gzip_data(str(response).encode())
-                self.logger.debug(f"\nОтвет: {log}")
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"\nОтвет: {format_message(response)}")
 
                 break
 
             except grpc.RpcError as e:
                 self.logger.exception(f"Ошибка выполнения запроса к gRPC сервису: {str(e)}")
-                if i == len(self.__channels) - 1:
+                if i == len(self._channels) - 1:
                     raise
+                self.metrics.record_failover(service_name, method_name)
 
         return response
+
+    def execute_many(self, service_name: str, method_name: str,
+                     data: Iterable[GeneratedProtocolMessageType], concurrency: int = 100,
+                     return_exceptions: bool = False) -> List[Any]:
+        """
+        Выполняет набор запросов к сервису gRPC одновременно, через future интерфейс stub
+
+        Вызовы не занимают отдельных потоков, ограничение concurrency задает максимальное кол-во
+        одновременно выполняющихся запросов. При ошибке запрос повторяется на следующем канале.
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Последовательность передаваемых данных
+            concurrency: Максимальное кол-во одновременных запросов
+            return_exceptions: Вернуть исключение в списке результатов, вместо его вызова
+
+        Returns:
+            Список ответов сервиса в порядке переданных данных
+
+        """
+        if concurrency < 1:
+            raise ValueError("Кол-во одновременных запросов должно быть больше 0")
+
+        pools: List[ChannelPool] = [pool for name, pool in self._ordered_channels()]
+        items: Iterator[Tuple[int, GeneratedProtocolMessageType]] = enumerate(data)
+        results: Dict[int, Any] = dict()
+        active: Dict[int, Tuple[GeneratedProtocolMessageType, Optional[grpc.Future]]] = dict()
+        completed: Queue = Queue()
+
+        def submit(number: int, request: GeneratedProtocolMessageType, attempt: int):
+            pool: ChannelPool = pools[attempt]
+            try:
+                index, stub = pool.acquire(service_name)
+            except grpc.RpcError as e:
+                # Канал не готов - ошибка обрабатывается как ошибка вызова, с переходом на следующий канал
+                active[number] = (request, None)
+                completed.put((number, attempt, e))
+                return
+            try:
+                future = getattr(stub, method_name).future(request=request, timeout=pool.timeout,
+                                                           metadata=pool.metadata)
+            except Exception:
+                pool.release(index)
+                raise
+
+            def done(f: grpc.Future):
+                pool.release(index)
+                completed.put((number, attempt, f))
+
+            active[number] = (request, future)
+            future.add_done_callback(done)
+
+        self.logger.debug(f"Сервис: {service_name} Метод: {method_name} Одновременных запросов: {concurrency}")
+
+        try:
+            for number, request in islice(items, concurrency):
+                submit(number, request, 0)
+
+            while active:
+                number, attempt, outcome = completed.get()
+                request, _ = active.pop(number)
+                try:
+                    if not isinstance(outcome, grpc.Future):
+                        raise outcome
+                    results[number] = outcome.result()
+                except grpc.RpcError as e:
+                    self.logger.error(f"Ошибка выполнения запроса к gRPC сервису в канале {pools[attempt].alias}: "
+                                      f"{str(e)}")
+                    # Повторим запрос на следующем канале, заданном в конфигурации
+                    if attempt < len(pools) - 1:
+                        self.metrics.record_failover(service_name, method_name)
+                        submit(number, request, attempt + 1)
+                        continue
+                    if not return_exceptions:
+                        raise
+                    results[number] = e
+
+                # Освободилось место - отправим следующий запрос
+                for number, request in islice(items, 1):
+                    submit(number, request, 0)
+        except BaseException:
+            for request, future in active.values():
+                if future is not None:
+                    future.cancel()
+            raise
+
+        return [results[number] for number in range(len(results))]
+
+    def __open_stream(self, service_name: str, method_name: str, data: Any,
+                      requests: Optional[RequestStream], timeout: Optional[int]) -> Iterator[Any]:
+        """
+        Открывает поток ответов сервиса, переключаясь на следующий канал, пока не получено первое сообщение
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Передаваемые данные для unary запроса
+            requests: Поток исходящих сообщений
+            timeout: Таймаут на весь поток
+
+        Returns:
+            Итератор ответов сервиса
+
+        """
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
+            title: str = f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}"
+            index, stub = pool.acquire(service_name)
+            try:
+                self.logger.debug(f"{title} Открытие потока")
+                responses = getattr(stub, method_name)(
+                    iter(requests) if requests is not None else data,
+                    timeout=timeout or pool.timeout, metadata=pool.metadata
+                )
+                # Дождемся первого сообщения. До него поток можно повторить на другом канале
+                first: Any = next(responses, None)
+            except grpc.RpcError as e:
+                pool.release(index)
+                self.logger.exception(f"Ошибка открытия потока к gRPC сервису: {str(e)}")
+                if i == len(self._channels) - 1 or (requests is not None and not requests.replayable):
+                    raise
+                self.metrics.record_failover(service_name, method_name)
+                continue
+            except BaseException:
+                pool.release(index)
+                raise
+
+            return self.__read_stream(pool, index, responses, first, title)
+
+    def __read_stream(self, pool: ChannelPool, index: int, responses: Any, first: Any, title: str) -> Iterator[Any]:
+        """
+        Читает поток ответов сервиса по одному сообщению
+
+        Args:
+            pool: Пул каналов, в котором открыт поток
+            index: Индекс канала в пуле
+            responses: Поток ответов gRPC
+            first: Первое, уже полученное сообщение
+            title: Описание вызова для лога
+
+        Returns:
+            Итератор ответов сервиса
+
+        """
+        received: int = 0
+        try:
+            if first is None:
+                return
+            for message in chain((first,), responses):
+                received += 1
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"{title} Ответ #{received}: {format_message(message)}")
+                yield message
+        finally:
+            # Если поток прочитан не до конца, отменим вызов, чтобы не держать канал
+            responses.cancel()
+            pool.release(index)
+            self.logger.debug(f"{title} Поток закрыт, получено сообщений: {received}")
+
+    def execute_unary_stream(self, service_name: str, method_name: str,
+                             data: Optional[GeneratedProtocolMessageType] = None,
+                             timeout: Optional[int] = None) -> Iterator[GeneratedProtocolMessageType]:
+        """
+        Выполняет запрос к сервису gRPC с потоком ответов (server streaming)
+
+        Ответы читаются из сети по мере чтения итератора. Если итератор не дочитан до конца, его нужно закрыть,
+        например, через contextlib.closing
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Передаваемые данные
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Итератор ответов сервиса
+
+        Example:
+
+            .. code-block:: python
+
+                for price in self.transport['prices'].execute_unary_stream("prices", "Export", request):
+                    tr.execute(sql, (price.article, price.value), fetch=tr.NOTHING)
+        """
+        return self.__open_stream(service_name, method_name, data, None, timeout)
+
+    def execute_stream_unary(self, service_name: str, method_name: str,
+                             data: Iterable[GeneratedProtocolMessageType],
+                             timeout: Optional[int] = None) -> Optional[GeneratedProtocolMessageType]:
+        """
+        Выполняет запрос к сервису gRPC с потоком передаваемых данных (client streaming)
+
+        Сообщения берутся из итератора по мере их отправки в сеть
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Итератор передаваемых данных
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Ответ сервиса
+
+        """
+        response: Optional[GeneratedProtocolMessageType] = None
+        requests = RequestStream(data, self.logger, f"Сервис: {service_name} Метод: {method_name}")
+
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
+            title: str = f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}"
+            try:
+                with pool.stub(service_name) as stub:
+                    response = getattr(stub, method_name)(
+                        iter(requests), timeout=timeout or pool.timeout, metadata=pool.metadata
+                    )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"{title} Отправлено сообщений: {requests.sent}\n"
+                                      f"Ответ: {format_message(response)}")
+                break
+
+            except grpc.RpcError as e:
+                self.logger.exception(f"Ошибка выполнения запроса к gRPC сервису: {str(e)}")
+                if i == len(self._channels) - 1 or not requests.replayable:
+                    raise
+                self.metrics.record_failover(service_name, method_name)
+
+        return response
+
+    def execute_stream_stream(self, service_name: str, method_name: str,
+                              data: Iterable[GeneratedProtocolMessageType],
+                              timeout: Optional[int] = None) -> Iterator[GeneratedProtocolMessageType]:
+        """
+        Выполняет двунаправленный потоковый запрос к сервису gRPC (bidirectional streaming)
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Итератор передаваемых данных
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Итератор ответов сервиса
+
+        """
+        requests = RequestStream(data, self.logger, f"Сервис: {service_name} Метод: {method_name}")
+        return self.__open_stream(service_name, method_name, None, requests, timeout)
+
+
+class AsyncGRPCFactory(GRPCFactory):
+    """
+    Асинхронная фабрика коннектов gRPC на grpc.aio
+    """
+    _pool_cls: Type[ChannelPool] = AsyncChannelPool
+    _interceptor_classes: Tuple[Type, ...] = ASYNC_METRICS_INTERCEPTORS
+
+    def __del__(self):
+        # Каналы grpc.aio закрываются корутиной, вызывайте await close() до остановки цикла событий
+        pass
+
+    async def close(self):
+        """
+        Закрыть все каналы фабрики
+        """
+        for name, pool in self._channels.items():
+            await pool.close()
+
+    def _discard_pool(self, pool: AsyncChannelPool):
+        """
+        Закрыть пул каналов, замененный при перенастройке
+
+        Args:
+            pool: Пул каналов
+
+        """
+        # Каналы пула создаются при первом вызове. Если вызовов еще не было, закрывать нечего
+        if not pool.channels:
+            return
+        try:
+            asyncio.get_running_loop().create_task(pool.close())
+        except RuntimeError:
+            self.logger.warning(f"Пул каналов {pool.alias} заменен вне цикла событий и не был закрыт")
+
+    async def execute(self, service_name: str, method_name: str,
+                      data: Optional[GeneratedProtocolMessageType] = None) -> Optional[GeneratedProtocolMessageType]:
+        """
+        Выполняет запрос к сервису gRPC, не блокируя цикл событий
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Передаваемые данные
+
+        Returns:
+            Ответ сервиса
+
+        Example:
+
+            .. code-block:: python
+
+                responses = await asyncio.gather(*[
+                    self.transport['stores'].execute("prices", "Upload", request) for request in requests
+                ])
+        """
+        response: Optional[GeneratedProtocolMessageType] = None
+
+        # Запрос будет последовательно выполняться для всех каналов, заданных в конфигурации, до успеха
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
+            try:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}\n"
+                                      f"Данные: {format_message(data)}")
+
+                async with pool.stub(service_name) as stub:
+                    method = getattr(stub, method_name)
+                    response = await method(request=data, timeout=pool.timeout, metadata=pool.metadata)
+
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"\nОтвет: {format_message(response)}")
+
+                break
+
+            except grpc.RpcError as e:
+                self.logger.exception(f"Ошибка выполнения запроса к gRPC сервису: {str(e)}")
+                if i == len(self._channels) - 1:
+                    raise
+                self.metrics.record_failover(service_name, method_name)
+
+        return response
+
+    async def execute_many(self, service_name: str, method_name: str,
+                           data: Iterable[GeneratedProtocolMessageType], concurrency: int = 100,
+                           return_exceptions: bool = False) -> List[Any]:
+        """
+        Выполняет набор запросов к сервису gRPC одновременно
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Последовательность передаваемых данных
+            concurrency: Максимальное кол-во одновременных запросов
+            return_exceptions: Вернуть исключение в списке результатов, вместо его вызова
+
+        Returns:
+            Список ответов сервиса в порядке переданных данных
+
+        """
+        if concurrency < 1:
+            raise ValueError("Кол-во одновременных запросов должно быть больше 0")
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(request: GeneratedProtocolMessageType):
+            async with semaphore:
+                return await self.execute(service_name, method_name, request)
+
+        return await asyncio.gather(*[call(request) for request in data], return_exceptions=return_exceptions)
+
+    async def __stream(self, service_name: str, method_name: str, data: Any,
+                       requests: Optional[AsyncRequestStream], timeout: Optional[int]) -> AsyncIterator[Any]:
+        """
+        Открывает поток ответов сервиса, переключаясь на следующий канал, пока не получено первое сообщение,
+        и читает его по одному сообщению
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Передаваемые данные для unary запроса
+            requests: Поток исходящих сообщений
+            timeout: Таймаут на весь поток
+
+        Returns:
+            Асинхронный итератор ответов сервиса
+
+        """
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
+            title: str = f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}"
+            index: Optional[int] = None
+            try:
+                index, stub = await pool.acquire(service_name)
+                self.logger.debug(f"{title} Открытие потока")
+                call = getattr(stub, method_name)(
+                    requests.__aiter__() if requests is not None else data,
+                    timeout=timeout or pool.timeout, metadata=pool.metadata
+                )
+                # Дождемся первого сообщения. До него поток можно повторить на другом канале
+                message: Any = await call.read()
+            except grpc.RpcError as e:
+                if index is not None:
+                    pool.release(index)
+                self.logger.exception(f"Ошибка открытия потока к gRPC сервису: {str(e)}")
+                if i == len(self._channels) - 1 or (requests is not None and not requests.replayable):
+                    raise
+                self.metrics.record_failover(service_name, method_name)
+                continue
+            except BaseException:
+                if index is not None:
+                    pool.release(index)
+                raise
+            break
+        else:
+            return
+
+        received: int = 0
+        try:
+            while message is not grpc.aio.EOF:
+                received += 1
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"{title} Ответ #{received}: {format_message(message)}")
+                yield message
+                message = await call.read()
+        finally:
+            # Если поток прочитан не до конца, отменим вызов, чтобы не держать канал
+            call.cancel()
+            pool.release(index)
+            self.logger.debug(f"{title} Поток закрыт, получено сообщений: {received}")
+
+    def execute_unary_stream(self, service_name: str, method_name: str,
+                             data: Optional[GeneratedProtocolMessageType] = None,
+                             timeout: Optional[int] = None) -> AsyncIterator[GeneratedProtocolMessageType]:
+        """
+        Выполняет запрос к сервису gRPC с потоком ответов (server streaming)
+
+        Поток открывается при чтении первого ответа. Если итератор не дочитан до конца, его нужно закрыть
+        через await aclose()
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Передаваемые данные
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Асинхронный итератор ответов сервиса
+
+        Example:
+
+            .. code-block:: python
+
+                async for price in self.transport['prices'].execute_unary_stream("prices", "Export", request):
+                    await tr.execute(sql, (price.article, price.value), fetch=tr.NOTHING)
+        """
+        return self.__stream(service_name, method_name, data, None, timeout)
+
+    async def execute_stream_unary(self, service_name: str, method_name: str,
+                                   data: Union[Iterable[GeneratedProtocolMessageType],
+                                               AsyncIterable[GeneratedProtocolMessageType]],
+                                   timeout: Optional[int] = None) -> Optional[GeneratedProtocolMessageType]:
+        """
+        Выполняет запрос к сервису gRPC с потоком передаваемых данных (client streaming)
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Обычный или асинхронный итератор передаваемых данных
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Ответ сервиса
+
+        """
+        response: Optional[GeneratedProtocolMessageType] = None
+        requests = AsyncRequestStream(data, self.logger, f"Сервис: {service_name} Метод: {method_name}")
+
+        for i, (chanel_name, pool) in enumerate(self._ordered_channels()):
+            title: str = f"Канал: {chanel_name} Сервис: {service_name} Метод: {method_name}"
+            try:
+                async with pool.stub(service_name) as stub:
+                    response = await getattr(stub, method_name)(
+                        requests.__aiter__(), timeout=timeout or pool.timeout, metadata=pool.metadata
+                    )
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"{title} Отправлено сообщений: {requests.sent}\n"
+                                      f"Ответ: {format_message(response)}")
+                break
+
+            except grpc.RpcError as e:
+                self.logger.exception(f"Ошибка выполнения запроса к gRPC сервису: {str(e)}")
+                if i == len(self._channels) - 1 or not requests.replayable:
+                    raise
+                self.metrics.record_failover(service_name, method_name)
+
+        return response
+
+    def execute_stream_stream(self, service_name: str, method_name: str,
+                              data: Union[Iterable[GeneratedProtocolMessageType],
+                                          AsyncIterable[GeneratedProtocolMessageType]],
+                              timeout: Optional[int] = None) -> AsyncIterator[GeneratedProtocolMessageType]:
+        """
+        Выполняет двунаправленный потоковый запрос к сервису gRPC (bidirectional streaming)
+
+        Args:
+            service_name: Наименование сервиса
+            method_name: Наименование метода
+            data: Обычный или асинхронный итератор передаваемых данных
+            timeout: Таймаут на весь поток, по умолчанию таймаут канала
+
+        Returns:
+            Асинхронный итератор ответов сервиса
+
+        """
+        requests = AsyncRequestStream(data, self.logger, f"Сервис: {service_name} Метод: {method_name}")
+        return self.__stream(service_name, method_name, None, requests, timeout)
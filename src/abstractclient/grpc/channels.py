@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+import grpc
+import asyncio
+import logging
+import threading
+from time import monotonic
+from itertools import count
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, List, Tuple, Any, Optional, Generator, Sequence, AsyncIterator
+
+from ..constants import TR
+
+BALANCING_ROUND_ROBIN: str = "round_robin"
+BALANCING_LEAST_LOADED: str = "least_loaded"
+
+COMPRESSION: Dict[str, grpc.Compression] = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+# Параметры конфигурации канала и соответствующие им аргументы gRPC канала
+CHANNEL_ARGS: Dict[str, str] = {
+    "max_send_message_length": "grpc.max_send_message_length",
+    "max_receive_message_length": "grpc.max_receive_message_length",
+    "keepalive_time_ms": "grpc.keepalive_time_ms",
+    "keepalive_timeout_ms": "grpc.keepalive_timeout_ms",
+    "keepalive_permit_without_calls": "grpc.keepalive_permit_without_calls",
+}
+
+Metadata = Tuple[Tuple[str, str], ...]
+
+
+class ChannelNotReadyError(grpc.RpcError):
+    """ Канал не перешел в состояние READY за время ожидания ready_timeout """
+
+    def __init__(self, alias: str, timeout: float):
+        super().__init__(f"Канал {alias} не готов к работе в течение {timeout} сек.")
+        self.alias = alias
+
+    def code(self) -> grpc.StatusCode:
+        return grpc.StatusCode.UNAVAILABLE
+
+    def details(self) -> str:
+        return str(self)
+
+
+class ChannelPool:
+    """
+    Пул gRPC каналов к одному адресу (alias из раздела transport.channels)
+    """
+    alias: str
+    url: str
+    timeout: int
+    metadata: Metadata
+    size: int
+    balancing: str
+    compression: grpc.Compression
+    failure_backoff: float
+    wait_for_ready: bool
+    ready_timeout: float
+    channel_args: List[Tuple[str, Any]]
+    channels: List[grpc.Channel]
+    lazy: bool = False
+
+    def __init__(self, config: Dict, interceptors: Sequence[Any] = (), service_config: Optional[str] = None):
+        """
+        Настройка пула каналов
+
+        Args:
+            config: Словарь с настройками канала
+            interceptors: Перехватчики вызовов, устанавливаемые на каждый канал
+            service_config: service config gRPC в формате JSON (политики retry и hedging)
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.interceptors = tuple(interceptors)
+        self.service_config = service_config
+
+        self.url = config.get("url")
+        if not self.url:
+            raise ValueError("Не задан url адрес")
+
+        self.alias = config.get("alias", self.url).lower()
+        self.timeout = config.get("timeout", TR.SESSION_TIMEOUT)
+        self.metadata = tuple((config.get("metadata") or {}).items())
+
+        self.size = int(config.get("pool_size", 1))
+        if self.size < 1:
+            raise ValueError(f"Размер пула каналов {self.alias} должен быть больше 0")
+
+        self.balancing = config.get("balancing", BALANCING_ROUND_ROBIN).lower()
+        if self.balancing not in (BALANCING_ROUND_ROBIN, BALANCING_LEAST_LOADED):
+            raise ValueError(f"Неизвестная стратегия балансировки каналов {self.balancing}. "
+                             f"Должна быть одна из {BALANCING_ROUND_ROBIN}, {BALANCING_LEAST_LOADED}")
+
+        compression: str = str(config.get("compression", "none")).lower()
+        if compression not in COMPRESSION:
+            raise ValueError(f"Неизвестный алгоритм сжатия {compression}. Должен быть один из {', '.join(COMPRESSION)}")
+        self.compression = COMPRESSION[compression]
+
+        # Канал в TRANSIENT_FAILURE не выбирается для вызовов в течение failure_backoff секунд.
+        # Если включен wait_for_ready, вызов ждет готовности канала не более ready_timeout секунд
+        self.failure_backoff = float(config.get("failure_backoff", 5))
+        self.wait_for_ready = bool(config.get("wait_for_ready", False))
+        self.ready_timeout = float(config.get("ready_timeout", 1))
+
+        self.channel_args = self.__load_channel_args(config)
+        self.credentials = self.__load_credentials(config.get("verify"))
+        self.channels = list()
+        self.__stub_classes: Dict[str, Any] = dict()
+        self.__stubs: Dict[str, List[Any]] = dict()
+        self.__in_flight: List[int] = [0] * self.size
+        self.__states: List[grpc.ChannelConnectivity] = [grpc.ChannelConnectivity.IDLE] * self.size
+        self.__failed_at: List[float] = [0.0] * self.size
+        self.__counter = count()
+        self.__lock = threading.Lock()
+
+        if not self.lazy:
+            self.open()
+
+    def __load_credentials(self, certs_filename: Optional[str]) -> Optional[grpc.ChannelCredentials]:
+        """
+        Если задан SSL сертификат, то создадим для канала полномочия
+
+        Args:
+            certs_filename: Путь к файлу сертификата
+
+        Returns:
+            Полномочия защищенного канала или None
+
+        """
+        if not certs_filename:
+            return None
+        try:
+            with open(certs_filename, 'rb') as f:
+                trusted_certs = f.read()
+            return grpc.ssl_channel_credentials(root_certificates=trusted_certs)
+        except (OSError, IOError, EOFError):
+            self.logger.error("Не удалось прочитать SSL сертификат. Будет создан незащищенный канал.")
+            return None
+
+    def __load_channel_args(self, config: Dict) -> List[Tuple[str, Any]]:
+        """
+        Считывает из настроек аргументы gRPC канала: ограничения размера сообщений, keepalive и
+        произвольные аргументы grpc.* из раздела options
+
+        Args:
+            config: Словарь с настройками канала
+
+        Returns:
+            Список аргументов gRPC канала
+
+        """
+        args: Dict[str, Any] = {arg: config[key] for key, arg in CHANNEL_ARGS.items() if config.get(key) is not None}
+
+        for arg, value in (config.get("options") or {}).items():
+            if not arg.startswith("grpc."):
+                raise ValueError(f"Аргумент канала {arg} должен начинаться с grpc.")
+            args[arg] = value
+
+        return list(args.items())
+
+    def options(self) -> List[Tuple[str, Any]]:
+        """
+        Параметры создания канала
+
+        Returns:
+            Список параметров gRPC канала
+
+        """
+        options: List[Tuple[str, Any]] = list(self.channel_args)
+        # Явно заданный в options service config имеет приоритет над собранным из политик stubs
+        if self.service_config and "grpc.service_config" not in dict(options):
+            options.extend([("grpc.service_config", self.service_config), ("grpc.enable_retries", 1)])
+        # Каналы с одинаковыми параметрами gRPC склеивает в одно HTTP/2 соединение через глобальный пул
+        # субканалов. Чтобы каждый канал пула держал собственное соединение, включим локальный пул субканалов
+        if self.size > 1:
+            options.append(("grpc.use_local_subchannel_pool", 1))
+        return options
+
+    def _create_channel(self) -> grpc.Channel:
+        """
+        Создает gRPC канал
+
+        Returns:
+            grpc.Channel
+
+        """
+        options = self.options()
+        if self.credentials:
+            channel = grpc.secure_channel(self.url, self.credentials, options=options, compression=self.compression)
+        else:
+            channel = grpc.insecure_channel(self.url, options=options, compression=self.compression)
+        return grpc.intercept_channel(channel, *self.interceptors) if self.interceptors else channel
+
+    def open(self):
+        """
+        Создает каналы пула и stubs сервисов на них
+        """
+        with self.__lock:
+            if self.channels:
+                return
+            channels = [self._create_channel() for _ in range(self.size)]
+            self.__stubs = {name: [stub_cls(channel) for channel in channels]
+                            for name, stub_cls in self.__stub_classes.items()}
+            self.channels = channels
+
+        for index, channel in enumerate(channels):
+            self._watch(index, channel)
+
+    def _watch(self, index: int, channel: grpc.Channel):
+        """
+        Подписывается на изменение состояния канала. Подписка сразу начинает подключение,
+        поэтому к первому вызову канал, как правило, уже готов
+
+        Args:
+            index: Индекс канала в пуле
+            channel: Канал
+
+        """
+        channel.subscribe(lambda state: self._update_state(index, state), try_to_connect=True)
+
+    def _update_state(self, index: int, state: grpc.ChannelConnectivity):
+        """
+        Запоминает состояние канала и время перехода в TRANSIENT_FAILURE
+
+        Args:
+            index: Индекс канала в пуле
+            state: Состояние канала
+
+        """
+        if state == grpc.ChannelConnectivity.TRANSIENT_FAILURE and self.__states[index] != state:
+            self.__failed_at[index] = monotonic()
+            self.logger.warning(f"Канал {self.alias} #{index} недоступен, повтор не ранее, "
+                                f"чем через {self.failure_backoff} сек.")
+        self.__states[index] = state
+
+    def channel_state(self, index: int) -> grpc.ChannelConnectivity:
+        """
+        Текущее состояние канала
+
+        Args:
+            index: Индекс канала в пуле
+
+        Returns:
+            grpc.ChannelConnectivity
+        """
+        return self.__states[index]
+
+    def __backing_off(self, index: int) -> bool:
+        return self.channel_state(index) == grpc.ChannelConnectivity.TRANSIENT_FAILURE \
+            and monotonic() - self.__failed_at[index] < self.failure_backoff
+
+    @property
+    def ready(self) -> bool:
+        """
+        В пуле есть канал в состоянии READY
+
+        Returns:
+            bool
+        """
+        return any(self.channel_state(index) == grpc.ChannelConnectivity.READY for index in range(len(self.channels)))
+
+    @property
+    def backing_off(self) -> bool:
+        """
+        Все каналы пула недоступны и находятся в окне failure_backoff
+
+        Returns:
+            bool
+        """
+        return bool(self.channels) and all(self.__backing_off(index) for index in range(len(self.channels)))
+
+    def add_stub(self, name: str, stub_cls: Any):
+        """
+        Создает Stub сервиса для каждого канала пула
+
+        Args:
+            name: Наименование сервиса
+            stub_cls: Класс stub, сгенерированный protoc
+
+        """
+        with self.__lock:
+            self.__stub_classes[name] = stub_cls
+            self.__stubs[name] = [stub_cls(channel) for channel in self.channels]
+
+    def __select(self) -> int:
+        """
+        Выбирает индекс канала для очередного вызова
+
+        Returns:
+            Индекс канала в пуле
+
+        """
+        if self.size == 1:
+            return 0
+
+        # Выбираем среди готовых каналов, если их нет - среди каналов вне окна failure_backoff
+        indexes: List[int] = list(range(self.size))
+        candidates: List[int] = [index for index in indexes
+                                 if self.channel_state(index) == grpc.ChannelConnectivity.READY] \
+            or [index for index in indexes if not self.__backing_off(index)] or indexes
+
+        # Смещение счетчика нужно и для round robin, и для равномерного выбора среди одинаково загруженных каналов
+        offset: int = next(self.__counter) % len(candidates)
+        if self.balancing == BALANCING_ROUND_ROBIN:
+            return candidates[offset]
+
+        with self.__lock:
+            return min(candidates[offset:] + candidates[:offset], key=self.__in_flight.__getitem__)
+
+    def _wait_ready(self, index: int):
+        """
+        Ожидает готовности канала не более ready_timeout секунд
+
+        Args:
+            index: Индекс канала в пуле
+
+        """
+        try:
+            grpc.channel_ready_future(self.channels[index]).result(timeout=self.ready_timeout)
+        except grpc.FutureTimeoutError:
+            raise ChannelNotReadyError(self.alias, self.ready_timeout)
+
+    def _select(self, name: str) -> Tuple[int, Any]:
+        """
+        Выбирает канал для вызова, без учета загрузки
+
+        Args:
+            name: Наименование сервиса
+
+        Returns:
+            Индекс канала в пуле и stub сервиса на нем
+
+        """
+        if not self.channels:
+            self.open()
+
+        stubs: Optional[List[Any]] = self.__stubs.get(name)
+        if not stubs:
+            raise ValueError(f"Сервис {name} не найден. Должен быть один из {', '.join(self.__stubs.keys())}")
+
+        index: int = self.__select()
+        return index, stubs[index]
+
+    def _checkout(self, index: int):
+        """
+        Учитывает вызов на канале до вызова release
+
+        Args:
+            index: Индекс канала в пуле
+
+        """
+        with self.__lock:
+            self.__in_flight[index] += 1
+
+    def acquire(self, name: str) -> Tuple[int, Any]:
+        """
+        Выбирает канал для вызова и учитывает его загрузку до вызова release
+
+        Args:
+            name: Наименование сервиса
+
+        Returns:
+            Индекс канала в пуле и stub сервиса на нем
+
+        """
+        index, stub = self._select(name)
+        if self.wait_for_ready and self.channel_state(index) != grpc.ChannelConnectivity.READY:
+            self._wait_ready(index)
+
+        self._checkout(index)
+        return index, stub
+
+    def release(self, index: int):
+        """
+        Снимает с канала учтенный вызов
+
+        Args:
+            index: Индекс канала в пуле, полученный из acquire
+
+        """
+        with self.__lock:
+            self.__in_flight[index] -= 1
+
+    @contextmanager
+    def stub(self, name: str) -> Generator[Any, Any, Any]:
+        """
+        Выдает stub сервиса на одном из каналов пула и учитывает его загрузку на время вызова
+
+        Args:
+            name: Наименование сервиса
+
+        Returns:
+            Stub сервиса
+
+        """
+        index, stub = self.acquire(name)
+        try:
+            yield stub
+        finally:
+            self.release(index)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Кол-во выполняющихся в данный момент вызовов
+
+        Returns:
+            int
+        """
+        return sum(self.__in_flight)
+
+    def close(self):
+        """
+        Закрыть все каналы пула
+        """
+        for channel in self.channels:
+            channel.close()
+        self.channels = list()
+
+
+class AsyncChannelPool(ChannelPool):
+    """
+    Пул каналов grpc.aio к одному адресу
+    """
+    # Каналы grpc.aio привязаны к циклу событий, в котором созданы. Фабрики настраиваются до запуска цикла,
+    # поэтому каналы создаются при первом вызове, уже внутри работающего цикла
+    lazy: bool = True
+
+    def _create_channel(self) -> grpc.aio.Channel:
+        """
+        Создает канал grpc.aio
+
+        Returns:
+            grpc.aio.Channel
+
+        """
+        options = self.options()
+        interceptors = list(self.interceptors) or None
+        if self.credentials:
+            return grpc.aio.secure_channel(self.url, self.credentials, options=options, compression=self.compression,
+                                           interceptors=interceptors)
+        return grpc.aio.insecure_channel(self.url, options=options, compression=self.compression,
+                                         interceptors=interceptors)
+
+    def _watch(self, index: int, channel: grpc.aio.Channel):
+        """
+        Каналы grpc.aio не поддерживают подписку, их состояние считывается при выборе канала
+
+        Args:
+            index: Индекс канала в пуле
+            channel: Канал
+
+        """
+        channel.get_state(try_to_connect=True)
+
+    def channel_state(self, index: int) -> grpc.ChannelConnectivity:
+        """
+        Текущее состояние канала
+
+        Args:
+            index: Индекс канала в пуле
+
+        Returns:
+            grpc.ChannelConnectivity
+        """
+        if index < len(self.channels):
+            self._update_state(index, self.channels[index].get_state())
+        return super().channel_state(index)
+
+    async def _wait_ready(self, index: int):
+        """
+        Ожидает готовности канала не более ready_timeout секунд, не блокируя цикл событий
+
+        Args:
+            index: Индекс канала в пуле
+
+        """
+        try:
+            await asyncio.wait_for(self.channels[index].channel_ready(), self.ready_timeout)
+        except asyncio.TimeoutError:
+            raise ChannelNotReadyError(self.alias, self.ready_timeout)
+
+    async def acquire(self, name: str) -> Tuple[int, Any]:
+        """
+        Выбирает канал для вызова и учитывает его загрузку до вызова release
+
+        Args:
+            name: Наименование сервиса
+
+        Returns:
+            Индекс канала в пуле и stub сервиса на нем
+
+        """
+        index, stub = self._select(name)
+        if self.wait_for_ready and self.channel_state(index) != grpc.ChannelConnectivity.READY:
+            await self._wait_ready(index)
+
+        self._checkout(index)
+        return index, stub
+
+    @asynccontextmanager
+    async def stub(self, name: str) -> AsyncIterator[Any]:
+        """
+        Выдает stub сервиса на одном из каналов пула и учитывает его загрузку на время вызова
+
+        Args:
+            name: Наименование сервиса
+
+        Returns:
+            Stub сервиса
+
+        """
+        index, stub = await self.acquire(name)
+        try:
+            yield stub
+        finally:
+            self.release(index)
+
+    async def close(self):
+        """
+        Закрыть все каналы пула
+        """
+        channels, self.channels = self.channels, list()
+        for channel in channels:
+            await channel.close()
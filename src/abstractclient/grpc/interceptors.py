@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import grpc
+import asyncio
+import threading
+from time import monotonic
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Iterator, Iterable, AsyncIterable, AsyncIterator, Callable, Set, Tuple, Type, Union
+
+from ..metrics import Histogram
+
+
+def message_size(message: Any) -> int:
+    """
+    Размер сериализованного сообщения protobuf, без сериализации и приведения к строке
+
+    Args:
+        message: Сообщение
+
+    Returns:
+        Размер в байтах или 0, если размер неизвестен
+    """
+    return message.ByteSize() if hasattr(message, "ByteSize") else 0
+
+
+def method_name(details: Any) -> str:
+    """
+    Полное имя метода вызова (/package.Service/Method)
+
+    Args:
+        details: Параметры вызова gRPC
+
+    Returns:
+        str
+    """
+    method = details.method
+    return method.decode() if isinstance(method, bytes) else method
+
+
+@dataclass()
+class MethodMetrics:
+    """
+    Метрики вызовов одного метода
+    """
+    latency: Histogram = field(default_factory=Histogram)
+    request_bytes: int = 0
+    response_bytes: int = 0
+    codes: Dict[str, int] = field(default_factory=dict)
+
+
+class GRPCMetrics:
+    """
+    Метрики вызовов gRPC: гистограммы длительности, объем переданных данных, статусы ответов и переключения каналов
+    """
+
+    def __init__(self):
+        self.__methods: Dict[str, MethodMetrics] = dict()
+        self.__failovers: Dict[str, int] = dict()
+        self.__lock = threading.Lock()
+
+    def __method(self, method: str) -> MethodMetrics:
+        metrics: Optional[MethodMetrics] = self.__methods.get(method)
+        if metrics is None:
+            with self.__lock:
+                metrics = self.__methods.setdefault(method, MethodMetrics())
+        return metrics
+
+    def record(self, method: str, seconds: float, code: grpc.StatusCode, request_bytes: int = 0,
+               response_bytes: int = 0):
+        """
+        Учесть завершенный вызов
+
+        Args:
+            method: Полное имя метода
+            seconds: Длительность вызова
+            code: Статус ответа
+            request_bytes: Размер переданных данных
+            response_bytes: Размер полученных данных
+
+        """
+        metrics: MethodMetrics = self.__method(method)
+        metrics.latency.observe(seconds)
+        with self.__lock:
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+            metrics.codes[code.name] = metrics.codes.get(code.name, 0) + 1
+
+    def record_failover(self, service_name: str, method: str):
+        """
+        Учесть переключение вызова на следующий канал
+
+        Args:
+            service_name: Наименование сервиса в настройках stubs
+            method: Наименование метода
+
+        """
+        key: str = f"{service_name}/{method}"
+        with self.__lock:
+            self.__failovers[key] = self.__failovers.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Текущее состояние метрик
+
+        Returns:
+            Словарь с метриками по методам и кол-вом переключений каналов
+        """
+        with self.__lock:
+            latency = {name: item.latency for name, item in self.__methods.items()}
+            methods = {
+                name: {
+                    "request_bytes": item.request_bytes,
+                    "response_bytes": item.response_bytes,
+                    "codes": dict(item.codes),
+                } for name, item in self.__methods.items()
+            }
+            failovers = dict(self.__failovers)
+
+        for name, histogram in latency.items():
+            methods[name]["latency"] = histogram.snapshot()
+
+        return {"methods": methods, "failovers": failovers}
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                         grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
+    """
+    Перехватчик вызовов gRPC канала, собирающий метрики
+
+    Для потоковых вызовов учитывается длительность всего потока и размер исходящих сообщений
+    """
+
+    def __init__(self, metrics: GRPCMetrics):
+        self.metrics = metrics
+
+    def __done(self, method: str, start: float, sent: Callable[[], int], unary_response: bool):
+        def callback(call: Any):
+            code: grpc.StatusCode = call.code() or grpc.StatusCode.UNKNOWN
+            received: int = message_size(call.result()) if unary_response and code == grpc.StatusCode.OK else 0
+            self.metrics.record(method, monotonic() - start, code, sent(), received)
+        return callback
+
+    def __count(self, messages: Iterator[Any], sent: Dict[str, int]) -> Iterator[Any]:
+        for message in messages:
+            sent["bytes"] += message_size(message)
+            yield message
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        start: float = monotonic()
+        outcome = continuation(client_call_details, request)
+        size: int = message_size(request)
+        outcome.add_done_callback(self.__done(method_name(client_call_details), start, lambda: size, True))
+        return outcome
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        start: float = monotonic()
+        outcome = continuation(client_call_details, request)
+        size: int = message_size(request)
+        outcome.add_done_callback(self.__done(method_name(client_call_details), start, lambda: size, False))
+        return outcome
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        start: float = monotonic()
+        sent: Dict[str, int] = {"bytes": 0}
+        outcome = continuation(client_call_details, self.__count(request_iterator, sent))
+        outcome.add_done_callback(self.__done(method_name(client_call_details), start, lambda: sent["bytes"], True))
+        return outcome
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        start: float = monotonic()
+        sent: Dict[str, int] = {"bytes": 0}
+        outcome = continuation(client_call_details, self.__count(request_iterator, sent))
+        outcome.add_done_callback(self.__done(method_name(client_call_details), start, lambda: sent["bytes"], False))
+        return outcome
+
+
+class AsyncCallMetrics:
+    """
+    Учет метрик вызовов канала grpc.aio
+
+    Канал grpc.aio регистрирует перехватчик только для одного типа вызова, поэтому для каждого типа
+    используется отдельный перехватчик
+    """
+
+    def __init__(self, metrics: GRPCMetrics):
+        self.metrics = metrics
+        self.__pending: Set[asyncio.Future] = set()
+
+    async def __record(self, call: Any, method: str, seconds: float, sent: Callable[[], int], unary_response: bool):
+        code: grpc.StatusCode = await call.code() or grpc.StatusCode.UNKNOWN
+        received: int = message_size(await call) if unary_response and code == grpc.StatusCode.OK else 0
+        self.metrics.record(method, seconds, code, sent(), received)
+
+    def _done(self, method: str, start: float, sent: Callable[[], int], unary_response: bool):
+        def callback(call: Any):
+            # Статус вызова grpc.aio доступен только через корутину, поэтому учет выполняется отдельной задачей
+            task: asyncio.Future = asyncio.ensure_future(
+                self.__record(call, method, monotonic() - start, sent, unary_response))
+            self.__pending.add(task)
+            task.add_done_callback(self.__pending.discard)
+        return callback
+
+    async def _count(self, messages: Union[Iterable[Any], AsyncIterable[Any]],
+                     sent: Dict[str, int]) -> AsyncIterator[Any]:
+        if hasattr(messages, "__aiter__"):
+            async for message in messages:
+                sent["bytes"] += message_size(message)
+                yield message
+        else:
+            for message in messages:
+                sent["bytes"] += message_size(message)
+                yield message
+
+    async def _intercept_stream(self, continuation, client_call_details, request_iterator, unary_response: bool):
+        start: float = monotonic()
+        sent: Dict[str, int] = {"bytes": 0}
+        if request_iterator is not None:
+            request_iterator = self._count(request_iterator, sent)
+        call = await continuation(client_call_details, request_iterator)
+        call.add_done_callback(self._done(method_name(client_call_details), start, lambda: sent["bytes"],
+                                          unary_response))
+        return call
+
+
+class AsyncMetricsInterceptor(AsyncCallMetrics, grpc.aio.UnaryUnaryClientInterceptor):
+    """
+    Перехватчик unary вызовов канала grpc.aio, собирающий метрики
+    """
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        start: float = monotonic()
+        call = await continuation(client_call_details, request)
+        try:
+            response = await call
+        except grpc.RpcError as e:
+            self.metrics.record(method_name(client_call_details), monotonic() - start, e.code(), message_size(request))
+            raise
+        self.metrics.record(method_name(client_call_details), monotonic() - start, grpc.StatusCode.OK,
+                            message_size(request), message_size(response))
+        return call
+
+
+class AsyncUnaryStreamMetricsInterceptor(AsyncCallMetrics, grpc.aio.UnaryStreamClientInterceptor):
+    """
+    Перехватчик вызовов unary-stream канала grpc.aio, собирающий метрики длительности всего потока
+    """
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        start: float = monotonic()
+        call = await continuation(client_call_details, request)
+        size: int = message_size(request)
+        call.add_done_callback(self._done(method_name(client_call_details), start, lambda: size, False))
+        return call
+
+
+class AsyncStreamUnaryMetricsInterceptor(AsyncCallMetrics, grpc.aio.StreamUnaryClientInterceptor):
+    """
+    Перехватчик вызовов stream-unary канала grpc.aio, собирающий метрики
+    """
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        return await self._intercept_stream(continuation, client_call_details, request_iterator, True)
+
+
+class AsyncStreamStreamMetricsInterceptor(AsyncCallMetrics, grpc.aio.StreamStreamClientInterceptor):
+    """
+    Перехватчик вызовов stream-stream канала grpc.aio, собирающий метрики длительности всего потока
+    """
+
+    async def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        return await self._intercept_stream(continuation, client_call_details, request_iterator, False)
+
+
+# Перехватчики метрик канала grpc.aio для всех типов вызовов
+ASYNC_METRICS_INTERCEPTORS: Tuple[Type[AsyncCallMetrics], ...] = (
+    AsyncMetricsInterceptor, AsyncUnaryStreamMetricsInterceptor, AsyncStreamUnaryMetricsInterceptor,
+    AsyncStreamStreamMetricsInterceptor,
+)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import json
+import grpc
+from typing import Dict, List, Iterable, Optional, Any
+
+# gRPC ограничивает кол-во попыток retry и hedging пятью, большие значения молча урезаются
+MAX_ATTEMPTS: int = 5
+
+
+def duration(seconds: Any) -> str:
+    """
+    Длительность в формате service config (google.protobuf.Duration в JSON)
+
+    Args:
+        seconds: Кол-во секунд
+
+    Returns:
+        str
+    """
+    return f"{float(seconds):g}s"
+
+
+def status_codes(codes: Iterable[str], policy: str) -> List[str]:
+    """
+    Проверяет и нормализует список статусов ответа
+
+    Args:
+        codes: Наименования статусов, например UNAVAILABLE
+        policy: Наименование политики для сообщения об ошибке
+
+    Returns:
+        Список наименований статусов в верхнем регистре
+    """
+    result: List[str] = [str(code).upper() for code in codes]
+    unknown: List[str] = [code for code in result if code not in grpc.StatusCode.__members__]
+    if unknown:
+        raise ValueError(f"Неизвестные статусы gRPC в политике {policy}: {', '.join(unknown)}")
+    return result
+
+
+def max_attempts(config: Dict, policy: str) -> int:
+    """
+    Проверяет кол-во попыток политики
+
+    Args:
+        config: Словарь с параметрами политики
+        policy: Наименование политики для сообщения об ошибке
+
+    Returns:
+        int
+    """
+    attempts: int = int(config.get("max_attempts", 3))
+    if not 1 < attempts <= MAX_ATTEMPTS:
+        raise ValueError(f"max_attempts политики {policy} должен быть от 2 до {MAX_ATTEMPTS}")
+    return attempts
+
+
+def retry_policy(config: Dict) -> Dict[str, Any]:
+    """
+    Политика повтора запроса
+
+    Args:
+        config: Словарь с параметрами max_attempts, initial_backoff, max_backoff, backoff_multiplier,
+            retryable_status_codes
+
+    Returns:
+        retryPolicy service config
+    """
+    return {
+        "maxAttempts": max_attempts(config, "retry"),
+        "initialBackoff": duration(config.get("initial_backoff", 0.1)),
+        "maxBackoff": duration(config.get("max_backoff", 1)),
+        "backoffMultiplier": float(config.get("backoff_multiplier", 2)),
+        "retryableStatusCodes": status_codes(config.get("retryable_status_codes", ["UNAVAILABLE"]), "retry"),
+    }
+
+
+def hedging_policy(config: Dict) -> Dict[str, Any]:
+    """
+    Политика хеджирования: параллельная отправка копий запроса с задержкой hedging_delay
+
+    Args:
+        config: Словарь с параметрами max_attempts, hedging_delay, non_fatal_status_codes
+
+    Returns:
+        hedgingPolicy service config
+    """
+    return {
+        "maxAttempts": max_attempts(config, "hedging"),
+        "hedgingDelay": duration(config.get("hedging_delay", 0)),
+        "nonFatalStatusCodes": status_codes(config.get("non_fatal_status_codes", ["UNAVAILABLE"]), "hedging"),
+    }
+
+
+def method_config(name: Dict[str, str], config: Dict) -> Optional[Dict[str, Any]]:
+    """
+    Настройка вызова методов сервиса
+
+    Args:
+        name: Имя сервиса и метода в формате service config
+        config: Словарь с настройками retry и hedging
+
+    Returns:
+        methodConfig service config или None, если политики не заданы
+    """
+    retry: Optional[Dict] = config.get("retry")
+    hedging: Optional[Dict] = config.get("hedging")
+    if retry and hedging:
+        raise ValueError(f"Для {name} одновременно заданы политики retry и hedging, допустима только одна")
+    if not retry and not hedging:
+        return None
+
+    result: Dict[str, Any] = {"name": [name]}
+    if retry:
+        result["retryPolicy"] = retry_policy(retry)
+    else:
+        result["hedgingPolicy"] = hedging_policy(hedging)
+    return result
+
+
+def build_service_config(stubs: Iterable[Dict], throttling: Optional[Dict] = None) -> Optional[str]:
+    """
+    Собирает service config gRPC из политик retry и hedging, заданных в разделе stubs
+
+    Args:
+        stubs: Список настроек stubs. Политики сервиса задаются ключами retry или hedging, политики методов -
+            в разделе methods, для применения политики обязательно указать полное имя сервиса в ключе service
+        throttling: Ограничение повторов retry_throttling (max_tokens, token_ratio)
+
+    Returns:
+        service config в формате JSON или None, если политики не заданы
+
+    Example:
+
+        .. code-block:: toml
+
+            [[production.transport.prices.stubs]]
+             alias = "prices"
+             module = "prices_pb2_grpc"
+             stub = "PriceServiceStub"
+             service = "magnit.prices.PriceService"
+             retry = {max_attempts = 4, initial_backoff = 0.1, retryable_status_codes = ["UNAVAILABLE"]}
+             methods = {Find = {hedging = {max_attempts = 3, hedging_delay = 0.05}}}
+    """
+    configs: List[Dict[str, Any]] = []
+    for item in stubs:
+        if not any(item.get(key) for key in ("retry", "hedging", "methods")):
+            continue
+
+        service: Optional[str] = item.get("service")
+        if not service:
+            raise ValueError(f"Для политик retry и hedging stub {item.get('alias')} необходимо задать полное имя "
+                             f"сервиса в параметре service")
+
+        for method, config in (item.get("methods") or {}).items():
+            configs.append(method_config({"service": service, "method": method}, config))
+        configs.append(method_config({"service": service}, item))
+
+    configs = [config for config in configs if config]
+    if not configs:
+        return None
+
+    result: Dict[str, Any] = {"methodConfig": configs}
+    if throttling:
+        result["retryThrottling"] = {
+            "maxTokens": int(throttling.get("max_tokens", 10)),
+            "tokenRatio": float(throttling.get("token_ratio", 0.1)),
+        }
+    return json.dumps(result)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import logging
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Union, Any
+
+from .utils import format_message
+
+
+class RequestStream:
+    """
+    Поток исходящих сообщений
+
+    gRPC читает итератор по мере того, как позволяет окно HTTP/2, поэтому следующее сообщение
+    формируется только когда предыдущее ушло в сеть. Первое сообщение запоминается, чтобы поток можно было
+    повторить на другом канале, пока сервер не получил ничего, кроме него.
+    """
+
+    def __init__(self, messages: Iterable[Any], logger: logging.Logger, title: str):
+        """
+        Args:
+            messages: Исходящие сообщения
+            logger: Логгер фабрики
+            title: Описание вызова для лога
+
+        """
+        self.logger = logger
+        self.title = title
+        self.sent: int = 0
+        self.__messages: Iterator[Any] = iter(messages)
+        self.__head: Optional[Any] = None
+
+    @property
+    def replayable(self) -> bool:
+        """
+        Поток можно повторить на другом канале
+
+        Returns:
+            bool
+        """
+        return self.sent <= 1
+
+    def __iter__(self) -> Iterator[Any]:
+        self.sent = 0
+        if self.__head is not None:
+            self.sent = 1
+            self._log(self.__head)
+            yield self.__head
+
+        for message in self.__messages:
+            if not self.sent:
+                self.__head = message
+            self.sent += 1
+            self._log(message)
+            yield message
+
+    def _log(self, message: Any):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"{self.title} Сообщение #{self.sent}: {format_message(message)}")
+
+
+class AsyncRequestStream(RequestStream):
+    """
+    Поток исходящих сообщений для grpc.aio. Сообщения могут задаваться обычным или асинхронным итератором
+    """
+
+    def __init__(self, messages: Union[Iterable[Any], AsyncIterable[Any]], logger: logging.Logger, title: str):
+        """
+        Args:
+            messages: Исходящие сообщения
+            logger: Логгер фабрики
+            title: Описание вызова для лога
+
+        """
+        super().__init__((), logger, title)
+        self.__messages: AsyncIterator[Any] = messages.__aiter__() if hasattr(messages, "__aiter__") \
+            else self.__wrap(messages)
+        self.__head: Optional[Any] = None
+
+    @staticmethod
+    async def __wrap(messages: Iterable[Any]) -> AsyncIterator[Any]:
+        for message in messages:
+            yield message
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        self.sent = 0
+        if self.__head is not None:
+            self.sent = 1
+            self._log(self.__head)
+            yield self.__head
+
+        async for message in self.__messages:
+            if not self.sent:
+                self.__head = message
+            self.sent += 1
+            self._log(message)
+            yield message
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from typing import Any, List
+
+from google.protobuf import text_format
+from google.protobuf.message import Message
+
+from .. import environment
+
+MAX_LOG_LENGTH: int = environment.get("MAX_LOG_LENGTH", 5000)
+
+
+class LimitReached(Exception):
+    """ Текст сообщения достиг заданной длины """
+
+
+class BoundedWriter:
+    """
+    Приемник текста text_format, прерывающий печать сообщения при достижении заданной длины
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size: int = 0
+        self.parts: List[str] = []
+
+    def write(self, text: str):
+        self.parts.append(text[:self.limit - self.size])
+        self.size += len(text)
+        if self.size >= self.limit:
+            raise LimitReached
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+
+def format_message(message: Any, limit: int = MAX_LOG_LENGTH) -> str:
+    """
+    Форматирует сообщение protobuf для лога с ограничением длины
+
+    Сообщение печатается поле за полем и печать прерывается, как только набрано limit символов,
+    поэтому большое сообщение никогда не приводится к строке целиком
+
+    Args:
+        message: Сообщение
+        limit: Максимальная длина текста
+
+    Returns:
+        Текстовое представление сообщения
+
+    """
+    if not isinstance(message, Message):
+        text: str = repr(message)
+        return text if len(text) <= limit else f"{text[:limit]}... (обрезано)"
+
+    writer = BoundedWriter(limit)
+    try:
+        text_format.PrintMessage(message, writer, as_one_line=True, as_utf8=True)
+    except LimitReached:
+        return f"[{message.ByteSize()}b] {writer.getvalue()}... (обрезано)"
+    return f"[{message.ByteSize()}b] {writer.getvalue()}"
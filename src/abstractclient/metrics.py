@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple, Any
+
+# Границы корзин гистограммы длительностей, в секундах
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Потокобезопасная гистограмма с фиксированными границами корзин
+
+    Наблюдение стоит один bisect и одну блокировку, поэтому гистограмму можно держать включенной в production
+    """
+    buckets: Tuple[float, ...]
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        """
+        Args:
+            buckets: Верхние границы корзин
+
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.__counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.__count: int = 0
+        self.__sum: float = 0.0
+        self.__max: float = 0.0
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float):
+        """
+        Учесть значение
+
+        Args:
+            value: Наблюдаемое значение
+
+        """
+        index: int = bisect_left(self.buckets, value)
+        with self.__lock:
+            self.__counts[index] += 1
+            self.__count += 1
+            self.__sum += value
+            if value > self.__max:
+                self.__max = value
+
+    @property
+    def count(self) -> int:
+        """
+        Кол-во наблюдений
+
+        Returns:
+            int
+        """
+        return self.__count
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Текущее состояние гистограммы
+
+        Returns:
+            Словарь с кол-вом, суммой, максимумом и накопленным кол-вом наблюдений по верхним границам корзин
+        """
+        with self.__lock:
+            counts, count, total, maximum = list(self.__counts), self.__count, self.__sum, self.__max
+
+        buckets: Dict[str, int] = dict()
+        cumulative: int = 0
+        for bound, value in zip(self.buckets + (float("inf"),), counts):
+            cumulative += value
+            buckets[f"{bound:g}"] = cumulative
+
+        return {
+            "count": count,
+            "sum": total,
+            "avg": total / count if count else 0.0,
+            "max": maximum,
+            "buckets": buckets,
+        }
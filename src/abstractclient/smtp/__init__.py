@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
+import uuid
 import logging
-from typing import Dict, List, Optional, Tuple, Union, IO
-from smtplib import SMTP, SMTPException
+from copy import copy
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union, IO, Iterable
+from smtplib import SMTPException
 from email.message import EmailMessage
 
+from .pool import SMTPConnectionPool
+from .outbox import SMTPOutbox
+from .attachments import AttachmentCache, make_part
 from ..abstractpipeline import AbstractFactory
 
 # Пользовательская типизация
@@ -12,12 +19,52 @@ Filename = Union[str, bytes, os.PathLike]
 MimeType = str
 
 
+@dataclass()
+class Delivery:
+    """
+    Результат отправки письма
+    """
+    msg: EmailMessage
+    session: Optional[str] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def readdress(template: EmailMessage, mailto: Union[str, List[str]]) -> EmailMessage:
+    """
+    Создает копию письма с другими получателями. Тело и приложения письма не копируются, а используются совместно
+    с шаблоном, поэтому шаблон не должен изменяться, пока копии отправляются
+
+    Args:
+        template: Письмо-шаблон
+        mailto: Адрес или список адресов получателей
+
+    Returns:
+        EmailMessage
+    """
+    # Разделитель частей задается шаблону один раз: иначе он подбирается заново при каждой отправке копии
+    # перебором всего закодированного текста письма
+    if template.is_multipart() and template.get_boundary() is None:
+        template.set_boundary(f"==============={uuid.uuid4().hex}==")
+
+    msg: EmailMessage = copy(template)
+    # Удаление заголовка создает у копии собственный список заголовков, шаблон остается прежним
+    del msg["To"]
+    msg["To"] = mailto if isinstance(mailto, str) else ",".join(mailto)
+    return msg
+
+
 class SMTPFactory(AbstractFactory):
     """
     Фабрика коннектов SMTP
     """
 
-    __sessions: Dict[str, Dict] = dict()
+    __sessions: Dict[str, Dict]
+    __pools: Dict[str, SMTPConnectionPool]
+    outbox: Optional[SMTPOutbox] = None
 
     def __init__(self, config: Dict):
         """
@@ -29,7 +76,23 @@ class SMTPFactory(AbstractFactory):
         """
         self.logger = logging.getLogger(__name__)
         self.__config = config
+        self.__sessions = dict()
+        self.__pools = dict()
+        self.attachments = AttachmentCache(config.get("attachment_cache_size", 64 * 1024 * 1024))
         self.setup_sessions()
+        self.setup_outbox()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Закрыть все открытые подключения. Неотправленные письма очереди остаются на диске до следующего запуска
+        """
+        if self.outbox:
+            self.outbox.stop(timeout=self.outbox.poll_interval)
+        for pool in getattr(self, "_SMTPFactory__pools", {}).values():
+            pool.close()
 
     def setup_sessions(self, cfg: Optional[List[Dict]] = None):
         """
@@ -55,18 +118,75 @@ class SMTPFactory(AbstractFactory):
             if not host:
                 raise ValueError("Не задан адрес хоста")
 
-            self.__sessions[item.get("alias").lower()] = dict(
-                connect=dict(host=host, port=port),
+            alias: str = item.get("alias").lower()
+            connect: Dict = dict(host=host, port=port)
+            if item.get("timeout"):
+                connect["timeout"] = item.get("timeout")
+
+            self.__sessions[alias] = dict(
+                connect=connect,
                 credentials=dict(user=item.get("username"),
                                  password=item.get("password")),
                 login=True if item.get("username") or item.get("password") else False,
                 tls=item.get("tls", False)
             )
 
-    def send(self, from_mail: str, mailto: Union[str, List[str]], subject: Optional[str] = "",
-             message: Optional[str] = "", files: List[Tuple[Filename, MimeType, Union[str, IO]]] = None):
+            # Подключения сессии переиспользуются между письмами. Прежний пул при перенастройке закроем
+            if alias in self.__pools:
+                self.__pools[alias].close()
+            self.__pools[alias] = SMTPConnectionPool(
+                alias,
+                self.__sessions[alias],
+                pool_size=item.get("pool_size", 1),
+                max_age=item.get("max_age", 300),
+                check_interval=item.get("check_interval", 10),
+                wait_timeout=item.get("wait_timeout")
+            )
+
+    def setup_outbox(self, cfg: Optional[Dict] = None):
         """
-        Отправляет письма по SMTP протоколу
+        Настройка очереди исходящих писем на диске, раздел transport.outbox. Без настройки очереди
+        метод enqueue недоступен
+
+        Args:
+            cfg: Словарь с настройками path, max_attempts, backoff, max_backoff, poll_interval, autostart
+
+        Example:
+
+            .. code-block:: toml
+
+                [production.transport.mail.outbox]
+                 path = "/var/spool/app/mail"
+                 max_attempts = 10
+                 backoff = 30
+
+        """
+        config: Optional[Dict] = cfg if cfg else self.__config.get("outbox", None)
+        if not config:
+            return
+
+        if not config.get("path"):
+            raise ValueError("Не задан каталог очереди писем. Проверьте в конфигурации раздел transport.outbox.path")
+
+        if self.outbox:
+            self.outbox.stop()
+        self.outbox = SMTPOutbox(
+            config.get("path"),
+            self.send_message,
+            max_attempts=config.get("max_attempts", 10),
+            backoff=config.get("backoff", 30),
+            max_backoff=config.get("max_backoff", 3600),
+            poll_interval=config.get("poll_interval", 5)
+        )
+        # Фоновый поток сразу дочитывает письма, оставшиеся в очереди с прошлого запуска
+        if config.get("autostart", True):
+            self.outbox.start()
+
+    def build_message(self, from_mail: str, mailto: Union[str, List[str]], subject: Optional[str] = "",
+                      message: Optional[str] = "",
+                      files: List[Tuple[Filename, MimeType, Union[str, IO]]] = None) -> EmailMessage:
+        """
+        Формирует письмо
 
         Args:
             from_mail: Адрес отправителя
@@ -75,6 +195,9 @@ class SMTPFactory(AbstractFactory):
             message: Текст сообщения
             files: Список отправляемых файлов
 
+        Returns:
+            EmailMessage
+
         """
         if not files:
             files = []
@@ -88,37 +211,134 @@ class SMTPFactory(AbstractFactory):
         msg["Subject"] = subject
         msg.set_content(message)
 
-        # Добавим к сообщению приложения
+        # Добавим к сообщению приложения. Файлы на диске кодируются один раз и берутся из кеша,
+        # потоки кодируются блоками без чтения целиком
+        if files:
+            msg.make_mixed()
         for filename, mimetype, file in files:
             if hasattr(file, "read"):
-                data = file.read()
-            elif os.path.exists(file):
-                with open(file, "rb") as f:
-                    data = f.read()
+                msg.attach(make_part(file, filename, mimetype))
+            else:
+                msg.attach(self.attachments.get(file, filename, mimetype))
+
+        return msg
+
+    def send(self, from_mail: str, mailto: Union[str, List[str]], subject: Optional[str] = "",
+             message: Optional[str] = "", files: List[Tuple[Filename, MimeType, Union[str, IO]]] = None):
+        """
+        Отправляет письма по SMTP протоколу
+
+        Args:
+            from_mail: Адрес отправителя
+            mailto: Адрес или список адресов получаетелей
+            subject: Тема письма
+            message: Текст сообщения
+            files: Список отправляемых файлов
+
+        """
+        self.logger.debug(f"От: {from_mail} в адрес {mailto}, заголовок {subject}\n"
+                          f"Текст {message}\nПриложения: {files}")
+        self.send_message(self.build_message(from_mail, mailto, subject, message, files))
+
+    def enqueue(self, from_mail: str, mailto: Union[str, List[str]], subject: Optional[str] = "",
+                message: Optional[str] = "", files: List[Tuple[Filename, MimeType, Union[str, IO]]] = None) -> str:
+        """
+        Помещает письмо в очередь на диске без ожидания сервера SMTP. Письмо отправит фоновый поток
+        или следующий запуск приложения
+
+        Args:
+            from_mail: Адрес отправителя
+            mailto: Адрес или список адресов получаетелей
+            subject: Тема письма
+            message: Текст сообщения
+            files: Список отправляемых файлов
+
+        Returns:
+            Путь к файлу письма в очереди
+
+        """
+        return self.enqueue_message(self.build_message(from_mail, mailto, subject, message, files))
+
+    def enqueue_message(self, msg: EmailMessage) -> str:
+        """
+        Помещает готовое письмо в очередь на диске
+
+        Args:
+            msg: Письмо
 
-            maintype, subtype = mimetype.split("/", 1)
-            msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+        Returns:
+            Путь к файлу письма в очереди
+
+        """
+        if not self.outbox:
+            raise ValueError("Очередь писем не настроена. Проверьте в конфигурации раздел transport.outbox")
+        return self.outbox.enqueue(msg)
 
+    def send_message(self, msg: EmailMessage) -> str:
+        """
+        Отправляет готовое письмо
+
+        Args:
+            msg: Письмо
+
+        Returns:
+            Наименование сессии, через которую отправлено письмо
+
+        """
         # Отправка сообщения будет последовательно выполняться для всех сессий, заданных в конфигурации, до успеха
-        for i, (key, session) in enumerate(self.__sessions.items()):
+        for i, (key, pool) in enumerate(self.__pools.items()):
             try:
-                self.logger.debug(f"Попытка отправки письма в рамках сессии: {key}")
-                self.logger.debug(f"От: {from_mail} в адрес {mailto}, заголовок {subject}\n"
-                                  f"Текст {message}\nПриложения: {files}")
-
-                smtp: SMTP = SMTP(**session.get("connect"))
-                if session.get("tls", False):
-                    smtp.ehlo()
-                    smtp.starttls()
-                    smtp.ehlo()
-                if session.get("login", False):
-                    smtp.login(**session.get("credentials"))
-                smtp.send_message(msg)
-                smtp.quit()
-
-                break
-
-            except (SMTPException, TimeoutError) as e:
+                self.logger.debug(f"Попытка отправки письма {msg['Subject']} в адрес {msg['To']} "
+                                  f"в рамках сессии: {key}")
+                pool.send_message(msg)
+                return key
+
+            except (SMTPException, TimeoutError, OSError) as e:
                 self.logger.exception(f"Ошибка при отправке письма: {str(e)}")
-                if i == len(self.__sessions) - 1:
+                if i == len(self.__pools) - 1:
                     raise
+
+    def send_many(self, messages: Iterable[EmailMessage], workers: Optional[int] = None) -> List[Delivery]:
+        """
+        Отправляет набор писем параллельно через пулы подключений сессий
+
+        Ошибка отправки одного письма не прерывает отправку остальных. Переход на следующую сессию выполняется
+        для каждого письма отдельно.
+
+        Args:
+            messages: Письма, например, созданные через readdress из одного шаблона
+            workers: Кол-во параллельных отправителей, по умолчанию - суммарный размер пулов подключений сессий.
+                Больше отправителей не запускается, лишние ожидали бы свободного подключения
+
+        Returns:
+            Результаты отправки в порядке переданных писем
+
+        Example:
+
+            .. code-block:: python
+
+                smtp = self.transport['mail']
+                template = smtp.build_message("robot@magnit.ru", [], "Остатки", "Отчет во вложении", files)
+                results = smtp.send_many(readdress(template, store.email) for store in stores)
+                failed = [result for result in results if not result.ok]
+        """
+        connections: int = sum(pool.size for pool in self.__pools.values())
+        if workers is None:
+            workers = connections
+        elif workers > connections:
+            self.logger.warning(f"Кол-во отправителей {workers} больше кол-ва подключений сессий {connections} "
+                                f"и будет уменьшено до него")
+            workers = connections
+
+        def deliver(msg: EmailMessage) -> Delivery:
+            try:
+                return Delivery(msg=msg, session=self.send_message(msg))
+            except (SMTPException, TimeoutError, OSError) as e:
+                return Delivery(msg=msg, error=e)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="smtp") as executor:
+            results: List[Delivery] = list(executor.map(deliver, messages))
+
+        failed: int = sum(1 for result in results if not result.ok)
+        self.logger.info(f"Отправлено писем: {len(results) - failed}, с ошибкой: {failed}")
+        return results
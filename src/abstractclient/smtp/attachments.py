@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import base64
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.message import MIMEPart
+from typing import IO, List, Tuple, Optional
+
+# Кол-во байт исходных данных в одной строке base64 (76 символов по RFC 2045)
+LINE_BYTES: int = 57
+# Размер блока чтения файла: целое число строк base64
+CHUNK_BYTES: int = LINE_BYTES * 1024
+
+AttachmentKey = Tuple[str, int, int, str, str]
+
+
+def encode_base64(stream: IO[bytes]) -> str:
+    """
+    Кодирует поток в base64 блоками, не загружая исходные данные целиком в память
+
+    Закодированные блоки собираются в строку одним join, без промежуточного буфера
+
+    Args:
+        stream: Бинарный поток
+
+    Returns:
+        Данные в base64, разбитые на строки по 76 символов
+    """
+    chunks: List[str] = []
+    while True:
+        chunk: bytes = stream.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        # Блок кратен 57 байтам, поэтому строки base64 соседних блоков не разрываются
+        chunks.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(chunks)
+
+
+def make_part(stream: IO[bytes], filename: str, mimetype: str) -> MIMEPart:
+    """
+    Создает закодированное вложение письма
+
+    Args:
+        stream: Бинарный поток с данными вложения
+        filename: Имя файла во вложении
+        mimetype: Тип данных
+
+    Returns:
+        MIMEPart
+    """
+    part = MIMEPart()
+    part["Content-Type"] = mimetype
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    part.set_payload(encode_base64(stream))
+    return part
+
+
+class AttachmentCache:
+    """
+    Кеш закодированных вложений, прочитанных с диска
+
+    Вложение кодируется один раз и переиспользуется в следующих письмах, пока файл не изменился
+    (ключ кеша включает время изменения и размер файла). Объем кеша ограничен суммарным размером
+    закодированных данных, при превышении вытесняются давно не использованные вложения.
+    """
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_size: Максимальный суммарный размер закодированных вложений, байт
+
+        """
+        self.max_size = max_size
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.__parts: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, path: str, filename: Optional[str] = None, mimetype: Optional[str] = None) -> MIMEPart:
+        """
+        Выдает закодированное вложение для файла
+
+        Args:
+            path: Путь к файлу
+            filename: Имя файла во вложении, по умолчанию - имя файла на диске
+            mimetype: Тип данных, по умолчанию определяется по расширению файла
+
+        Returns:
+            MIMEPart
+        """
+        path = os.path.realpath(os.fspath(path))
+        stat: os.stat_result = os.stat(path)
+        filename = filename or os.path.basename(path)
+        mimetype = mimetype or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        key: AttachmentKey = (path, stat.st_mtime_ns, stat.st_size, filename, mimetype)
+
+        with self.__lock:
+            part: Optional[MIMEPart] = self.__parts.get(key)
+            if part is not None:
+                self.__parts.move_to_end(key)
+                self.hits += 1
+                return part
+            self.misses += 1
+
+        with open(path, "rb") as f:
+            part = make_part(f, filename, mimetype)
+
+        size: int = len(part.get_payload())
+        if size > self.max_size:
+            return part
+
+        with self.__lock:
+            if key not in self.__parts:
+                self.__parts[key] = part
+                self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.__parts.popitem(last=False)
+                self.size -= len(evicted.get_payload())
+        return part
+
+    def clear(self):
+        """
+        Очищает кеш
+        """
+        with self.__lock:
+            self.__parts.clear()
+            self.size = 0
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import os
+import uuid
+import email
+import logging
+import threading
+from time import time
+from itertools import count
+from email import policy
+from email.message import EmailMessage
+from smtplib import SMTPResponseException, SMTPRecipientsRefused
+from typing import Callable, Iterator, List, Optional
+
+# Суффиксы файлов очереди: письмо, ожидающее отправки, и письмо, которое отправляется в данный момент
+QUEUED: str = ".eml"
+SENDING: str = ".sending"
+# Порядковый номер письма в процессе: письма, помещенные в очередь в одну миллисекунду, отправляются по порядку
+SEQUENCE: Iterator[int] = count()
+
+
+def permanent(error: Exception) -> bool:
+    """
+    Проверяет, является ли ошибка отправки окончательной (5xx), повтор которой не имеет смысла
+
+    Args:
+        error: Ошибка отправки
+
+    Returns:
+        bool
+    """
+    if isinstance(error, SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class SMTPOutbox:
+    """
+    Очередь исходящих писем на диске
+
+    Письмо сериализуется в файл каталога очереди и отправляется фоновым потоком. Неотправленные письма повторяются
+    с экспоненциальной задержкой и переживают перезапуск приложения: очередь дочитывается при следующем запуске.
+    Имя файла содержит время следующей попытки, номер попытки и порядковый номер:
+    <время, мс>-<попытка>-<порядковый номер>-<uuid>.eml, поэтому состояние очереди не требует отдельного хранилища.
+
+    Письма, не отправленные за max_attempts попыток или отклоненные сервером окончательно (5xx), переносятся
+    в подкаталог failed.
+    """
+
+    def __init__(self, path: str, sender: Callable[[EmailMessage], str], max_attempts: int = 10,
+                 backoff: float = 30, max_backoff: float = 3600, poll_interval: float = 5):
+        """
+        Args:
+            path: Каталог очереди
+            sender: Функция отправки письма, возвращающая наименование сессии
+            max_attempts: Максимальное кол-во попыток отправки письма
+            backoff: Задержка перед второй попыткой, сек. Каждая следующая задержка удваивается
+            max_backoff: Максимальная задержка между попытками, сек.
+            poll_interval: Интервал проверки очереди фоновым потоком, сек.
+
+        """
+        if max_attempts < 1:
+            raise ValueError("Кол-во попыток отправки письма из очереди должно быть больше 0")
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.failed_path = os.path.join(path, "failed")
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.__wakeup = threading.Event()
+        self.__stopping = threading.Event()
+        self.__drain_lock = threading.Lock()
+        self.__thread: Optional[threading.Thread] = None
+
+        os.makedirs(self.failed_path, exist_ok=True)
+        self.__recover()
+
+    def __recover(self):
+        """
+        Возвращает в очередь письма, отправка которых была прервана остановкой приложения
+        """
+        for name in os.listdir(self.path):
+            if name.endswith(SENDING):
+                os.replace(os.path.join(self.path, name), os.path.join(self.path, name[:-len(SENDING)] + QUEUED))
+
+    def __filename(self, due: float, attempt: int, key: str) -> str:
+        return os.path.join(self.path, f"{int(due * 1000):013d}-{attempt}-{next(SEQUENCE):010d}-{key}{QUEUED}")
+
+    def enqueue(self, msg: EmailMessage) -> str:
+        """
+        Помещает письмо в очередь. Не обращается к серверу SMTP
+
+        Args:
+            msg: Письмо
+
+        Returns:
+            Путь к файлу письма в очереди
+        """
+        filename: str = self.__filename(time(), 0, uuid.uuid4().hex)
+        # Запись через временный файл, чтобы фоновый поток не прочитал письмо частично
+        temporary: str = f"{filename}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(msg.as_bytes(policy=policy.SMTP))
+        os.replace(temporary, filename)
+
+        self.logger.debug(f"Письмо {msg['Subject']} в адрес {msg['To']} помещено в очередь: {filename}")
+        self.__wakeup.set()
+        return filename
+
+    @property
+    def pending(self) -> List[str]:
+        """
+        Файлы писем, ожидающих отправки, в порядке времени следующей попытки
+        """
+        return sorted(name for name in os.listdir(self.path) if name.endswith(QUEUED))
+
+    @property
+    def failed(self) -> List[str]:
+        """
+        Файлы писем, которые не удалось отправить
+        """
+        return sorted(os.listdir(self.failed_path))
+
+    def __deliver(self, name: str) -> bool:
+        """
+        Отправляет письмо из очереди. Файл на время отправки переименовывается, поэтому одно письмо
+        не будет отправлено дважды параллельными вызовами drain
+
+        Args:
+            name: Имя файла письма
+
+        Returns:
+            True, если письмо отправлено
+        """
+        _, attempt, _, key = name[:-len(QUEUED)].split("-", 3)
+        queued: str = os.path.join(self.path, name)
+        sending: str = os.path.join(self.path, name[:-len(QUEUED)] + SENDING)
+        try:
+            os.replace(queued, sending)
+        except FileNotFoundError:
+            return False
+
+        with open(sending, "rb") as f:
+            msg: EmailMessage = email.message_from_binary_file(f, policy=policy.default)
+
+        try:
+            session: str = self.sender(msg)
+        except Exception as e:
+            # Любая ошибка отправки возвращает письмо в очередь, иначе оно осталось бы в состоянии отправки
+            attempts: int = int(attempt) + 1
+            if permanent(e) or attempts >= self.max_attempts:
+                self.logger.error(f"Письмо {msg['Subject']} в адрес {msg['To']} не отправлено за {attempts} попыток "
+                                  f"и перенесено в {self.failed_path}: {str(e)}")
+                os.replace(sending, os.path.join(self.failed_path, name))
+            else:
+                delay: float = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                self.logger.warning(f"Письмо {msg['Subject']} в адрес {msg['To']} не отправлено ({str(e)}), "
+                                    f"повтор через {delay:g} сек.")
+                os.replace(sending, self.__filename(time() + delay, attempts, key))
+            return False
+
+        os.remove(sending)
+        self.logger.debug(f"Письмо {msg['Subject']} в адрес {msg['To']} из очереди отправлено в рамках сессии "
+                          f"{session}")
+        return True
+
+    def drain(self) -> int:
+        """
+        Отправляет письма очереди, время попытки которых наступило
+
+        Returns:
+            Кол-во отправленных писем
+        """
+        sent: int = 0
+        with self.__drain_lock:
+            now: int = int(time() * 1000)
+            for name in self.pending:
+                if int(name.split("-", 1)[0]) > now or self.__stopping.is_set():
+                    break
+                sent += self.__deliver(name)
+        return sent
+
+    def __run(self):
+        while not self.__stopping.is_set():
+            self.__wakeup.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                self.logger.exception(f"Ошибка при отправке писем из очереди: {str(e)}")
+            self.__wakeup.wait(self.poll_interval)
+
+    def start(self):
+        """
+        Запускает фоновый поток отправки писем
+        """
+        if self.__thread and self.__thread.is_alive():
+            if not self.__stopping.is_set():
+                return
+            # Поток, не успевший остановиться, дорабатывает текущую отправку. Второй поток запускается после него
+            self.__thread.join()
+        self.__stopping.clear()
+        self.__thread = threading.Thread(target=self.__run, name="smtp-outbox", daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Останавливает фоновый поток. Неотправленные письма остаются в очереди до следующего запуска
+
+        Args:
+            timeout: Время ожидания завершения текущей отправки, сек.
+
+        """
+        self.__stopping.set()
+        self.__wakeup.set()
+        if self.__thread:
+            self.__thread.join(timeout)
+            if self.__thread.is_alive():
+                # Признак остановки не сбрасывается: поток завершится после текущей отправки
+                self.logger.warning(f"Поток отправки писем не остановился за {timeout} сек. и завершится "
+                                    f"после текущей отправки")
+                return
+            self.__thread = None
+        self.__stopping.clear()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from time import monotonic
+from queue import LifoQueue, Empty
+from dataclasses import dataclass
+from contextlib import contextmanager
+from email.message import EmailMessage
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected, SMTPConnectError, SMTPRecipientsRefused, \
+    SMTPSenderRefused, SMTPDataError
+from typing import Dict, Optional, Generator, Any
+
+
+@dataclass()
+class PooledConnection:
+    """
+    Подключение SMTP, находящееся в пуле
+    """
+    smtp: SMTP
+    created: float
+    used: float
+    uses: int = 0
+
+
+class SMTPConnectionPool:
+    """
+    Пул авторизованных подключений SMTP одной сессии
+
+    Подключение открывается один раз (EHLO, STARTTLS, EHLO, LOGIN) и переиспользуется для последующих писем.
+    Перед повторным использованием простаивавшее подключение проверяется командой NOOP, а по истечении max_age
+    закрывается и открывается заново.
+    """
+
+    def __init__(self, alias: str, session: Dict, pool_size: int = 1, max_age: float = 300,
+                 check_interval: float = 10, wait_timeout: Optional[float] = None):
+        """
+        Args:
+            alias: Наименование сессии
+            session: Настройки сессии (connect, credentials, login, tls)
+            pool_size: Максимальное кол-во одновременно открытых подключений
+            max_age: Время жизни подключения, сек.
+            check_interval: Простой подключения, после которого оно проверяется командой NOOP, сек.
+            wait_timeout: Время ожидания свободного подключения, сек. None - без ограничения
+
+        """
+        if pool_size < 1:
+            raise ValueError(f"Размер пула подключений SMTP {alias} должен быть больше 0")
+
+        self.logger = logging.getLogger(__name__)
+        self.alias = alias
+        self.session = session
+        self.size = pool_size
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.wait_timeout = wait_timeout
+        self.__idle: LifoQueue = LifoQueue()
+        self.__slots = threading.BoundedSemaphore(pool_size)
+
+    def __connect(self) -> PooledConnection:
+        """
+        Открывает авторизованное подключение
+
+        Returns:
+            PooledConnection
+        """
+        self.logger.debug(f"Открытие подключения SMTP в рамках сессии: {self.alias}")
+        smtp: SMTP = SMTP(**self.session.get("connect"))
+        try:
+            if self.session.get("tls", False):
+                smtp.ehlo()
+                smtp.starttls()
+                smtp.ehlo()
+            if self.session.get("login", False):
+                smtp.login(**self.session.get("credentials"))
+        except BaseException:
+            self.__close(smtp)
+            raise
+
+        now: float = monotonic()
+        return PooledConnection(smtp=smtp, created=now, used=now)
+
+    def __close(self, smtp: SMTP):
+        """
+        Закрывает подключение, игнорируя ошибки разорванного соединения
+
+        Args:
+            smtp: Подключение
+
+        """
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
+
+    def __reset(self, smtp: SMTP) -> bool:
+        """
+        Сбрасывает незавершенную транзакцию письма командой RSET
+
+        Args:
+            smtp: Подключение
+
+        Returns:
+            Подключение осталось рабочим
+        """
+        try:
+            return smtp.rset()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    def __alive(self, connection: PooledConnection) -> bool:
+        """
+        Проверяет, можно ли переиспользовать подключение
+
+        Args:
+            connection: Подключение из пула
+
+        Returns:
+            bool
+        """
+        now: float = monotonic()
+        if now - connection.created > self.max_age:
+            return False
+        if now - connection.used < self.check_interval:
+            return True
+        try:
+            return connection.smtp.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    def acquire(self) -> PooledConnection:
+        """
+        Выдает живое подключение из пула или открывает новое
+
+        Returns:
+            PooledConnection
+        """
+        if not self.__slots.acquire(timeout=self.wait_timeout):
+            raise TimeoutError(f"Нет свободного подключения SMTP в рамках сессии {self.alias}")
+
+        try:
+            while True:
+                try:
+                    connection: PooledConnection = self.__idle.get_nowait()
+                except Empty:
+                    return self.__connect()
+                if self.__alive(connection):
+                    return connection
+                self.logger.debug(f"Подключение SMTP {self.alias} устарело или разорвано и будет открыто заново")
+                self.__close(connection.smtp)
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    def release(self, connection: PooledConnection, discard: bool = False):
+        """
+        Возвращает подключение в пул
+
+        Args:
+            connection: Подключение
+            discard: Закрыть подключение вместо возврата в пул
+
+        """
+        try:
+            if discard:
+                self.__close(connection.smtp)
+            else:
+                connection.used = monotonic()
+                connection.uses += 1
+                self.__idle.put(connection)
+        finally:
+            self.__slots.release()
+
+    @contextmanager
+    def connection(self) -> Generator[SMTP, Any, Any]:
+        """
+        Выдает подключение на время работы с ним. При ошибке подключение закрывается
+
+        Returns:
+            SMTP
+        """
+        connection: PooledConnection = self.acquire()
+        try:
+            yield connection.smtp
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def send_message(self, msg: EmailMessage):
+        """
+        Отправляет письмо. Если переиспользуемое подключение оказалось разорвано сервером,
+        письмо отправляется повторно через новое подключение
+
+        Если письмо отклонено сервером (SMTPRecipientsRefused, SMTPSenderRefused, SMTPDataError), транзакция
+        сбрасывается командой RSET и подключение возвращается в пул. При остальных ошибках подключение закрывается
+
+        Args:
+            msg: Письмо
+
+        """
+        for attempt in range(2):
+            connection: PooledConnection = self.acquire()
+            try:
+                connection.smtp.send_message(msg)
+            except (SMTPRecipientsRefused, SMTPSenderRefused, SMTPDataError):
+                # Письмо отклонено сервером, подключение при этом остается рабочим
+                self.release(connection, discard=not self.__reset(connection.smtp))
+                raise
+            except (SMTPServerDisconnected, SMTPConnectError, OSError) as e:
+                self.release(connection, discard=True)
+                if attempt or not connection.uses:
+                    raise
+                self.logger.warning(f"Подключение SMTP {self.alias} разорвано сервером ({str(e)}), переподключение")
+                continue
+            except BaseException:
+                self.release(connection, discard=True)
+                raise
+            self.release(connection)
+            return
+
+    def close(self):
+        """
+        Закрывает все свободные подключения пула
+        """
+        while True:
+            try:
+                self.__close(self.__idle.get_nowait().smtp)
+            except Empty:
+                return
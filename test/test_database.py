@@ -0,0 +1,364 @@
+import time
+import asyncio
+import sqlite3
+import threading
+import pytest
+
+from src.abstractclient.dba.fanout import fan_out, merge_rows
+from src.abstractclient.defaultpipeline.database import DAO, AsyncDAO, AsyncConnectionPool, GenericConnectionPool
+
+
+class CountingFabric:
+    """
+    Фабрика подключений sqlite, считающая открытые подключения
+    """
+
+    def __init__(self):
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, **credentials):
+        with self.lock:
+            self.opened += 1
+        return sqlite3.connect(":memory:", check_same_thread=False, **credentials)
+
+
+def make_pool(fabric: CountingFabric, **options) -> GenericConnectionPool:
+    return GenericConnectionPool(fabric, {}, **options)
+
+
+def test_pool_reuses_connections():
+    """
+    Возвращенное подключение остается открытым и выдается повторно
+    """
+    fabric = CountingFabric()
+    dao = DAO(make_pool(fabric, pool_size=2))
+    for number in range(10):
+        with dao.acquire() as tr:
+            assert tr.execute("select ? as value", (number,), fetch=tr.ONE).value == number
+
+    assert fabric.opened == 1
+    assert dao._pool.checkedin == 1 and dao._pool.checkedout == 0
+
+
+def test_dao_closes_unread_streams():
+    """
+    Потоковая выборка, не прочитанная до конца транзакции, закрывается при возврате подключения в пул
+    """
+    dao = DAO(make_pool(CountingFabric(), reset_on_return=False))
+    with dao.acquire(auto=True) as tr:
+        tr.execute("create table goods (id integer, price real)", (), fetch=tr.NOTHING)
+        tr.execute("insert into goods values (1, 1.5)", (), fetch=tr.NOTHING)
+        tr.execute("update goods set price = 0 returning id", (), fetch=tr.ITER)
+        con = tr._con
+
+    assert not con.in_transaction
+    with dao.acquire() as tr:
+        assert tr.execute("select price from goods", (), fetch=tr.ONE).price == 1.5
+
+
+def test_pool_timeout():
+    """
+    При исчерпании пула подключение ожидается не дольше timeout
+    """
+    pool = make_pool(CountingFabric(), pool_size=1, max_overflow=0, timeout=0.1)
+    connection = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+    threading.Timer(0.05, pool.release, (connection,)).start()
+    assert pool.acquire(timeout=1) is connection
+
+
+def test_pool_overflow_closed_on_release():
+    """
+    Подключения сверх pool_size закрываются при возврате
+    """
+    fabric = CountingFabric()
+    pool = make_pool(fabric, pool_size=1, max_overflow=2)
+    connections = [pool.acquire() for _ in range(3)]
+    for connection in connections:
+        pool.release(connection)
+
+    assert fabric.opened == 3
+    assert pool.checkedin == 1 and pool.overflow == 0
+
+
+def test_pool_recycle_and_ping():
+    """
+    Подключение старше recycle и подключение, не прошедшее проверку, открываются заново
+    """
+    fabric = CountingFabric()
+    pool = make_pool(fabric, recycle=0)
+    pool.release(pool.acquire())
+    pool.release(pool.acquire())
+    assert fabric.opened == 2
+
+    pool = make_pool(fabric, pre_ping=True, ping_query="select 1")
+    connection = pool.acquire()
+    pool.release(connection)
+    connection.close()
+    assert pool.acquire() is not connection
+    assert fabric.opened == 4
+
+
+def test_pool_reaps_idle():
+    """
+    Простаивающие подключения закрываются
+    """
+    pool = make_pool(CountingFabric(), idle_timeout=0.05)
+    pool.release(pool.acquire())
+    time.sleep(0.1)
+    assert pool.reap() == 1
+    assert pool.checkedin == 0
+
+
+def test_pool_stats():
+    """
+    Метрики пула: ожидание, удержание, открытие подключений, переполнение и тайм-ауты
+    """
+    pool = make_pool(CountingFabric(), pool_size=1, max_overflow=1, timeout=0.01)
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    stats = pool.stats()
+    assert (stats["size"], stats["checkedin"], stats["checkedout"]) == (1, 1, 0)
+    assert (stats["checkouts"], stats["connects"], stats["timeouts"]) == (2, 2, 1)
+    assert stats["overflow_high_water"] == 1
+    assert stats["recycles"] == {"overflow": 1}
+    assert stats["wait"]["count"] == 2 and stats["hold"]["count"] == 2 and stats["connect"]["count"] == 2
+
+
+def test_async_dao():
+    """
+    Транзакции AsyncDAO выполняются в потоках подключений, подключение берется из пула на время транзакции
+    """
+    dao = AsyncDAO(GenericConnectionPool(sqlite3.connect, {"database": ":memory:", "check_same_thread": False},
+                                         pool_size=2))
+
+    async def query(number: int):
+        async with dao.acquire(auto=True) as tr:
+            row = await tr.execute("select ? as value", (number,), fetch=tr.ONE)
+            rows = await tr.execute("select ? as value union all select ?", (number, number + 1), fetch=tr.ITER)
+            return row.value, [item.value async for item in rows]
+
+    async def run():
+        return await asyncio.gather(*(query(number) for number in range(10)))
+
+    assert asyncio.run(run()) == [(number, [number, number + 1]) for number in range(10)]
+    stats = dao._pool.stats()
+    assert stats["connects"] <= 2 and stats["checkouts"] == 10 and stats["checkedout"] == 0
+    asyncio.run(dao.dispose())
+
+
+def test_async_dao_releases_connection_of_cancelled_transaction():
+    """
+    Подключение, полученное потоком после отмены ожидающей транзакции, возвращается в пул
+    """
+    dao = AsyncDAO(GenericConnectionPool(sqlite3.connect, {"database": ":memory:", "check_same_thread": False},
+                                         pool_size=1, max_overflow=0, timeout=5), workers=2)
+
+    async def run():
+        hold = asyncio.Event()
+
+        async def holder():
+            async with dao.acquire() as tr:
+                await tr.execute("select 1 as one", (), fetch=tr.ONE)
+                await hold.wait()
+
+        async def waiter():
+            async with dao.acquire() as tr:
+                await tr.execute("select 1 as one", (), fetch=tr.ONE)
+
+        first = asyncio.ensure_future(holder())
+        await asyncio.sleep(0.1)
+        second = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.1)
+        second.cancel()
+        hold.set()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        # Подключение возвращается в пул потоком, получившим его уже после отмены
+        await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    assert dao._pool.stats()["checkedout"] == 0
+    asyncio.run(dao.dispose())
+
+
+def test_async_bulk_progress():
+    dao = AsyncDAO(GenericConnectionPool(sqlite3.connect, {"database": ":memory:", "check_same_thread": False}))
+    batches = []
+
+    async def run():
+        async with dao.acquire(auto=True) as tr:
+            await tr.execute("create table items (value int)", (), fetch=tr.NOTHING)
+            stats = await tr.bulk("insert into items values (?)", ((number,) for number in range(25)),
+                                  batch_size=10, progress=lambda stats: batches.append(stats.rows))
+            return stats.rows
+
+    assert asyncio.run(run()) == 25
+    assert batches == [10, 20, 25]
+    asyncio.run(dao.dispose())
+
+
+class AsyncSQLiteCursor:
+    """
+    Курсор sqlite3 с интерфейсом асинхронного драйвера
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, connection: "AsyncSQLite"):
+        self.cursor = cursor
+        self.connection = connection
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    async def execute(self, statement, params):
+        self.cursor.execute(statement, params)
+
+    async def fetchone(self):
+        return self.cursor.fetchone()
+
+    async def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    async def fetchall(self):
+        return self.cursor.fetchall()
+
+    async def close(self):
+        self.connection.closed_cursors += 1
+        self.cursor.close()
+
+
+class AsyncSQLite:
+    """
+    Подключение sqlite3 с интерфейсом асинхронного драйвера (aiosqlite), считающее commit и rollback
+    """
+
+    def __init__(self):
+        self.con = sqlite3.connect(":memory:")
+        self.commits = self.rollbacks = self.closed_cursors = 0
+
+    async def cursor(self):
+        return AsyncSQLiteCursor(self.con.cursor(), self)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    async def close(self):
+        self.con.close()
+
+
+def test_async_dao_native_streams():
+    """
+    Потоковая выборка асинхронного драйвера фиксируется только при полном переборе, а незавершенная
+    закрывается с откатом при завершении транзакции
+    """
+    connections = []
+
+    async def connect():
+        connections.append(AsyncSQLite())
+        return connections[-1]
+
+    dao = AsyncDAO(AsyncConnectionPool(connect, {}, pool_size=1, reset_on_return=False))
+    query = "select 1 as value union all select 2"
+
+    async def run():
+        async with dao.acquire(auto=True) as tr:
+            assert [row.value async for row in await tr.execute(query, (), fetch=tr.ITER)] == [1, 2]
+            con = connections[0]
+            assert (con.commits, con.rollbacks) == (1, 0)
+
+            rows = await tr.execute(query, (), fetch=tr.ITER)
+            assert (await rows.__anext__()).value == 1
+            await rows.aclose()
+            assert (con.commits, con.rollbacks) == (1, 1)
+
+            rows = await tr.execute(query, (), fetch=tr.ITER)
+            await rows.__anext__()
+            await tr.execute(query, (), fetch=tr.ITER)
+        return con
+
+    con = asyncio.run(run())
+    assert (con.commits, con.rollbacks, con.closed_cursors) == (1, 3, 4)
+
+
+def test_async_dao_native_driver():
+    """
+    AsyncDAO с пулом асинхронного драйвера
+    """
+    aiosqlite = pytest.importorskip("aiosqlite")
+    dao = AsyncDAO(AsyncConnectionPool(aiosqlite.connect, {"database": ":memory:"}, pool_size=1))
+
+    async def run():
+        async with dao.acquire() as tr:
+            one = await tr.execute("select ? as value", (1,), fetch=tr.ONE)
+            many = await tr.execute("select 1 as value union all select 2", ())
+            rows = await tr.execute("select 1 as value union all select 2", (), fetch=tr.ITER)
+            return one.value, [row.value for row in many], [row.value async for row in rows]
+
+    assert dao.native
+    assert asyncio.run(run()) == (1, [1, 2], [1, 2])
+
+
+def test_fan_out():
+    """
+    Запрос выполняется во всех базах, результаты помечаются ключом базы, ошибка одной базы не прерывает остальные
+    """
+    daos = {key: DAO(make_pool(CountingFabric())) for key in ("msk", "spb", "kzn")}
+
+    results = fan_out(daos, "select ? as value", (7,))
+    assert list(results) == ["msk", "spb", "kzn"]
+    assert merge_rows(results.values()) == [(key, results[key].result[0]) for key in daos]
+    assert all(row.value == 7 for _, row in merge_rows(results.values()))
+
+    results = fan_out(daos, {"spb": "select 2 as value", "kzn": ("select missing", None)})
+    assert list(results) == ["spb", "kzn"]
+    assert results["spb"].result[0].value == 2
+    assert not results["kzn"].ok
+
+    results = fan_out(daos, "select 1 as value", keys=(key for key in ("kzn", "msk")))
+    assert list(results) == ["kzn", "msk"] and all(result.ok for result in results.values())
+
+
+def test_replica_routing():
+    """
+    Транзакции только на чтение распределяются по репликам, а при их занятости или недоступности
+    выполняются на основной базе
+    """
+    primary, first, second = CountingFabric(), CountingFabric(), CountingFabric()
+    replicas = [make_pool(fabric, pool_size=1, max_overflow=0) for fabric in (first, second)]
+    dao = DAO(make_pool(primary), replicas=replicas, balancing="round_robin")
+
+    with dao.acquire(readonly=True) as tr:
+        assert tr.execute("select 1 as value", ())[0].value == 1
+    with dao.acquire(readonly=True):
+        pass
+    assert (primary.opened, first.opened, second.opened) == (0, 1, 1)
+
+    with dao.acquire(readonly=True), dao.acquire(readonly=True), dao.acquire(readonly=True):
+        assert [pool.checkedout for pool in replicas] == [1, 1]
+    assert primary.opened == 1
+
+    with dao.acquire():
+        assert [pool.checkedout for pool in replicas] == [0, 0]
+
+    def broken(**credentials):
+        raise sqlite3.OperationalError("unable to open database")
+
+    dao = DAO(make_pool(primary), replicas=[make_pool(broken)], failure_backoff=60)
+    with dao.acquire(readonly=True) as tr:
+        assert tr.execute("select 1 as value", ())[0].value == 1
+    assert dao._replicas.ordered() == []
+
+    with pytest.raises(ValueError):
+        DAO(make_pool(primary), replicas=replicas, balancing="random")
@@ -0,0 +1,477 @@
+import time
+import pytest
+import socket
+import asyncio
+import threading
+from concurrent import futures
+
+grpc = pytest.importorskip("grpc")
+from google.protobuf.wrappers_pb2 import StringValue  # noqa: E402
+
+from src.abstractclient.grpc import GRPCFactory, AsyncGRPCFactory  # noqa: E402
+from src.abstractclient.grpc.utils import format_message  # noqa: E402
+
+SERVICE: str = "test.Echo"
+
+
+class EchoStub:
+    """
+    Stub тестового сервиса, аналог сгенерированного protoc
+    """
+
+    def __init__(self, channel):
+        self.Echo = channel.unary_unary(
+            f"/{SERVICE}/Echo",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+        self.Missing = channel.unary_unary(
+            f"/{SERVICE}/Missing",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+        self.Flaky = channel.unary_unary(
+            f"/{SERVICE}/Flaky",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+        self.Split = channel.unary_stream(
+            f"/{SERVICE}/Split",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+        self.Join = channel.stream_unary(
+            f"/{SERVICE}/Join",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+        self.Upper = channel.stream_stream(
+            f"/{SERVICE}/Upper",
+            request_serializer=StringValue.SerializeToString,
+            response_deserializer=StringValue.FromString,
+        )
+
+
+def echo(request, context):
+    return StringValue(value=request.value)
+
+
+FLAKY_ATTEMPTS: dict = {}
+
+
+def flaky(request, context):
+    # Первые две попытки для каждого значения завершаются ошибкой UNAVAILABLE
+    FLAKY_ATTEMPTS[request.value] = FLAKY_ATTEMPTS.get(request.value, 0) + 1
+    if FLAKY_ATTEMPTS[request.value] < 3:
+        context.abort(grpc.StatusCode.UNAVAILABLE, "try again")
+    return StringValue(value=request.value)
+
+
+def split(request, context):
+    for char in request.value:
+        yield StringValue(value=char)
+
+
+def join(requests, context):
+    return StringValue(value="".join(request.value for request in requests))
+
+
+def upper(requests, context):
+    for request in requests:
+        yield StringValue(value=request.value.upper())
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(SERVICE, {
+        "Echo": grpc.unary_unary_rpc_method_handler(
+            echo, request_deserializer=StringValue.FromString, response_serializer=StringValue.SerializeToString
+        ),
+        "Flaky": grpc.unary_unary_rpc_method_handler(
+            flaky, request_deserializer=StringValue.FromString, response_serializer=StringValue.SerializeToString
+        ),
+        "Split": grpc.unary_stream_rpc_method_handler(
+            split, request_deserializer=StringValue.FromString, response_serializer=StringValue.SerializeToString
+        ),
+        "Join": grpc.stream_unary_rpc_method_handler(
+            join, request_deserializer=StringValue.FromString, response_serializer=StringValue.SerializeToString
+        ),
+        "Upper": grpc.stream_stream_rpc_method_handler(
+            upper, request_deserializer=StringValue.FromString, response_serializer=StringValue.SerializeToString
+        ),
+    }),))
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    yield f"localhost:{port}"
+    server.stop(None)
+
+
+class CountingProxy:
+    """
+    TCP прокси, считающий байты, отправленные клиентом на сервер
+    """
+
+    def __init__(self, target: str):
+        host, port = target.rsplit(":", 1)
+        self.target = (host, int(port))
+        self.sent: int = 0
+        self.listener = socket.create_server(("localhost", 0))
+        self.url = f"localhost:{self.listener.getsockname()[1]}"
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(self.target)
+            threading.Thread(target=self.pump, args=(client, upstream, True), daemon=True).start()
+            threading.Thread(target=self.pump, args=(upstream, client, False), daemon=True).start()
+
+    def pump(self, source: socket.socket, destination: socket.socket, count: bool):
+        try:
+            while True:
+                chunk = source.recv(65536)
+                if not chunk:
+                    break
+                if count:
+                    self.sent += len(chunk)
+                destination.sendall(chunk)
+        except OSError:
+            pass
+        finally:
+            destination.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def make_factory(url: str, **options) -> GRPCFactory:
+    return GRPCFactory({
+        "channels": [{"alias": "primary", "url": url, "timeout": 5, **options}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+
+
+def test_factory_state_is_per_instance(server):
+    """
+    Каналы и метаданные разных фабрик не должны пересекаться
+    """
+    first = make_factory(server, metadata={"x-first": "1"})
+    second = make_factory("localhost:1", alias="secondary", metadata={"x-second": "2"})
+
+    assert first.execute("echo", "Echo", StringValue(value="ok")).value == "ok"
+    with pytest.raises(grpc.RpcError):
+        second.execute("echo", "Echo", StringValue(value="ok"))
+
+
+@pytest.mark.parametrize("balancing", ["round_robin", "least_loaded"])
+def test_channel_pool_in_threads(server, balancing):
+    """
+    Параллельные вызовы распределяются по каналам пула
+    """
+    factory = make_factory(server, pool_size=4, balancing=balancing)
+    results: dict = {}
+
+    def call(number: int):
+        results[number] = factory.execute("echo", "Echo", StringValue(value=str(number))).value
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == {number: str(number) for number in range(50)}
+
+
+def test_async_factory_failover(server):
+    """
+    Асинхронная фабрика переключается на следующий канал при недоступности первого
+    """
+    factory = AsyncGRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 1},
+                     {"alias": "primary", "url": server, "timeout": 5, "pool_size": 2}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+
+    async def run():
+        try:
+            return await asyncio.gather(*[
+                factory.execute("echo", "Echo", StringValue(value=str(number))) for number in range(20)
+            ])
+        finally:
+            await factory.close()
+
+    assert [response.value for response in asyncio.run(run())] == [str(number) for number in range(20)]
+
+
+def test_execute_many_keeps_order_with_failover(server):
+    """
+    Пакетное выполнение возвращает ответы по порядку, переключая каналы для каждого запроса
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 1},
+                     {"alias": "primary", "url": server, "timeout": 5, "pool_size": 2}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    requests = (StringValue(value=str(number)) for number in range(200))
+
+    responses = factory.execute_many("echo", "Echo", requests, concurrency=16)
+
+    assert [response.value for response in responses] == [str(number) for number in range(200)]
+
+
+def test_streams_with_failover(server):
+    """
+    Потоковые вызовы переключаются на следующий канал до получения первого сообщения
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 1},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    words = [StringValue(value=word) for word in ("stream", "of", "words")]
+
+    assert [item.value for item in factory.execute_unary_stream("echo", "Split", StringValue(value="abc"))] == \
+        ["a", "b", "c"]
+    assert factory.execute_stream_unary("echo", "Join", iter(words)).value == "streamofwords"
+    assert [item.value for item in factory.execute_stream_stream("echo", "Upper", iter(words))] == \
+        ["STREAM", "OF", "WORDS"]
+
+
+def test_channel_compression_reduces_payload(server):
+    """
+    Сжатие канала уменьшает объем данных, переданных по сети
+    """
+    payload = StringValue(value="magnit " * 200000)
+    sent = {}
+    for compression in ("none", "gzip"):
+        proxy = CountingProxy(server)
+        factory = make_factory(proxy.url, compression=compression, max_send_message_length=4 * 1024 * 1024,
+                               keepalive_time_ms=10000, options={"grpc.http2.max_pings_without_data": 0})
+        assert factory.execute("echo", "Echo", payload).value == payload.value
+        factory.close()
+        proxy.close()
+        sent[compression] = proxy.sent
+
+    assert sent["gzip"] * 10 < sent["none"]
+
+
+def test_channel_max_send_message_length(server):
+    """
+    Сообщение больше заданного ограничения не отправляется
+    """
+    factory = make_factory(server, max_send_message_length=1024)
+    with pytest.raises(grpc.RpcError) as e:
+        factory.execute("echo", "Echo", StringValue(value="x" * 2048))
+    assert e.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+
+
+def test_channel_options_must_be_grpc_args(server):
+    with pytest.raises(ValueError):
+        make_factory(server, options={"max_send_message_length": 1024})
+
+
+def test_metrics(server):
+    """
+    Перехватчики учитывают длительность, размер данных и статусы ответов
+    """
+    factory = make_factory(server)
+    request = StringValue(value="metrics")
+    factory.execute("echo", "Echo", request)
+    with pytest.raises(grpc.RpcError):
+        factory.execute("echo", "Missing", request)
+
+    snapshot = factory.metrics.snapshot()
+    method = snapshot["methods"][f"/{SERVICE}/Echo"]
+    assert method["codes"] == {"OK": 1}
+    assert method["latency"]["count"] == 1
+    assert method["request_bytes"] == request.ByteSize()
+    assert method["response_bytes"] == request.ByteSize()
+    assert snapshot["methods"][f"/{SERVICE}/Missing"]["codes"] == {"UNIMPLEMENTED": 1}
+
+
+def test_metrics_failover():
+    factory = GRPCFactory({
+        "channels": [{"alias": "first", "url": "localhost:1", "timeout": 1},
+                     {"alias": "second", "url": "localhost:2", "timeout": 1}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    with pytest.raises(grpc.RpcError):
+        factory.execute("echo", "Echo", StringValue(value="failover"))
+
+    assert factory.metrics.snapshot()["failovers"] == {"echo/Echo": 1}
+
+
+def test_ready_channels_go_first(server):
+    """
+    Готовый канал выбирается раньше недоступного, несмотря на порядок в конфигурации
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 5},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    deadline = time.monotonic() + 5
+    while factory._ordered_channels()[0][0] != "primary" and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert factory.execute("echo", "Echo", StringValue(value="ready")).value == "ready"
+    assert factory.metrics.snapshot()["failovers"] == {}
+
+
+def test_wait_for_ready_fails_over_fast(server):
+    """
+    Ожидание готовности канала ограничено ready_timeout, после чего запрос уходит в следующий канал
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 30, "wait_for_ready": True,
+                      "ready_timeout": 0.2},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    start = time.monotonic()
+    assert factory.execute("echo", "Echo", StringValue(value="fast")).value == "fast"
+    assert time.monotonic() - start < 5
+
+
+def test_async_wait_for_ready_fails_over_fast(server):
+    """
+    Асинхронная фабрика ждет готовности канала не дольше ready_timeout и переходит к следующему каналу
+    """
+    # Порт принимает TCP подключения, но не отвечает, канал остается в состоянии CONNECTING
+    silent = socket.create_server(("localhost", 0))
+    factory = AsyncGRPCFactory({
+        "channels": [{"alias": "silent", "url": f"localhost:{silent.getsockname()[1]}", "timeout": 30,
+                      "wait_for_ready": True, "ready_timeout": 0.2},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+
+    async def run():
+        try:
+            response = await factory.execute("echo", "Echo", StringValue(value="fast"))
+            split = [item.value async for item in factory.execute_unary_stream("echo", "Split", StringValue(value="ab"))]
+            return response.value, split
+        finally:
+            await factory.close()
+
+    start = time.monotonic()
+    try:
+        assert asyncio.run(run()) == ("fast", ["a", "b"])
+    finally:
+        silent.close()
+    assert time.monotonic() - start < 5
+    assert factory.metrics.snapshot()["failovers"] == {"echo/Echo": 1}
+
+
+def test_execute_many_fails_over_not_ready_channel(server):
+    """
+    Неготовый канал в execute_many переключает на следующий канал только свой запрос, а не весь пакет
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 30, "wait_for_ready": True,
+                      "ready_timeout": 0.1},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    requests = [StringValue(value=str(number)) for number in range(3)]
+    assert [response.value for response in factory.execute_many("echo", "Echo", requests)] == ["0", "1", "2"]
+
+    broken = make_factory("localhost:1", wait_for_ready=True, ready_timeout=0.1)
+    results = broken.execute_many("echo", "Echo", requests, return_exceptions=True)
+    assert len(results) == 3 and all(isinstance(result, grpc.RpcError) for result in results)
+
+
+def test_format_message_is_bounded():
+    message = StringValue(value="x" * 100000)
+    text = format_message(message, limit=100)
+    assert text.startswith(f"[{message.ByteSize()}b]")
+    assert len(text) < 150
+
+
+def test_retry_policy(server):
+    """
+    Политика retry из настроек stubs повторяет запрос в транспорте, без переключения каналов
+    """
+    factory = GRPCFactory({
+        "channels": [{"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub", "service": SERVICE,
+                   "methods": {"Flaky": {"retry": {"max_attempts": 3, "initial_backoff": 0.01,
+                                                   "retryable_status_codes": ["unavailable"]}}}}],
+    })
+    assert factory.execute("echo", "Flaky", StringValue(value="retry")).value == "retry"
+    assert FLAKY_ATTEMPTS["retry"] == 3
+
+    without_retry = make_factory(server)
+    with pytest.raises(grpc.RpcError) as e:
+        without_retry.execute("echo", "Flaky", StringValue(value="no retry"))
+    assert e.value.code() == grpc.StatusCode.UNAVAILABLE
+
+
+def test_retry_and_hedging_are_exclusive(server):
+    with pytest.raises(ValueError):
+        GRPCFactory({
+            "channels": [{"alias": "primary", "url": server}],
+            "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub", "service": SERVICE,
+                       "retry": {"max_attempts": 3}, "hedging": {"max_attempts": 3}}],
+        })
+
+
+def test_async_streams_with_failover(server):
+    """
+    Потоковые вызовы асинхронной фабрики переключаются на следующий канал до получения первого сообщения
+    """
+    factory = AsyncGRPCFactory({
+        "channels": [{"alias": "broken", "url": "localhost:1", "timeout": 1},
+                     {"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    words = [StringValue(value=word) for word in ("stream", "of", "words")]
+
+    async def produce():
+        for word in words:
+            yield word
+
+    async def run():
+        try:
+            split = [item.value async for item in factory.execute_unary_stream("echo", "Split", StringValue(value="abc"))]
+            joined = await factory.execute_stream_unary("echo", "Join", produce())
+            upper = [item.value async for item in factory.execute_stream_stream("echo", "Upper", iter(words))]
+            return split, joined.value, upper
+        finally:
+            await factory.close()
+
+    assert asyncio.run(run()) == (["a", "b", "c"], "streamofwords", ["STREAM", "OF", "WORDS"])
+
+
+def test_async_stream_metrics(server):
+    """
+    Перехватчик асинхронной фабрики учитывает и потоковые вызовы
+    """
+    factory = AsyncGRPCFactory({
+        "channels": [{"alias": "primary", "url": server, "timeout": 5}],
+        "stubs": [{"alias": "echo", "module": __name__, "stub": "EchoStub"}],
+    })
+    words = [StringValue(value=word) for word in ("stream", "of", "words")]
+
+    async def run():
+        try:
+            [item async for item in factory.execute_unary_stream("echo", "Split", StringValue(value="abc"))]
+            await factory.execute_stream_unary("echo", "Join", iter(words))
+            [item async for item in factory.execute_stream_stream("echo", "Upper", iter(words))]
+            await asyncio.sleep(0.1)
+        finally:
+            await factory.close()
+
+    asyncio.run(run())
+    methods = factory.metrics.snapshot()["methods"]
+    sent = sum(word.ByteSize() for word in words)
+    assert methods[f"/{SERVICE}/Split"]["codes"] == {"OK": 1}
+    assert methods[f"/{SERVICE}/Join"]["request_bytes"] == sent
+    assert methods[f"/{SERVICE}/Join"]["response_bytes"] == StringValue(value="streamofwords").ByteSize()
+    assert methods[f"/{SERVICE}/Upper"]["request_bytes"] == sent
+    assert methods[f"/{SERVICE}/Upper"]["latency"]["count"] == 1
@@ -0,0 +1,320 @@
+import io
+import os
+import time
+import email
+import pytest
+from email import policy
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from smtplib import SMTPRecipientsRefused
+
+from src.abstractclient import smtp
+from src.abstractclient.smtp import SMTPFactory, readdress
+from src.abstractclient.smtp.outbox import SMTPOutbox
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Минимальный SMTP сервер: принимает письма и считает подключения
+    """
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b".\r\n", b""):
+                        break
+                    data.append(chunk)
+                with server.lock:
+                    server.messages.append(b"".join(data))
+                self.reply("250 OK")
+            elif command == "RCPT" and "refused" in line:
+                self.reply("550 no such user")
+            elif command == "RSET":
+                with server.lock:
+                    server.resets += 1
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections: int = 0
+        self.resets: int = 0
+        self.messages: list = []
+
+
+@pytest.fixture()
+def server():
+    server = SMTPServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_factory(server: SMTPServer, **options) -> SMTPFactory:
+    return SMTPFactory({"sessions": [{"alias": "primary", "host": "localhost", "port": server.server_address[1],
+                                      **options}]})
+
+
+def test_send_reuses_connection(server):
+    """
+    Последовательные письма отправляются через одно подключение
+    """
+    factory = make_factory(server)
+    for number in range(10):
+        factory.send("robot@magnit.ru", "store@magnit.ru", f"Отчет {number}", "Текст")
+    factory.close()
+
+    assert len(server.messages) == 10
+    assert server.connections == 1
+
+
+def test_send_recycles_old_connection(server):
+    """
+    Подключение старше max_age открывается заново
+    """
+    factory = make_factory(server, max_age=0)
+    for number in range(3):
+        factory.send("robot@magnit.ru", "store@magnit.ru", f"Отчет {number}", "Текст")
+    factory.close()
+
+    assert len(server.messages) == 3
+    assert server.connections == 3
+
+
+def test_send_keeps_connection_after_rejection(server):
+    """
+    Письмо, отклоненное сервером, не закрывает подключение: транзакция сбрасывается командой RSET
+    """
+    factory = make_factory(server)
+    with pytest.raises(SMTPRecipientsRefused):
+        factory.send("robot@magnit.ru", "refused@magnit.ru", "Отчет", "Текст")
+    factory.send("robot@magnit.ru", "store@magnit.ru", "Отчет", "Текст")
+    factory.close()
+
+    assert len(server.messages) == 1
+    assert server.connections == 1
+    assert server.resets >= 1
+
+
+def test_send_many_in_parallel(server):
+    """
+    Пакет писем отправляется параллельно через ограниченное кол-во подключений
+    """
+    factory = make_factory(server, pool_size=4)
+    template = factory.build_message("robot@magnit.ru", [], "Остатки", "Отчет во вложении",
+                                     [("report.csv", "text/csv", io.BytesIO(b"article;qty\n1;10\n"))])
+    recipients = [f"store{number}@magnit.ru" for number in range(20)]
+
+    results = factory.send_many(readdress(template, mailto) for mailto in recipients)
+    factory.close()
+
+    assert [result.msg["To"] for result in results] == recipients
+    assert all(result.ok and result.session == "primary" for result in results)
+    assert len(server.messages) == 20
+    assert server.connections <= 4
+    assert template["To"] == ""
+
+
+def test_send_many_fallback_per_message(server):
+    """
+    Письмо, не отправленное через первую сессию, отправляется через следующую
+    """
+    factory = SMTPFactory({"sessions": [
+        {"alias": "broken", "host": "localhost", "port": 1},
+        {"alias": "secondary", "host": "localhost", "port": server.server_address[1]},
+    ]})
+    messages = [factory.build_message("robot@magnit.ru", "store@magnit.ru", f"Отчет {number}") for number in range(5)]
+
+    results = factory.send_many(messages, workers=2)
+
+    assert all(result.ok and result.session == "secondary" for result in results)
+    assert len(server.messages) == 5
+
+
+def test_send_many_workers_match_connections(server, monkeypatch, caplog):
+    """
+    Кол-во отправителей по умолчанию равно суммарному размеру пулов сессий и не превышает его
+    """
+    executors: list = []
+
+    class Executor(ThreadPoolExecutor):
+        def __init__(self, max_workers, **kwargs):
+            executors.append(max_workers)
+            super().__init__(max_workers, **kwargs)
+
+    monkeypatch.setattr(smtp, "ThreadPoolExecutor", Executor)
+    factory = SMTPFactory({"sessions": [
+        {"alias": "primary", "host": "localhost", "port": server.server_address[1], "pool_size": 2},
+        {"alias": "secondary", "host": "localhost", "port": server.server_address[1], "pool_size": 3},
+    ]})
+    messages = [factory.build_message("robot@magnit.ru", "store@magnit.ru", f"Отчет {number}") for number in range(5)]
+
+    factory.send_many(messages)
+    factory.send_many(messages, workers=10)
+    factory.close()
+
+    assert executors == [5, 5]
+    assert "будет уменьшено" in caplog.text
+    assert len(server.messages) == 10
+
+
+def test_outbox_drains_spool(server, tmp_path):
+    """
+    Письма из очереди на диске отправляются при разборе очереди, в том числе новым экземпляром фабрики
+    """
+    config = {"sessions": [{"alias": "primary", "host": "localhost", "port": server.server_address[1]}],
+              "outbox": {"path": str(tmp_path), "autostart": False}}
+    factory = SMTPFactory(config)
+    for number in range(3):
+        factory.enqueue("robot@magnit.ru", "store@magnit.ru", f"Отчет {number}", "Текст")
+    factory.close()
+
+    assert server.connections == 0
+    assert len(factory.outbox.pending) == 3
+
+    restarted = SMTPFactory(config)
+    assert restarted.outbox.drain() == 3
+    restarted.close()
+
+    assert len(server.messages) == 3
+    assert restarted.outbox.pending == []
+
+
+def test_outbox_retries_with_backoff(tmp_path):
+    """
+    Неотправленное письмо откладывается, а после исчерпания попыток переносится в failed
+    """
+    factory = SMTPFactory({"sessions": [{"alias": "broken", "host": "localhost", "port": 1}],
+                           "outbox": {"path": str(tmp_path), "autostart": False, "max_attempts": 2, "backoff": 0}})
+    factory.enqueue("robot@magnit.ru", "store@magnit.ru", "Отчет", "Текст")
+
+    assert factory.outbox.drain() == 0
+    assert factory.outbox.pending[0].split("-")[1] == "1"
+
+    assert factory.outbox.drain() == 0
+    assert factory.outbox.pending == []
+    assert len(factory.outbox.failed) == 1
+
+
+def test_outbox_keeps_enqueue_order(tmp_path):
+    """
+    Письма, помещенные в очередь в одну миллисекунду, отправляются в порядке помещения
+    """
+    sent = []
+    outbox = SMTPOutbox(str(tmp_path), lambda msg: sent.append(msg["Subject"]) or "primary")
+    subjects = [f"Отчет {number}" for number in range(50)]
+    for subject in subjects:
+        msg = email.message.EmailMessage()
+        msg["Subject"] = subject
+        outbox.enqueue(msg)
+
+    assert outbox.drain() == 50
+    assert sent == subjects
+
+
+def test_outbox_requeues_unexpected_error(tmp_path):
+    """
+    Письмо, отправка которого завершилась непредвиденной ошибкой, возвращается в очередь
+    """
+    def sender(msg):
+        raise ValueError("broken message")
+
+    outbox = SMTPOutbox(str(tmp_path), sender, max_attempts=2, backoff=0)
+    outbox.enqueue(email.message.EmailMessage())
+
+    assert outbox.drain() == 0
+    assert outbox.pending[0].split("-")[1] == "1"
+    assert not any(name.endswith(".sending") for name in os.listdir(tmp_path))
+
+    assert outbox.drain() == 0
+    assert outbox.pending == [] and len(outbox.failed) == 1
+
+
+def test_outbox_stop_waits_for_slow_send(tmp_path):
+    """
+    Поток, не остановившийся за время ожидания, завершает текущую отправку и не берет следующее письмо
+    """
+    sending, release = threading.Event(), threading.Event()
+    sent = []
+
+    def sender(msg):
+        sending.set()
+        release.wait(5)
+        sent.append(msg["Subject"])
+        return "slow"
+
+    outbox = SMTPOutbox(str(tmp_path), sender, poll_interval=0.05)
+    for subject in ("first", "second"):
+        msg = email.message.EmailMessage()
+        msg["Subject"] = subject
+        outbox.enqueue(msg)
+    outbox.start()
+    assert sending.wait(5)
+
+    outbox.stop(timeout=0.05)
+    release.set()
+    wait_until(lambda: not any(name.endswith(".sending") for name in os.listdir(tmp_path)))
+    time.sleep(0.2)
+    assert sent == ["first"] and len(outbox.pending) == 1
+
+    outbox.start()
+    wait_until(lambda: not outbox.pending)
+    outbox.stop(timeout=5)
+    assert sent == ["first", "second"]
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_attachment_encoded_once(server, tmp_path):
+    """
+    Вложение с диска кодируется один раз и доходит до получателя без изменений
+    """
+    data = os.urandom(200000)
+    report = tmp_path / "report.bin"
+    report.write_bytes(data)
+
+    factory = make_factory(server)
+    for number in range(3):
+        template = factory.build_message("robot@magnit.ru", [], f"Отчет {number}", "Текст",
+                                         [("Отчет.bin", "application/octet-stream", str(report))])
+        factory.send_message(readdress(template, "store@magnit.ru"))
+    factory.close()
+
+    assert (factory.attachments.misses, factory.attachments.hits) == (1, 2)
+    received = email.message_from_bytes(server.messages[-1], policy=policy.default)
+    attachment = next(received.iter_attachments())
+    assert attachment.get_filename() == "Отчет.bin"
+    assert attachment.get_content() == data
@@ -0,0 +1,219 @@
+import sqlite3
+import pytest
+from array import array
+from decimal import Decimal
+
+from src.abstractclient.dba.transaction import Transaction, FetchFloatColumns, make_model_class, pretty_log, \
+    MAX_DB_ANSWER_LENGTH
+from src.abstractclient.dba import transaction
+from src.abstractclient.dba.statements import StatementCache
+from src.abstractclient.dba.profiling import StatementRegistry, normalize_statement
+
+
+@pytest.fixture()
+def connection():
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    connection.execute("create table goods (id integer primary key, name text, price real)")
+    connection.executemany("insert into goods (id, name, price) values (?, ?, ?)",
+                           [(number, f"Товар {number}", number * 1.5) for number in range(1, 101)])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def test_model_class_cached(connection):
+    """
+    Класс строки создается один раз для одного набора колонок
+    """
+    tr = Transaction(connection)
+    first = tr.execute("select id, name from goods where id = ?", (1,), fetch=Transaction.ONE)
+    second = tr.execute("select ID, NAME from goods where id = ?", (2,), fetch=Transaction.ONE)
+    rows = tr.execute("select id, name from goods order by id", ())
+
+    assert type(first) is type(second) is type(rows[0])
+    assert (first.id, first.name) == (1, "Товар 1")
+    assert rows[-1].asdict() == {"id": 100, "name": "Товар 100"}
+    assert make_model_class((("ID", None), ("PRICE", float))) is make_model_class((("id", None), ("price", float)))
+
+
+def test_iter_streams_rows(connection):
+    """
+    Потоковая выборка читает строки блоками и фиксирует транзакцию после перебора
+    """
+    tr = Transaction(connection, auto=True)
+    tr.execute("insert into goods (id, name, price) values (?, ?, ?)", (101, "Новый", 1.0), fetch=Transaction.NOTHING)
+    rows = tr.execute("select id, price from goods order by id", (), fetch=Transaction.ITER)
+
+    assert next(rows).id == 1
+    assert sum(1 for _ in rows) == 100
+    assert not connection.in_transaction
+
+
+def test_iter_closed_early(connection):
+    """
+    Прерванный перебор закрывает курсор и откатывает транзакцию, не начатый перебор закрывается с транзакцией
+    """
+    tr = Transaction(connection, auto=True, statements=StatementCache(connection, 10))
+    rows = tr.execute("update goods set price = 0 where id = 1 returning id", (), fetch=Transaction.ITER)
+    assert next(rows).id == 1
+    rows.close()
+
+    assert not connection.in_transaction
+    assert tr.execute("select price from goods where id = 1", (), fetch=Transaction.ONE).price == 1.5
+
+    tr.execute("update goods set price = 0 where id = 2 returning id", (), fetch=Transaction.ITER)
+    idle = len(tr._statements)
+    assert connection.in_transaction
+    tr.close_streams()
+
+    assert not connection.in_transaction and len(tr._statements) == idle + 1
+    assert tr.execute("select price from goods where id = 2", (), fetch=Transaction.ONE).price == 3.0
+
+
+class ListCursor:
+    """
+    Курсор над списком строк с описанием колонок в стиле fdb
+    """
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.arraysize = 1
+        self.rows = rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+def test_columns(connection):
+    """
+    Выборка по колонкам возвращает массивы для чисел и списки для строк и колонок с NULL
+    """
+    description = (("ID", int, None, None, 10, 0, False), ("NAME", str), ("PRICE", Decimal), ("QTY", Decimal))
+    rows = [(number, f"Товар {number}", Decimal("1.5") * number, None if number == 3000 else number)
+            for number in range(1, 3001)]
+    columns = Transaction(connection).fetch(ListCursor(description, rows), Transaction.COLUMNS)
+
+    assert isinstance(columns["id"], array) and columns["id"].typecode == "q"
+    assert sum(columns["id"]) == 4501500
+    assert isinstance(columns["price"], list) and columns["price"][1] == Decimal("3.0")
+    assert columns["name"][0] == "Товар 1"
+    assert isinstance(columns["qty"], list) and len(columns["qty"]) == 3000 and columns["qty"][-1] is None
+
+    columns = Transaction(connection).fetch(ListCursor(description, rows), FetchFloatColumns)
+    assert isinstance(columns["price"], array) and columns["price"][1] == 3.0
+
+
+def test_tuples(connection):
+    """
+    Кортежи драйвера и именованные кортежи с классом, общим для одного набора колонок
+    """
+    tr = Transaction(connection)
+    tuples = tr.execute("select id, name from goods order by id", (), fetch=Transaction.TUPLES)
+    records = tr.execute("select id, name from goods order by id", (), fetch=Transaction.RECORDS)
+    again = tr.execute("select ID, NAME from goods where id = 1", (), fetch=Transaction.RECORDS)
+
+    assert tuples[0] == (1, "Товар 1")
+    assert records[0].id == 1 and records[0].name == "Товар 1" and records[0] == tuples[0]
+    assert type(again[0]) is type(records[0])
+
+
+def test_statement_cache(connection):
+    """
+    Курсор повторного запроса берется из кеша подключения, курсор запроса с ошибкой закрывается
+    """
+    cache = StatementCache(connection, size=2)
+    tr = Transaction(connection, statements=cache)
+    for number in range(1, 6):
+        assert tr.execute("select name from goods where id = ?", (number,), fetch=Transaction.ONE).name == \
+               f"Товар {number}"
+    tr.execute("select count(*) as total from goods", ())
+    tr.execute("select max(id) as last from goods", ())
+    with pytest.raises(Exception):
+        tr.execute("select missing from goods", ())
+
+    assert cache.stats.snapshot() == {"hits": 4, "misses": 4, "evictions": 1, "invalidations": 0}
+    assert len(cache) == 2
+
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_bulk(connection):
+    """
+    Массовая запись читает поток строк пакетами и фиксирует каждые commit_every пакетов
+    """
+    progress = []
+    rows = ((number, f"Новый {number}", 0.5) for number in range(1001, 3501))
+    stats = Transaction(connection, auto=True).bulk("insert into goods (id, name, price) values (?, ?, ?)", rows,
+                                                    batch_size=1000, commit_every=2,
+                                                    progress=lambda current: progress.append(current.rows))
+
+    assert (stats.rows, stats.batches, stats.commits) == (2500, 3, 2)
+    assert progress == [1000, 2000, 2500]
+    assert Transaction(connection).execute("select count(*) as total from goods", (), Transaction.ONE).total == 2600
+
+
+def test_profiling(connection, caplog, monkeypatch):
+    """
+    Выполнения запроса учитываются по тексту без параметров, медленные запросы пишутся в журнал с параметрами
+    """
+    profiler = StatementRegistry(slow_threshold=0)
+    tr = Transaction(connection, profiler=profiler)
+    for number in (1, 2, 3):
+        tr.execute(f"select id, name from goods where id <= {number}", ())
+    rows = tr.execute("select id, name, price from goods where id in (?, ?)", (1, 2), fetch=Transaction.ITER)
+    assert len(list(rows)) == 2
+    with pytest.raises(sqlite3.OperationalError):
+        tr.execute("select missing from goods", ())
+
+    assert normalize_statement("select *\n  from goods -- товары\n where name = 'a''b' and id in (1, 2, :id)") == \
+        "select * from goods where name = ? and id in (...)"
+
+    stats = {item["statement"]: item for item in profiler.snapshot()}
+    assert set(stats) == {"select id, name from goods where id <= ?", "select id, name, price from goods where id in (...)",
+                          "select missing from goods"}
+    select = stats["select id, name from goods where id <= ?"]
+    assert (select["calls"], select["rows"], select["errors"]) == (3, 6, 0)
+    assert select["bytes"] > 0 and select["execute"]["count"] == select["fetch"]["count"] == 3
+    assert stats["select id, name, price from goods where id in (...)"]["rows"] == 2
+    assert stats["select missing from goods"]["errors"] == 1
+    assert profiler.top(1, key="calls")[0]["statement"] == "select id, name from goods where id <= ?"
+    assert "with params: (1, 2)" in caplog.text
+
+    profiler = StatementRegistry(max_statements=1)
+    tr = Transaction(connection, profiler=profiler)
+    tr.execute("select 1 as one", ())
+    tr.execute("select id from goods where id = 1", ())
+    assert sorted(item["statement"] for item in profiler.snapshot()) == ["<other>", "select ? as one"]
+
+    # Выключенный профайлер не оценивает результат выборки
+    monkeypatch.setattr(transaction, "result_size", None)
+    profiler.enabled = False
+    assert len(tr.execute("select id from goods", ())) == 100
+    assert len(list(tr.execute("select id from goods", (), fetch=Transaction.ITER))) == 100
+    assert len(Transaction(connection, profiler=None).execute("select id from goods", ())) == 100
+
+
+def test_pretty_log_bounded(connection):
+    """
+    В лог выводятся строки результата в пределах MAX_LOG_LENGTH и кол-во остальных строк
+    """
+    tr = Transaction(connection)
+    rows = tr.execute("select id, name, price from goods order by id", ())
+    records = tr.execute("select id, name from goods order by id", (), fetch=Transaction.RECORDS)
+    log = pretty_log(rows * 1000)
+
+    assert len(log) < MAX_DB_ANSWER_LENGTH + 200
+    assert '{"id": 1, "name": "Товар 1", "price": 1.5}' in log
+    assert "more rows of 100000" in log
+    assert '{"id": 100, "name": "Товар 100"}' in pretty_log(records[-1:])
+    assert "[1, 2]" in pretty_log([(1, 2)])
+    assert "100 rows in columns: id, name" in pretty_log(tr.execute("select id, name from goods", (),
+                                                                    fetch=Transaction.COLUMNS))
+
+    huge = pretty_log(tr.execute("select ? as text", ("x" * MAX_DB_ANSWER_LENGTH * 2,), fetch=Transaction.ONE))
+    assert len(huge) < MAX_DB_ANSWER_LENGTH + 200